@@ -1,234 +1,302 @@
 import os
-import shutil
 import yaml
 import random
-
-def filter_dataset(original_data_yaml, selected_classes, new_dataset_dir):
+import argparse
+import numpy as np
+from materialize import add_link_mode_argument
+from copyengine import CopyExecutor, add_copy_workers_argument, COPY_WORKERS
+from imageindex import ImageIndex, list_label_files, report_orphans
+from classtable import compile_class_table, parse_label_lines, remap_label_texts
+from datasetindex import DatasetIndex
+from instrument import add_metrics_arguments, begin_stage, start_metrics, finish_metrics
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png']
+
+# How oversampled images end up in the balanced split:
+#   copy    - physical '{name}_aug_{i}' image + label copies (or links, see --link-mode)
+#   list    - '<split>.txt' image list with repeated entries, referenced from data.yaml
+#   weights - '<split>_weights.txt' with one sampling weight per image for a weighted sampler
+OVERSAMPLE_MODES = ['copy', 'list', 'weights']
+
+# --- Plan-then-execute: filter + balance without copy-then-delete ---
+
+def plan_filtered_splits(original_data_yaml, selected_classes):
     """
-    Filters a YOLO dataset to include only selected classes.
+    Works out, in memory, which label files survive the class filter and their new contents.
 
-    Args:
-        original_data_yaml (dict): The loaded content of the original data.yaml file.
-        selected_classes (list): A list of class names to keep.
-        new_dataset_dir (str): The path to save the new filtered dataset.
-    """
-    # --- 1. Setup and Configuration ---
-    print("Starting dataset filtering process...")
+    Reads every label file exactly once; nothing is written.
 
+    Returns:
+        (list, dict): the new class names and, per output split, a list of
+        entries (stem, label_path, label_text, new_text, image_path or None).
+    """
     original_names = original_data_yaml['names']
-    
-    # Create a mapping from old class index to new class index
-    # and a list of the original indices we want to keep.
-    selected_class_indices_original = []
-    index_map = {}
-    new_names = []
-    
-    for i, name in enumerate(original_names):
-        if name in selected_classes:
-            selected_class_indices_original.append(i)
-            index_map[i] = len(new_names)
-            new_names.append(name)
-
+    new_names = [name for name in original_names if name in selected_classes]
     if not new_names:
         print("Error: None of the selected classes were found in the original dataset.")
-        return None
+        return None, None
 
+    # Compiled old index -> new index table; unselected classes map to -1
+    class_table = compile_class_table(original_names, {name: i for i, name in enumerate(new_names)})
+    index_map = {old: int(new) for old, new in enumerate(class_table.tolist()) if new >= 0}
     print(f"Selected classes to keep: {new_names}")
-    print(f"Original indices: {selected_class_indices_original}")
+    print(f"Original indices: {list(index_map)}")
     print(f"New index mapping (old_index -> new_index): {index_map}")
 
-    # --- 2. Create New Directory Structure ---
-    print(f"\nCreating new dataset directory at: {new_dataset_dir}")
-    for split in ['train', 'valid', 'test']:
-        os.makedirs(os.path.join(new_dataset_dir, split, 'images'), exist_ok=True)
-        os.makedirs(os.path.join(new_dataset_dir, split, 'labels'), exist_ok=True)
-
-    # --- 3. Process Each Data Split (train, valid, test) ---
+    splits = {}
     for split in ['train', 'val', 'test']:
         yaml_split_key = 'valid' if split == 'val' and 'valid' in original_data_yaml else split
-        
         if yaml_split_key not in original_data_yaml:
             print(f"Warning: Split '{yaml_split_key}' not found in YAML. Skipping.")
             continue
 
         original_image_dir = original_data_yaml[yaml_split_key]
         original_label_dir = original_image_dir.replace('images', 'labels')
-
         output_split_name = 'valid' if split == 'val' else split
-        new_image_dir = os.path.join(new_dataset_dir, output_split_name, 'images')
-        new_label_dir = os.path.join(new_dataset_dir, output_split_name, 'labels')
-        
-        print(f"\nProcessing '{yaml_split_key}' split...")
-        print(f"Original labels directory: {original_label_dir}")
-
         if not os.path.isdir(original_label_dir):
             print(f"Warning: Label directory not found for '{split}' split. Skipping.")
             continue
 
-        image_copy_count = 0
-        for label_filename in os.listdir(original_label_dir):
-            if not label_filename.endswith('.txt'):
+        label_files = list_label_files(original_label_dir)
+        image_index = ImageIndex(original_image_dir, IMAGE_EXTENSIONS)
+        report_orphans(image_index.match_labels(label_files), yaml_split_key)
+
+        label_texts = []
+        for label_filename in label_files:
+            with open(os.path.join(original_label_dir, label_filename), 'r') as f:
+                label_texts.append(f.read())
+        new_texts, _, _ = remap_label_texts(label_texts, class_table)
+
+        entries = []
+        for label_filename, label_text, new_text in zip(label_files, label_texts, new_texts):
+            if not new_text:
                 continue
+            stem = os.path.splitext(label_filename)[0]
+            entries.append((stem, os.path.join(original_label_dir, label_filename), label_text, new_text,
+                            image_index.path(stem)))
+        splits[output_split_name] = entries
+        print(f"Planned '{output_split_name}': {len(entries)} of {len(label_files)} label files keep a selected class.")
+    return new_names, splits
+
+def print_distribution(title, counts, names):
+    print(title)
+    for i, name in enumerate(names):
+        print(f"  - {name}: {int(counts[i])} images")
 
-            original_label_path = os.path.join(original_label_dir, label_filename)
-            
-            with open(original_label_path, 'r') as f:
-                lines = f.readlines()
-            
-            new_annotations = []
-            contains_selected_class = False
-            for line in lines:
-                parts = line.strip().split()
-                if not parts: continue
-                
-                original_class_index = int(parts[0])
-                
-                if original_class_index in selected_class_indices_original:
-                    contains_selected_class = True
-                    new_class_index = index_map[original_class_index]
-                    new_annotations.append(f"{new_class_index} {' '.join(parts[1:])}")
-
-            if contains_selected_class:
-                new_label_path = os.path.join(new_label_dir, label_filename)
-                with open(new_label_path, 'w') as f:
-                    f.write('\n'.join(new_annotations))
-
-                image_name = os.path.splitext(label_filename)[0]
-                
-                found_image = False
-                for ext in ['.jpg', '.jpeg', '.png']:
-                    original_image_path = os.path.join(original_image_dir, image_name + ext)
-                    if os.path.exists(original_image_path):
-                        new_image_path = os.path.join(new_image_dir, image_name + ext)
-                        shutil.copy2(original_image_path, new_image_path)
-                        image_copy_count += 1
-                        found_image = True
-                        break
-                
-                if not found_image:
-                    print(f"Warning: Image for label '{label_filename}' not found.")
-
-        print(f"Finished processing '{split}'. Copied {image_copy_count} images and their labels.")
-
-    # --- 4. Generate New data.yaml File ---
-    new_yaml_path = os.path.join(new_dataset_dir, 'data.yaml')
-    new_data_yaml = {
-        'path': os.path.abspath(new_dataset_dir),
-        'train': 'train/images', 'val': 'valid/images', 'test': 'test/images',
-        'names': new_names
-    }
-    with open(new_yaml_path, 'w') as f:
-        yaml.dump(new_data_yaml, f, sort_keys=False, default_flow_style=False)
+def plan_balance(entries, names, min_images, max_images):
+    """
+    Plans under- and oversampling of one split on the in-memory entries,
+    on arrays instead of by deleting and re-scanning files.
 
-    print(f"\nSuccessfully created new dataset at '{new_dataset_dir}'")
-    print(f"New configuration file saved at '{new_yaml_path}'")
-    return new_names
+    Returns:
+        (np.ndarray, dict, np.ndarray): a keep mask over `entries`, the
+        oversampled duplicates as {new_stem: entry index} and the final
+        images per class.
+    """
+    class_ids, _, line_counts, _ = parse_label_lines([entry[3] for entry in entries])
+    # Image ids of the index are the entry positions
+    index = DatasetIndex(['plan'])
+    index.add_split('plan', [entry[0] for entry in entries], np.repeat(np.arange(len(entries)), line_counts), class_ids)
+    index.finalize(num_classes=len(names))
 
-# --- Balancing Helper Functions ---
-
-def find_image_path(image_name_no_ext, image_dir):
-    """Finds the full path of an image given its name without extension."""
-    for ext in ['.jpg', '.jpeg', '.png']:
-        path = os.path.join(image_dir, f"{image_name_no_ext}{ext}")
-        if os.path.exists(path):
-            return path
-    return None
-
-def delete_image_and_label(image_name_no_ext, image_dir, label_dir):
-    """Deletes an image and its corresponding label file."""
-    try:
-        label_path = os.path.join(label_dir, f"{image_name_no_ext}.txt")
-        if os.path.exists(label_path):
-            os.remove(label_path)
-        
-        image_path = find_image_path(image_name_no_ext, image_dir)
-        if image_path:
-            os.remove(image_path)
-    except OSError as e:
-        print(f"Error deleting file {image_name_no_ext}: {e}")
-
-
-def copy_image_and_label(original_name_no_ext, new_name_no_ext, image_dir, label_dir):
-    """Copies an image and its label file to new names."""
-    try:
-        # Copy label
-        original_label_path = os.path.join(label_dir, f"{original_name_no_ext}.txt")
-        new_label_path = os.path.join(label_dir, f"{new_name_no_ext}.txt")
-        if os.path.exists(original_label_path):
-            shutil.copy2(original_label_path, new_label_path)
-            
-        # Copy image
-        original_image_path = find_image_path(original_name_no_ext, image_dir)
-        if original_image_path:
-            ext = os.path.splitext(original_image_path)[1]
-            new_image_path = os.path.join(image_dir, f"{new_name_no_ext}{ext}")
-            shutil.copy2(original_image_path, new_image_path)
-    except OSError as e:
-        print(f"Error copying file {original_name_no_ext}: {e}")
-
-def balance_dataset_split(dataset_dir, split, names, min_images, max_images):
-    """Balances the number of images per class in a specific dataset split."""
-    image_dir = os.path.join(dataset_dir, split, 'images')
-    label_dir = os.path.join(dataset_dir, split, 'labels')
-
-    def scan_and_get_counts():
-        class_counts = {i: 0 for i in range(len(names))}
-        class_image_map = {i: [] for i in range(len(names))}
-        
-        for label_file in os.listdir(label_dir):
-            image_name = os.path.splitext(label_file)[0]
-            with open(os.path.join(label_dir, label_file), 'r') as f:
-                unique_classes_in_image = set(int(line.split()[0]) for line in f if line.strip())
-            
-            for class_idx in unique_classes_in_image:
-                if class_idx in class_counts:
-                    class_counts[class_idx] += 1
-                    class_image_map[class_idx].append(image_name)
-        return class_counts, class_image_map
-
-    # --- 1. Initial Scan ---
-    class_counts, class_image_map = scan_and_get_counts()
-    print("Initial class distribution (image count):")
-    for i, name in enumerate(names):
-        print(f"  - {name}: {class_counts.get(i, 0)} images")
+    keep, duplicates, final_counts = plan_balance_index(index, names, min_images, max_images)
+    return keep, {f"{entries[idx][0]}_aug_{i}": idx for idx, i in duplicates}, final_counts
+
+def plan_balance_index(index, names, min_images, max_images):
+    """
+    The balancing plan of plan_balance() on a DatasetIndex (image ids = positions).
+
+    Returns:
+        (np.ndarray, list, np.ndarray): the keep mask, the duplicates as
+        (image id, n) pairs, where n numbers the '_aug_<n>' copies of a class,
+        and the final images per class.
+    """
+    num_classes = len(names)
+
+    # --- 1. Initial counts ---
+    counts = index.class_counts()
+    print_distribution("Initial class distribution (image count):", counts, names)
 
     # --- 2. Undersampling ---
-    print("\n--- Starting Undersampling ---")
-    for class_idx, count in class_counts.items():
+    print("\n--- Planning Undersampling ---")
+    removed = np.zeros(len(index), dtype=bool)
+    for class_idx in range(num_classes):
+        count = int(counts[class_idx])
         if count > max_images:
             num_to_remove = count - max_images
             print(f"Undersampling class '{names[class_idx]}': removing {num_to_remove} of {count} images.")
-            images_to_remove = random.sample(class_image_map[class_idx], num_to_remove)
-            for image_name in images_to_remove:
-                delete_image_and_label(image_name, image_dir, label_dir)
-
-    # --- 3. Rescan after Undersampling ---
-    print("\nRescanning dataset after undersampling...")
-    class_counts, class_image_map = scan_and_get_counts()
-    print("Class distribution after undersampling:")
-    for i, name in enumerate(names):
-        print(f"  - {name}: {class_counts.get(i, 0)} images")
+            images_to_remove = random.sample(index.images_of_class(class_idx).tolist(), num_to_remove)
+            removed[images_to_remove] = True
+
+    # --- 3. Counts after undersampling (no rescan needed) ---
+    counts = index.class_counts(~removed)
+    print_distribution("\nClass distribution after undersampling:", counts, names)
 
     # --- 4. Oversampling ---
-    print("\n--- Starting Oversampling (by duplication) ---")
-    for class_idx, count in class_counts.items():
+    print("\n--- Planning Oversampling (by duplication) ---")
+    duplicates = {}
+    for class_idx in range(num_classes):
+        count = int(counts[class_idx])
         if 0 < count < min_images:
             num_to_add = min_images - count
             print(f"Oversampling class '{names[class_idx]}': adding {num_to_add} images to reach {min_images}.")
-            images_to_duplicate = random.choices(class_image_map[class_idx], k=num_to_add)
-            for i, image_name in enumerate(images_to_duplicate):
-                new_name = f"{image_name}_aug_{i}"
-                copy_image_and_label(image_name, new_name, image_dir, label_dir)
-
-    # --- 5. Final Report ---
-    print("\n--- Balancing Complete ---")
-    final_counts, _ = scan_and_get_counts()
-    print(f"Final class distribution in '{split}' set:")
-    for i, name in enumerate(names):
-        print(f"  - {name}: {final_counts.get(i, 0)} images")
+            candidates = index.images_of_class(class_idx)
+            candidates = candidates[~removed[candidates]].tolist()
+            images_to_duplicate = random.choices(candidates, k=num_to_add)
+            # The same image drawn as copy n for two classes is one '_aug_<n>' file
+            for i, image_id in enumerate(images_to_duplicate):
+                duplicates[(image_id, i)] = image_id
+
+    # --- 5. Final counts ---
+    final_counts = index.class_counts(image_multiplicities(~removed, duplicates))
+    return ~removed, list(duplicates), final_counts
+
+def materialize_plan(new_dataset_dir, split, entries, keep=None, duplicates=None, link_mode='copy',
+                     copy_workers=COPY_WORKERS):
+    """Writes one split of the plan: a single pass, every kept byte written once."""
+    new_image_dir = os.path.join(new_dataset_dir, split, 'images')
+    new_label_dir = os.path.join(new_dataset_dir, split, 'labels')
+
+    image_count = 0
+    copier = CopyExecutor(copy_workers, link_mode, preserve_metadata=True)
+    with copier:
+        for idx, (stem, label_path, label_text, new_text, image_path) in enumerate(entries):
+            if keep is not None and not keep[idx]:
+                continue
+            copier.submit_label(os.path.join(new_label_dir, f"{stem}.txt"), new_text,
+                                src=label_path, src_text=label_text)
+            if image_path:
+                copier.submit(image_path, os.path.join(new_image_dir, os.path.basename(image_path)))
+                image_count += 1
+            else:
+                print(f"Warning: Image for label '{stem}.txt' not found.")
+
+        # Duplicates come straight from the source image, so link modes cost no extra bytes
+        for new_stem, idx in (duplicates or {}).items():
+            _, label_path, label_text, new_text, image_path = entries[idx]
+            copier.submit_label(os.path.join(new_label_dir, f"{new_stem}.txt"), new_text,
+                                src=label_path, src_text=label_text)
+            if image_path:
+                ext = os.path.splitext(image_path)[1]
+                copier.submit(image_path, os.path.join(new_image_dir, f"{new_stem}{ext}"))
+                image_count += 1
+    copier.report("images and labels")
+    return image_count
+
+def image_multiplicities(keep, duplicates):
+    """How often every kept entry is sampled: 1 + the number of its planned duplicates."""
+    multiplicity = keep.astype(np.int64)
+    np.add.at(multiplicity, list(duplicates.values()), 1)
+    return multiplicity
+
+def write_image_list(new_dataset_dir, split, entries, multiplicity):
+    """
+    Writes '<split>.txt' listing every kept image, repeated by its multiplicity.
+
+    YOLO accepts such a list instead of an images folder; './' paths are
+    resolved against the list's folder and labels are found via /images/ -> /labels/.
+    """
+    list_name = f"{split}.txt"
+    with open(os.path.join(new_dataset_dir, list_name), 'w') as f:
+        for entry, count in zip(entries, multiplicity.tolist()):
+            if count and entry[4]:
+                line = f"./{split}/images/{os.path.basename(entry[4])}\n"
+                f.write(line * count)
+    return list_name
+
+def write_sampling_weights(new_dataset_dir, split, entries, multiplicity):
+    """Writes '<split>_weights.txt': one '<split>/images/<name> <weight>' line per kept image."""
+    weights_name = f"{split}_weights.txt"
+    with open(os.path.join(new_dataset_dir, weights_name), 'w') as f:
+        for entry, count in zip(entries, multiplicity.tolist()):
+            if count and entry[4]:
+                f.write(f"{split}/images/{os.path.basename(entry[4])} {count}\n")
+    return weights_name
+
+def filter_and_balance_dataset(original_data_yaml, selected_classes, new_dataset_dir, min_images, max_images,
+                               balance_split='train', link_mode='copy', oversample_mode='copy',
+                               copy_workers=COPY_WORKERS):
+    """
+    Filters a YOLO dataset to the selected classes and balances one split in a single pass.
+
+    The final image set is planned in memory from the label files, then
+    materialized once: no image is copied only to be deleted again, and the
+    output is never re-scanned. With oversample_mode 'list' or 'weights' the
+    duplicates are virtual: they only exist as repeated list entries or
+    sampling weights, so class balance costs no extra image bytes.
+
+    Returns:
+        list: The new class names, or None if no selected class was found.
+    """
+    print("Starting dataset filtering process (plan, then write once)...")
+    begin_stage("plan")
+    new_names, splits = plan_filtered_splits(original_data_yaml, selected_classes)
+    if not new_names:
+        return None
+
+    keep = duplicates = None
+    if balance_split in splits:
+        print(f"\n--- Planning Dataset Balancing for '{balance_split}' Set ---")
+        begin_stage("balance")
+        keep, duplicates, final_counts = plan_balance(splits[balance_split], new_names, min_images, max_images)
+        print(f"\nPlanned final class distribution in '{balance_split}' set:")
+        for i, name in enumerate(new_names):
+            print(f"  - {name}: {int(final_counts[i])} images")
+
+    print(f"\nCreating new dataset directory at: {new_dataset_dir}")
+    begin_stage("write")
+    for split in ['train', 'valid', 'test']:
+        os.makedirs(os.path.join(new_dataset_dir, split, 'images'), exist_ok=True)
+        os.makedirs(os.path.join(new_dataset_dir, split, 'labels'), exist_ok=True)
+
+    for split, entries in splits.items():
+        if split == balance_split:
+            physical = duplicates if oversample_mode == 'copy' else None
+            count = materialize_plan(new_dataset_dir, split, entries, keep, physical, link_mode, copy_workers)
+        else:
+            count = materialize_plan(new_dataset_dir, split, entries, link_mode=link_mode, copy_workers=copy_workers)
+        print(f"Finished writing '{split}'. Wrote {count} images and their labels.")
+
+    begin_stage("yaml")
+    new_yaml_path = os.path.join(new_dataset_dir, 'data.yaml')
+    new_data_yaml = {
+        'path': os.path.abspath(new_dataset_dir),
+        'train': 'train/images', 'val': 'valid/images', 'test': 'test/images',
+        'names': new_names
+    }
+
+    if keep is not None and oversample_mode != 'copy':
+        yaml_key = 'val' if balance_split == 'valid' else balance_split
+        multiplicity = image_multiplicities(keep, duplicates)
+        if oversample_mode == 'list':
+            new_data_yaml[yaml_key] = write_image_list(new_dataset_dir, balance_split, splits[balance_split], multiplicity)
+            print(f"Oversampling is virtual: '{new_data_yaml[yaml_key]}' repeats {len(duplicates)} image entries.")
+        else:
+            # Not read by YOLO itself; meant for a custom weighted sampler
+            weights_key = f"{yaml_key}_weights"
+            new_data_yaml[weights_key] = write_sampling_weights(
+                new_dataset_dir, balance_split, splits[balance_split], multiplicity)
+            print(f"Oversampling is virtual: weights saved to '{new_data_yaml[weights_key]}'.")
+
+    with open(new_yaml_path, 'w') as f:
+        yaml.dump(new_data_yaml, f, sort_keys=False, default_flow_style=False)
+
+    print(f"\nSuccessfully created new dataset at '{new_dataset_dir}'")
+    print(f"New configuration file saved at '{new_yaml_path}'")
+    return new_names
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Filter a YOLO dataset to selected classes and balance the train split.")
+    add_link_mode_argument(parser)
+    parser.add_argument('--oversample-mode', choices=OVERSAMPLE_MODES, default='copy',
+                        help="'copy' writes _aug_N duplicates; 'list' and 'weights' oversample "
+                             "without writing any extra image bytes.")
+    add_copy_workers_argument(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    start_metrics(args)
+
     # --- Configuration ---
     SELECTED_CLASSES = [
         'fire', 
@@ -287,16 +355,17 @@ if __name__ == '__main__':
     MAX_IMAGES_PER_CLASS = 5000
     
     # --- Run the script ---
-    new_class_names = filter_dataset(ORIGINAL_DATA_YAML_CONTENT, SELECTED_CLASSES, NEW_DATASET_DIRECTORY)
-
-    # After filtering, balance the training set
-    if new_class_names:
-        print("\n--- Starting Dataset Balancing for Training Set ---")
-        balance_dataset_split(
-            NEW_DATASET_DIRECTORY,
-            'train',
-            new_class_names,
-            MIN_IMAGES_PER_CLASS,
-            MAX_IMAGES_PER_CLASS
-        )
+    # Filter and balance the training set in one planned pass
+    filter_and_balance_dataset(
+        ORIGINAL_DATA_YAML_CONTENT,
+        SELECTED_CLASSES,
+        NEW_DATASET_DIRECTORY,
+        MIN_IMAGES_PER_CLASS,
+        MAX_IMAGES_PER_CLASS,
+        balance_split='train',
+        link_mode=args.link_mode,
+        oversample_mode=args.oversample_mode,
+        copy_workers=args.copy_workers
+    )
+    finish_metrics(args)
 
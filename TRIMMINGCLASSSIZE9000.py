@@ -1,13 +1,34 @@
 import os
-import shutil
 import random
-from collections import defaultdict
+import argparse
+import numpy as np
 import yaml
+from materialize import add_link_mode_argument
+from copyengine import CopyExecutor, add_copy_workers_argument, COPY_WORKERS
+from journal import BuildJournal, add_resume_argument
+from instrument import add_metrics_arguments, begin_stage, start_metrics, finish_metrics
+from datasetindex import DatasetIndex
+from labelcache import add_label_cache_arguments, configure_label_cache
 
 # --- CONFIGURATION ---
 # Set the limit for images per class
 IMAGE_LIMIT = 9000
 
+# How images are chosen for classes above the limit:
+#   'greedy' - all classes are capped jointly: rarest class first, its images in random order, and an
+#              image is only kept if none of its classes is already at the limit. No class ends up
+#              above IMAGE_LIMIT. An image of a class below the limit is dropped too when it also
+#              shows a class that is already full.
+#   'random' - sample IMAGE_LIMIT images per class independently and keep the union, so classes that
+#              share images can overshoot the limit.
+# NOTE: the default used to be 'random' (the only behaviour before); set 'random' to get it back.
+TRIM_STRATEGY = 'greedy'
+# 'greedy' only: try the smallest files of a class first instead of a random order. Gives the
+# smallest output, but biases every capped class toward its lowest-resolution, most compressed images.
+SMALLEST_FIRST = False
+# Seed of the random choices (None = different every run)
+SEED = None
+
 # Set up the paths. This script assumes both folders are on your Desktop.
 # os.path.expanduser('~') gets the path to your home directory (e.g., C:/Users/Utkarsh)
 desktop_path = os.path.join(os.path.expanduser('~'), 'Desktop')
@@ -15,18 +36,66 @@ source_dataset_path = os.path.join(desktop_path, 'ALLmaster_dataset')
 output_dataset_path = os.path.join(desktop_path, 'folder9000')
 source_yaml_name = 'master.yaml' # The name of your yaml file in the source folder
 
+# How files are placed in the output: 'copy', 'hardlink', 'reflink' or 'symlink'.
+# Labels are not modified here, so with a link mode the trimmed dataset costs no extra image/label bytes.
+LINK_MODE = 'copy'
+# Parallel copies in step 3 (1 = copy one file at a time)
+COPY_THREADS = COPY_WORKERS
+
 # --- SCRIPT LOGIC (No need to edit below this line) ---
 
-def find_image_file(label_path, image_dir):
-    """Finds the corresponding image file for a given label file."""
-    base_name = os.path.splitext(os.path.basename(label_path))[0]
-    for ext in ['.jpg', '.jpeg', '.png', '.bmp', '.webp']:
-        image_path = os.path.join(image_dir, base_name + ext)
-        if os.path.exists(image_path):
-            return image_path
-    return None
+def greedy_trim(index, limit, smallest_first=SMALLEST_FIRST):
+    """
+    Picks images against all class caps at once.
+
+    Classes are visited from the fewest to the most images. For each, the
+    not-yet-kept images are tried in random order (from the smallest file up
+    with `smallest_first`), and an image is kept only if every class it
+    contains is still below `limit`. Seed the `random` module for a
+    reproducible choice.
+
+    Args:
+        index (DatasetIndex): Index (built with sizes for `smallest_first`).
+
+    Returns:
+        np.ndarray: Boolean keep mask over the image ids.
+    """
+    image_ptr, image_classes = index.image_class_csr()
+    keep = np.zeros(len(index), dtype=bool)
+    counts = np.zeros(index.num_classes, dtype=np.int64)
+
+    for class_id in np.argsort(index.class_counts(), kind='stable').tolist():
+        images = index.images_of_class(class_id)
+        images = images[~keep[images]]
+        if smallest_first:
+            images = images[np.argsort(index.sizes[images], kind='stable')].tolist()
+        else:
+            images = images.tolist()
+            random.shuffle(images)
+        for image in images:
+            if counts[class_id] >= limit:
+                break
+            classes = image_classes[image_ptr[image]:image_ptr[image + 1]]
+            if (counts[classes] >= limit).any():
+                continue
+            keep[image] = True
+            counts[classes] += 1
+    return keep
+
+
+def random_trim(index, limit):
+    """The original trim: sample `limit` images per class and keep the union."""
+    keep = np.zeros(len(index), dtype=bool)
+    for class_id in range(index.num_classes):
+        images = index.images_of_class(class_id).tolist()
+        if len(images) > limit:
+            images = random.sample(images, limit)
+        keep[images] = True
+    return keep
 
-def main():
+
+def main(link_mode=LINK_MODE, strategy=TRIM_STRATEGY, copy_workers=COPY_THREADS, resume=False,
+         smallest_first=SMALLEST_FIRST, seed=SEED):
     print("🚀 Starting dataset balancing process...")
     
     if not os.path.exists(source_dataset_path):
@@ -35,100 +104,82 @@ def main():
 
     # --- 1. Scan the dataset and build an index of images per class ---
     print("\n🔍 Step 1: Scanning dataset and indexing images by class...")
-    class_to_images = defaultdict(list)
-    image_to_split = {} # To remember if an image is in train, valid, or test
+    begin_stage("scan")
+    # Image names are interned once; classes and splits are integer arrays over the image ids
+    index = DatasetIndex.from_yolo(source_dataset_path, with_sizes=True, verbose=True)
+    index.print_footprint()
 
-    for split in ['train', 'valid', 'test']:
-        label_dir = os.path.join(source_dataset_path, split, 'labels')
-        image_dir = os.path.join(source_dataset_path, split, 'images')
-        
-        if not os.path.exists(label_dir):
-            print(f"   - Warning: No '{split}/labels' directory found. Skipping.")
-            continue
-        
-        print(f"   - Processing '{split}' split...")
-        label_files = [f for f in os.listdir(label_dir) if f.endswith('.txt')]
-        
-        for label_file in label_files:
-            label_path = os.path.join(label_dir, label_file)
-            image_path = find_image_file(label_path, image_dir)
-            
-            if image_path is None:
-                continue
+    print("✅ Indexing complete.")
+    source_counts = index.class_counts()
+    for class_id in np.nonzero(source_counts)[0].tolist():
+        print(f"   - Class {class_id}: Found {source_counts[class_id]} images.")
+
+    # --- 2. Trim the classes exceeding the limit ---
+    print(f"\n✂️ Step 2: Trimming classes with more than {IMAGE_LIMIT} images ({strategy})...")
+    begin_stage("trim")
+    if seed is not None:
+        random.seed(seed)
+    if strategy == 'greedy':
+        keep = greedy_trim(index, IMAGE_LIMIT, smallest_first)
+    else:
+        keep = random_trim(index, IMAGE_LIMIT)
 
-            image_name = os.path.basename(image_path)
-            image_to_split[image_name] = split
-            
-            with open(label_path, 'r') as f:
-                # Use a set to only count an image once per class it contains
-                classes_in_image = set()
-                for line in f:
-                    try:
-                        class_id = int(line.strip().split()[0])
-                        classes_in_image.add(class_id)
-                    except (ValueError, IndexError):
-                        continue # Ignore empty or malformed lines
-                
-                for class_id in classes_in_image:
-                    class_to_images[class_id].append(image_name)
+    # Actual per-class image counts of the trimmed dataset
+    kept_counts = index.class_counts(keep)
+    for class_id in np.nonzero(source_counts)[0].tolist():
+        over = "  ⚠ over the limit" if kept_counts[class_id] > IMAGE_LIMIT else ""
+        print(f"   - Class {class_id}: {source_counts[class_id]} -> {kept_counts[class_id]} images.{over}")
 
-    print("✅ Indexing complete.")
-    for class_id, images in class_to_images.items():
-        print(f"   - Class {class_id}: Found {len(images)} images.")
-
-    # --- 2. Trim the lists for classes exceeding the limit ---
-    print(f"\n✂️ Step 2: Trimming classes with more than {IMAGE_LIMIT} images...")
-    images_to_keep = set()
-
-    for class_id, images in class_to_images.items():
-        if len(images) > IMAGE_LIMIT:
-            print(f"   - Class {class_id} has {len(images)} images. Reducing to {IMAGE_LIMIT}.")
-            trimmed_list = random.sample(images, IMAGE_LIMIT)
-            images_to_keep.update(trimmed_list)
-        else:
-            # If the class is within the limit, keep all its images
-            images_to_keep.update(images)
-    
-    print(f"✅ Trimming complete. Total unique images to keep: {len(images_to_keep)}")
+    kept_bytes = int(index.sizes[keep].sum())
+    total_bytes = int(index.sizes.sum())
+    print(f"✅ Trimming complete. Total unique images to keep: {int(keep.sum())}")
+    print(f"   - Kept {kept_bytes / 1024 ** 2:.1f} MB of {total_bytes / 1024 ** 2:.1f} MB (images + labels).")
 
     # --- 3. Create the new dataset structure and copy files ---
     print("\n📁 Step 3: Creating new dataset and copying files...")
+    begin_stage("copy")
     
-    # Remove old output directory if it exists for a clean start
-    if os.path.exists(output_dataset_path):
-        print(f"   - Found existing '{os.path.basename(output_dataset_path)}' folder. Removing it.")
-        shutil.rmtree(output_dataset_path)
-
-    # Create new directory structure
-    for split in ['train', 'valid', 'test']:
-        os.makedirs(os.path.join(output_dataset_path, split, 'images'), exist_ok=True)
-        os.makedirs(os.path.join(output_dataset_path, split, 'labels'), exist_ok=True)
-    
-    # Copy the selected files
-    copied_count = 0
-    for image_name in images_to_keep:
-        split = image_to_split[image_name]
-        
-        # Source paths
-        source_img_path = os.path.join(source_dataset_path, split, 'images', image_name)
-        label_name = os.path.splitext(image_name)[0] + '.txt'
-        source_lbl_path = os.path.join(source_dataset_path, split, 'labels', label_name)
-        
-        # Destination paths
-        dest_img_path = os.path.join(output_dataset_path, split, 'images', image_name)
-        dest_lbl_path = os.path.join(output_dataset_path, split, 'labels', label_name)
-        
-        if os.path.exists(source_img_path) and os.path.exists(source_lbl_path):
-            shutil.copy2(source_img_path, dest_img_path)
-            shutil.copy2(source_lbl_path, dest_lbl_path)
+    # Built in a staging folder next to the output; the existing output stays
+    # readable until the new one is complete and swapped in (step 5)
+    journal = BuildJournal(output_dataset_path, resume=resume)
+
+    copier = CopyExecutor(copy_workers, link_mode, preserve_metadata=True)
+    with copier:
+        # Create new directory structure
+        journal.make_dirs(copier, [os.path.join(split, sub)
+                                   for split in ['train', 'valid', 'test'] for sub in ['images', 'labels']])
+
+        # Copy the selected files
+        copied_count = 0
+        for image_id in np.nonzero(keep)[0].tolist():
+            image_name = index.name(image_id)
+            split = index.split_of(image_id)
+
+            # Source paths
+            source_img_path = os.path.join(source_dataset_path, split, 'images', image_name)
+            label_name = os.path.splitext(image_name)[0] + '.txt'
+            source_lbl_path = os.path.join(source_dataset_path, split, 'labels', label_name)
+
+            # Destination paths, relative to the output folder
+            dest_img_path = os.path.join(split, 'images', image_name)
+            dest_lbl_path = os.path.join(split, 'labels', label_name)
+
+            # Both files were seen during the scan in step 1, no need to stat them again;
+            # files finished by an interrupted run are skipped unless the source size changed
+            label_size = int(index.label_sizes[image_id])
+            journal.copy(copier, source_img_path, dest_img_path, expected_size=int(index.sizes[image_id]) - label_size)
+            journal.copy(copier, source_lbl_path, dest_lbl_path, expected_size=label_size)
             copied_count += 1
 
     print(f"   - Successfully copied {copied_count} image/label pairs.")
+    copier.report()
 
     # --- 4. Copy the YAML file ---
     print("\n📝 Step 4: Copying YAML file...")
+    begin_stage("yaml")
     source_yaml_path = os.path.join(source_dataset_path, source_yaml_name)
-    dest_yaml_path = os.path.join(output_dataset_path, 'dataset.yaml') # Standard name
+    dest_yaml_path = journal.path('dataset.yaml') # Standard name
+    journal.want('dataset.yaml')
 
     if os.path.exists(source_yaml_path):
         # We need to update the path in the YAML to be relative
@@ -147,9 +198,33 @@ def main():
     else:
         print(f"   - Warning: YAML file '{source_yaml_name}' not found in source directory.")
 
+    # --- 5. Publish the finished dataset in one step ---
+    begin_stage("publish")
+    if copier.failed:
+        journal.close()
+        print(f"\n❌ {copier.failed} files could not be copied. Fix the cause and re-run with --resume.")
+        return
+    journal.commit()
+
     print("\n\n🎉 All done! Your new balanced dataset is ready in 'folder9000' on your Desktop.")
 
 
 # Run the main function
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description="Trim every class to at most IMAGE_LIMIT images.")
+    add_link_mode_argument(parser, default=LINK_MODE)
+    parser.add_argument('--strategy', choices=['greedy', 'random'], default=TRIM_STRATEGY,
+                        help="'greedy' keeps every class at or below the limit; 'random' is the old per-class sample.")
+    parser.add_argument('--smallest-first', action='store_true', default=SMALLEST_FIRST,
+                        help="'greedy' only: try the smallest files first (smallest output, biased to small images).")
+    parser.add_argument('--seed', type=int, default=SEED, help="Seed of the random choices.")
+    add_copy_workers_argument(parser, default=COPY_THREADS)
+    add_resume_argument(parser)
+    add_label_cache_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    start_metrics(args)
+    configure_label_cache(args)
+    main(link_mode=args.link_mode, strategy=args.strategy, copy_workers=args.copy_workers, resume=args.resume,
+         smallest_first=args.smallest_first, seed=args.seed)
+    finish_metrics(args)
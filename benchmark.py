@@ -0,0 +1,390 @@
+import os
+import ast
+import sys
+import json
+import time
+import types
+import shlex
+import shutil
+import builtins
+import platform
+import argparse
+import subprocess
+from synthdataset import (generate_dataset, load_spec, SYNTH_VERSION, SOURCES, CLASSES, BYTES_PER_PIXEL,
+                          CLASS_SKEW, BOXES, parse_range)
+from materialize import LINK_MODES
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+WORK_DIR = 'benchmark_data'
+RESULTS_FILE = 'benchmark_results.jsonl'
+SCALES = ['10k', '100k', '1M']
+SEED = 0
+
+# The benchmarked scripts, in pipeline order. Each one runs in its own interpreter
+# (fresh module state, like a real run) with its configuration constants pointed
+# at the synthetic data and with --metrics, so the stage timings and counters of
+# instrument.py end up in the results.
+CASES = ['merge', 'merge-process', 'count', 'index', 'trim', 'filter', 'balance', 'split']
+SCRIPTS = {
+    'merge': 'secondlythis.py',
+    'merge-process': 'secondlythis.py',
+    'count': 'countingimagesinclass.py',
+    'index': 'datasetindex.py',
+    'trim': 'TRIMMINGCLASSSIZE9000.py',
+    'filter': 'filteringclassesfromfinal.py',
+    'balance': 'SORTINGFROMSIZE400MIN5000MAX.py',
+    'split': 'forsplittingintraintestvalid.py',
+}
+# Arguments a case always gets ('merge-process' is the merge on a process pool, into its own folder)
+MERGE_PROCESSES = max(2, os.cpu_count() or 1)
+CASE_ARGS = {
+    'merge': ['--full-rebuild', '--no-registry'],
+    'merge-process': ['--full-rebuild', '--no-registry', '--executor', 'process', '--workers', str(MERGE_PROCESSES)],
+    'split': ['--seed', str(SEED)],
+}
+# Cases that accept --link-mode
+LINK_MODE_CASES = {'merge', 'merge-process', 'trim', 'filter', 'balance', 'split'}
+
+
+def parse_scale(text):
+    """'10k' -> 10000, '1M' -> 1000000, '2500' -> 2500."""
+    factor = {'k': 1000, 'm': 1000 ** 2}.get(text[-1:].lower(), 1)
+    return int(float(text[:-1] if factor > 1 else text) * factor)
+
+
+# --- Running a script with other settings ---
+
+def _is_main_guard(node):
+    return (isinstance(node, ast.If) and isinstance(node.test, ast.Compare)
+            and isinstance(node.test.left, ast.Name) and node.test.left.id == '__name__')
+
+
+def configure_script(source, settings, filename='<script>'):
+    """
+    Compiles a script with some of its configuration constants replaced.
+
+    The scripts are configured by editing assignments at the top of the file
+    or at the top of their `if __name__ == '__main__':` block; those are the
+    assignments replaced here. Values are JSON-style literals; a constant that
+    was written as Path(...) stays a Path.
+    """
+    tree = ast.parse(source, filename)
+    missing = set(settings)
+    bodies = [tree.body] + [node.body for node in tree.body if _is_main_guard(node)]
+    for body in bodies:
+        for node in body:
+            if not (isinstance(node, ast.Assign) and len(node.targets) == 1
+                    and isinstance(node.targets[0], ast.Name) and node.targets[0].id in settings):
+                continue
+            name = node.targets[0].id
+            value = ast.parse(repr(settings[name]), mode='eval').body
+            if isinstance(node.value, ast.Call) and getattr(node.value.func, 'id', None) == 'Path':
+                value = ast.Call(func=ast.Name(id='Path', ctx=ast.Load()), args=[value], keywords=[])
+            node.value = value
+            missing.discard(name)
+    if missing:
+        raise KeyError(f"{filename} has no configuration constant(s) {sorted(missing)}")
+    return compile(ast.fix_missing_locations(tree), filename, 'exec')
+
+
+def exec_configured(script, settings, argv):
+    """
+    Runs `script` as __main__ in this interpreter with `settings` applied and `argv` as its arguments.
+
+    The script runs in a real module registered as sys.modules['__main__'],
+    so process pools can pickle the functions it defines: forked workers find
+    them in that module, spawned ones re-import them from `script`.
+    """
+    script = os.path.abspath(script)
+    with open(script, 'r', encoding='utf-8') as f:
+        code = configure_script(f.read(), settings, script)
+    sys.argv = [script] + list(argv)
+    sys.path.insert(0, os.path.dirname(script))
+    module = types.ModuleType('__main__')
+    module.__file__ = script
+    module.__builtins__ = builtins
+    sys.modules['__main__'] = module
+    exec(code, module.__dict__)
+
+
+def run_case(case, settings, argv, log_dir):
+    """
+    Runs one case in a child interpreter, its output going to <log_dir>/<case>.log.
+
+    Returns:
+        dict: Wall time, exit code, arguments and the stages/counters the script recorded.
+    """
+    log_path = os.path.join(log_dir, f"{case}.log")
+    metrics_path = os.path.join(log_dir, f"{case}.metrics.json")
+    if os.path.exists(metrics_path):
+        os.remove(metrics_path)
+    argv = list(argv) + ['--metrics', metrics_path]
+    command = [sys.executable, os.path.abspath(__file__), 'exec', os.path.join(REPO_DIR, SCRIPTS[case]),
+               json.dumps(settings), '--'] + argv
+
+    start = time.perf_counter()
+    with open(log_path, 'w', encoding='utf-8') as log:
+        returncode = subprocess.call(command, stdout=log, stderr=subprocess.STDOUT, cwd=log_dir,
+                                     env=dict(os.environ, PYTHONIOENCODING='utf-8'))
+    wall = time.perf_counter() - start
+
+    result = {'wall_s': round(wall, 6), 'returncode': returncode, 'argv': argv[:-2], 'stages': {}, 'counters': {}}
+    metrics = None
+    if os.path.exists(metrics_path):
+        with open(metrics_path, 'r', encoding='utf-8') as f:
+            metrics = json.load(f)
+    if metrics:
+        result['stages'] = metrics['stages']
+        result['counters'] = metrics['counters']
+    return result
+
+
+# --- Benchmark runs ---
+
+def case_settings(case, data_dir, out_dir, spec):
+    """Configuration constants of a case's script, pointed at the synthetic data of one scale."""
+    master = os.path.join(out_dir, 'master')
+    names = spec['names']
+    # Classes are Zipf-distributed, so a limit at the mean class size trims the big ones
+    limit = max(1, spec['labels'] // len(names))
+    # The largest source, filtered to its first half of classes
+    source = max(spec['sources'], key=lambda s: sum(c['labels'] for c in s['splits'].values()))
+    if case == 'merge':
+        return {'datasets_parent': data_dir, 'output_path': master, 'master_class_list': names}
+    if case == 'merge-process':
+        return {'datasets_parent': data_dir, 'output_path': os.path.join(out_dir, 'master-process'),
+                'master_class_list': names}
+    if case == 'count':
+        return {'DATASET_PATH': master, 'YAML_FILENAME': 'master.yaml'}
+    if case == 'index':
+        return {'DATASET_PATH': master}
+    if case == 'trim':
+        return {'source_dataset_path': master, 'output_dataset_path': os.path.join(out_dir, 'trimmed'),
+                'source_yaml_name': 'master.yaml', 'IMAGE_LIMIT': limit}
+    if case == 'filter':
+        selected = [name.strip() for name in source['names'][:max(1, len(source['names']) // 2)]]
+        return {'source_dataset_path': os.path.join(data_dir, source['folder']),
+                'output_path': os.path.join(out_dir, 'filtered'), 'selected_classes': selected}
+    if case == 'balance':
+        data_yaml = {split if split != 'valid' else 'val': os.path.join(master, split, 'images')
+                     for split in ['train', 'valid', 'test']}
+        data_yaml['names'] = names
+        return {'ORIGINAL_DATA_YAML_CONTENT': data_yaml, 'SELECTED_CLASSES': names[::2],
+                'NEW_DATASET_DIRECTORY': os.path.join(out_dir, 'balanced'),
+                'MIN_IMAGES_PER_CLASS': max(1, limit // 4), 'MAX_IMAGES_PER_CLASS': limit}
+    if case == 'split':
+        return {'SOURCE_DIR': os.path.join(master, 'train'), 'OUTPUT_DIR': os.path.join(out_dir, 'split')}
+    raise ValueError(f"Unknown case '{case}'. Expected one of {CASES}.")
+
+
+def case_outputs(case, out_dir):
+    folder = {'merge': 'master', 'merge-process': 'master-process', 'trim': 'trimmed', 'filter': 'filtered',
+              'balance': 'balanced', 'split': 'split'}.get(case)
+    if folder is None:
+        return []
+    path = os.path.join(out_dir, folder)
+    return [path, path + '.staging']
+
+
+def ensure_dataset(data_dir, labels, generator):
+    """Generates the synthetic data of one scale, or reuses it when it was made with the same settings."""
+    spec = load_spec(data_dir)
+    wanted = dict(generator, images=labels, version=SYNTH_VERSION)
+    if spec is not None and all(spec['settings'].get(key) == value for key, value in wanted.items()):
+        return spec, 0.0
+    start = time.perf_counter()
+    spec = generate_dataset(data_dir, images=labels, classes=generator['classes'], sources=generator['sources'],
+                            boxes=generator['boxes'], bytes_per_pixel=generator['bytes_per_pixel'],
+                            class_skew=generator['class_skew'], seed=generator['seed'])
+    return spec, time.perf_counter() - start
+
+
+def git_revision():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                                  text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return revision + ('-dirty' if dirty else '')
+
+
+def run_benchmarks(scales=SCALES[:1], cases=CASES, work_dir=WORK_DIR, results_file=RESULTS_FILE, label=None,
+                   link_mode=None, extra_args=None, generator=None, keep_outputs=False):
+    """
+    Generates (or reuses) the synthetic data of every scale and times the cases on it.
+
+    The cases run in pipeline order; the merged master every later case reads
+    is built first, unrecorded, when 'merge' itself is not selected. The run is
+    appended as one JSON line to `results_file`.
+
+    Returns:
+        dict: The recorded run.
+    """
+    generator = dict(generator or {})
+    extra_args = extra_args or {}
+    run = {
+        'run': time.strftime('%Y%m%d-%H%M%S'), 'label': label, 'revision': git_revision(),
+        'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+        'generator': generator, 'scales': {},
+    }
+    for scale in scales:
+        labels = parse_scale(scale)
+        base = os.path.abspath(os.path.join(work_dir, f"synth-{labels}"))
+        data_dir, out_dir, log_dir = (os.path.join(base, name) for name in ('sources', 'out', 'logs'))
+        os.makedirs(out_dir, exist_ok=True)
+        os.makedirs(log_dir, exist_ok=True)
+
+        print(f"\n📦 Scale {scale} ({labels} samples) in '{base}'")
+        spec, generate_s = ensure_dataset(data_dir, labels, generator)
+        if generate_s:
+            print(f"   - generated in {generate_s:.1f}s")
+        entry = {'labels': spec['labels'], 'images': spec['images'], 'boxes': spec['boxes'],
+                 'generate_s': round(generate_s, 3), 'cases': {}}
+        run['scales'][scale] = entry
+
+        wanted = [case for case in CASES if case in cases]
+        if 'merge' not in wanted and not os.path.exists(os.path.join(out_dir, 'master', 'master.yaml')):
+            wanted.insert(0, 'merge')
+        for case in wanted:
+            for path in case_outputs(case, out_dir):
+                shutil.rmtree(path, ignore_errors=True)
+            # The synthetic class list is given, so the merges read no class registry next to the sources
+            argv = CASE_ARGS.get(case, []) + shlex.split(extra_args.get(case, ''))
+            if link_mode and case in LINK_MODE_CASES:
+                argv += ['--link-mode', link_mode]
+
+            result = run_case(case, case_settings(case, data_dir, out_dir, spec), argv, log_dir)
+            if case in cases:
+                entry['cases'][case] = result
+            status = "✅" if result['returncode'] == 0 else f"❌ exit {result['returncode']}, see {log_dir}"
+            recorded = "" if case in cases else " (setup)"
+            print(f"   - {case:<13} {result['wall_s']:8.2f}s {status}{recorded}")
+            if result['returncode'] != 0 and case == 'merge':
+                print("   ⏹️ The merge failed; skipping the cases that read its output.")
+                break
+
+        if not keep_outputs:
+            for case in CASES:
+                if case != 'merge':
+                    for path in case_outputs(case, out_dir):
+                        shutil.rmtree(path, ignore_errors=True)
+
+    with open(results_file, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(run) + '\n')
+    print(f"\n📈 Results appended to {results_file} as run {run['run']}")
+    return run
+
+
+# --- Comparing runs ---
+
+def load_runs(results_file=RESULTS_FILE):
+    runs = []
+    with open(results_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                runs.append(json.loads(line))
+    return runs
+
+
+def find_run(runs, key):
+    """A run by its id or label, or by position ('-1' is the latest)."""
+    for run in reversed(runs):
+        if key in (run['run'], run.get('label')):
+            return run
+    try:
+        return runs[int(key)]
+    except (ValueError, IndexError):
+        raise KeyError(f"No run '{key}' in the results") from None
+
+
+def _change(old, new):
+    if not old:
+        return ""
+    return f"{(new - old) / old * 100:+7.1f}%"
+
+
+def compare_runs(base, run, stages=False):
+    """Prints the wall time of every case (and optionally stage) of two runs side by side."""
+    def title(r):
+        return f"{r['run']}" + (f" '{r['label']}'" if r.get('label') else "") + f" @ {r.get('revision')}"
+
+    print(f"📊 {title(base)}  →  {title(run)}")
+    for scale, entry in run['scales'].items():
+        base_entry = base['scales'].get(scale)
+        if base_entry is None:
+            print(f"\n  {scale}: not in the base run")
+            continue
+        print(f"\n  {scale} ({entry['labels']} label files):")
+        for case, result in entry['cases'].items():
+            old = base_entry['cases'].get(case)
+            if old is None:
+                print(f"   - {case:<28} {'':>9}   {result['wall_s']:8.2f}s")
+                continue
+            print(f"   - {case:<28} {old['wall_s']:8.2f}s → {result['wall_s']:8.2f}s {_change(old['wall_s'], result['wall_s'])}")
+            if stages:
+                for name, stage_result in result['stages'].items():
+                    old_stage = old['stages'].get(name)
+                    old_wall = f"{old_stage['wall_s']:8.2f}s" if old_stage else f"{'':>9}"
+                    change = _change(old_stage['wall_s'], stage_result['wall_s']) if old_stage else ""
+                    print(f"       {name:<26} {old_wall} → {stage_result['wall_s']:8.2f}s {change}")
+
+
+def parse_extra(items):
+    """['merge=--workers 8', ...] -> {'merge': '--workers 8'}"""
+    extra = {}
+    for item in items or []:
+        case, _, args = item.partition('=')
+        if case not in CASES:
+            raise argparse.ArgumentTypeError(f"Unknown case '{case}' in --extra. Expected one of {CASES}.")
+        extra[case] = args
+    return extra
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the dataset scripts on synthetic data and compare runs.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="Time the scripts at one or more scales.")
+    run_parser.add_argument('--scales', nargs='+', default=SCALES[:1],
+                            help=f"Number of samples per scale, e.g. {' '.join(SCALES)}.")
+    run_parser.add_argument('--cases', nargs='+', choices=CASES, default=CASES, help="Scripts to time.")
+    run_parser.add_argument('--work-dir', default=WORK_DIR, help="Folder for the synthetic data and outputs.")
+    run_parser.add_argument('--results', default=RESULTS_FILE, help="JSON-lines file the run is appended to.")
+    run_parser.add_argument('--label', help="Name of the run, for compare.")
+    run_parser.add_argument('--link-mode', choices=LINK_MODES, help="--link-mode for every case that has it.")
+    run_parser.add_argument('--extra', action='append', metavar='CASE=ARGS',
+                            help="Extra arguments of one case, e.g. 'merge=--workers 8' (repeatable).")
+    run_parser.add_argument('--keep-outputs', action='store_true', help="Keep the outputs of the cases.")
+    run_parser.add_argument('--sources', type=int, default=SOURCES, help="Source datasets to generate.")
+    run_parser.add_argument('--classes', type=int, default=CLASSES, help="Classes to generate.")
+    run_parser.add_argument('--boxes', type=parse_range, default=BOXES, help="Boxes per labelled image, e.g. '1-6'.")
+    run_parser.add_argument('--bytes-per-pixel', type=float, default=BYTES_PER_PIXEL, help="Generated image size.")
+    run_parser.add_argument('--class-skew', type=float, default=CLASS_SKEW, help="Zipf exponent of the classes.")
+    run_parser.add_argument('--seed', type=int, default=SEED, help="Seed of the synthetic data.")
+
+    compare_parser = commands.add_parser('compare', help="Compare two recorded runs.")
+    compare_parser.add_argument('base', nargs='?', default='-2', help="Run id, label or index (default: second latest).")
+    compare_parser.add_argument('run', nargs='?', default='-1', help="Run id, label or index (default: latest).")
+    compare_parser.add_argument('--results', default=RESULTS_FILE)
+    compare_parser.add_argument('--stages', action='store_true', help="Also compare the stages of every case.")
+
+    exec_parser = commands.add_parser('exec', help="Run a script with some configuration constants replaced.")
+    exec_parser.add_argument('script')
+    exec_parser.add_argument('settings', help="JSON object of constant name -> value.")
+    exec_parser.add_argument('args', nargs=argparse.REMAINDER, help="Arguments of the script, after '--'.")
+
+    args = parser.parse_args()
+    if args.command == 'exec':
+        script_args = args.args[1:] if args.args[:1] == ['--'] else args.args
+        exec_configured(args.script, json.loads(args.settings), script_args)
+    elif args.command == 'compare':
+        runs = load_runs(args.results)
+        compare_runs(find_run(runs, args.base), find_run(runs, args.run), stages=args.stages)
+    else:
+        generator = {'seed': args.seed, 'classes': args.classes, 'sources': args.sources, 'boxes': list(args.boxes),
+                     'bytes_per_pixel': args.bytes_per_pixel, 'class_skew': args.class_skew}
+        run_benchmarks(args.scales, args.cases, args.work_dir, args.results, label=args.label,
+                       link_mode=args.link_mode, extra_args=parse_extra(args.extra), generator=generator,
+                       keep_outputs=args.keep_outputs)
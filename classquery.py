@@ -0,0 +1,338 @@
+import os
+import re
+import argparse
+import numpy as np
+import yaml
+from labelcache import (load_label_table, add_label_cache_arguments, configure_label_cache, dataset_cache_path,
+                        scan_label_files)
+from classtable import normalize_class_name
+from instrument import add_metrics_arguments, begin_stage, count, start_metrics, finish_metrics
+
+# Bump when the layout of the bitmap file changes; old files are then rebuilt.
+BITMAP_VERSION = 2
+BITMAP_NAME = 'class_bitmaps.npz'
+SPLITS = ['train', 'valid', 'test']
+
+# Query syntax, e.g.  "(fire | smoke) & ~person",  "COW and not 'Black Rust'",  "person >= 3"
+#   &, and    both sides          |, or     either side          ~, not    negation
+#   name op N per-image instance count of a class, op one of >=, <=, >, <, ==, !=
+#   Class names may contain spaces; quote them when they clash with a keyword.
+_TOKEN = re.compile(r"\s*(?:(\(|\)|&|\||~)|(>=|<=|==|!=|>|<)|'([^']*)'|\"([^\"]*)\"|(\d+)(?![\w-])|([^\s()&|~<>=!'\"]+))")
+_KEYWORDS = {'and': '&', 'or': '|', 'not': '~'}
+_COMPARE = {
+    '>=': np.greater_equal, '<=': np.less_equal, '>': np.greater,
+    '<': np.less, '==': np.equal, '!=': np.not_equal,
+}
+
+
+def _tokenize(expression):
+    """Splits a query into ('op', x), ('cmp', x), ('int', n) and ('name', x) tokens."""
+    tokens = []
+    words = []
+
+    def flush_words():
+        if words:
+            tokens.append(('name', ' '.join(words)))
+            words.clear()
+
+    pos = 0
+    expression = expression.strip()
+    while pos < len(expression):
+        match = _TOKEN.match(expression, pos)
+        if not match or match.end() == pos:
+            raise ValueError(f"Cannot parse query at: {expression[pos:]!r}")
+        pos = match.end()
+        op, cmp, single, double, number, word = match.groups()
+        if word is not None and word.lower() not in _KEYWORDS:
+            # Unquoted names may span several words: "Black Rust"
+            words.append(word)
+            continue
+        if number is not None and (words or not tokens or tokens[-1][0] != 'cmp'):
+            # A number that does not follow a comparison is part of a class name
+            words.append(number)
+            continue
+        flush_words()
+        if word is not None:
+            tokens.append(('op', _KEYWORDS[word.lower()]))
+        elif op is not None:
+            tokens.append(('op', op))
+        elif cmp is not None:
+            tokens.append(('cmp', cmp))
+        elif number is not None:
+            tokens.append(('int', int(number)))
+        else:
+            tokens.append(('name', single if single is not None else double))
+    flush_words()
+    return tokens
+
+
+class ClassBitmapIndex:
+    """
+    Per-class membership bitmaps for every labeled image of a YOLO dataset.
+
+    Images of all splits share one id space (split i covers
+    split_offsets[i]:split_offsets[i + 1]). Membership of class c is
+    np.packbits'ed in bits[c]; per-image instance counts are kept as sparse
+    (image, class, count) columns for the `name >= N` filters. The index is
+    saved in the cache folder (see labelcache.CACHE_DIR), so queries never
+    open a label file and nothing is written into the dataset. The size and
+    mtime of every label file it was built from tell whether it is current.
+    """
+
+    def __init__(self, names, splits, split_offsets, stems, bits, pair_image, pair_class, pair_count, file_sizes,
+                 file_mtimes):
+        self.names = list(names)
+        self.splits = list(splits)
+        self.split_offsets = split_offsets
+        self.stems = stems
+        self.bits = bits
+        self.pair_image = pair_image
+        self.pair_class = pair_class
+        self.pair_count = pair_count
+        self.file_sizes = file_sizes
+        self.file_mtimes = file_mtimes
+        self._class_of_key = {}
+        for i, name in enumerate(self.names):
+            self._class_of_key.setdefault(name, i)
+            self._class_of_key.setdefault(normalize_class_name(name), i)
+
+    def __len__(self):
+        return len(self.stems)
+
+    # --- Building and persistence ---
+
+    @classmethod
+    def build(cls, dataset_path, names, splits=SPLITS, verbose=False):
+        """Builds the bitmaps from the label caches of every split."""
+        stems = []
+        split_offsets = [0]
+        file_sizes, file_mtimes = [], []
+        pair_image, pair_class, pair_count = [], [], []
+        for split in splits:
+            labels = load_label_table(os.path.join(dataset_path, split, 'labels'), verbose=verbose)
+            file_sizes.append(labels.sizes)
+            file_mtimes.append(labels.mtimes)
+            first = split_offsets[-1]
+            valid = (labels.class_id >= 0) & (labels.class_id < len(names))
+            key = labels.image_id[valid].astype(np.int64) * len(names) + labels.class_id[valid]
+            key, count = np.unique(key, return_counts=True)
+            pair_image.append(key // len(names) + first)
+            pair_class.append(key % len(names))
+            pair_count.append(count)
+            stems.extend(labels.stems.tolist())
+            split_offsets.append(first + len(labels))
+
+        pair_image = np.concatenate(pair_image).astype(np.uint32)
+        pair_class = np.concatenate(pair_class).astype(np.uint32)
+        pair_count = np.minimum(np.concatenate(pair_count), np.iinfo(np.uint16).max).astype(np.uint16)
+
+        membership = np.zeros((len(names), len(stems)), dtype=bool)
+        membership[pair_class, pair_image] = True
+        bits = np.packbits(membership, axis=1)
+        return cls(names, splits, np.asarray(split_offsets, dtype=np.int64), np.array(stems, dtype=str),
+                   bits, pair_image, pair_class, pair_count, np.concatenate(file_sizes).astype(np.int64),
+                   np.concatenate(file_mtimes).astype(np.int64))
+
+    def save(self, path):
+        tmp_path = path + '.tmp'
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, version=BITMAP_VERSION, names=np.array(self.names, dtype=str),
+                     splits=np.array(self.splits, dtype=str), split_offsets=self.split_offsets,
+                     stems=self.stems, bits=self.bits, pair_image=self.pair_image, pair_class=self.pair_class,
+                     pair_count=self.pair_count, file_sizes=self.file_sizes, file_mtimes=self.file_mtimes)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Loads a saved index, or returns None if it is missing or outdated."""
+        try:
+            with np.load(path) as data:
+                if int(data['version']) != BITMAP_VERSION:
+                    return None
+                return cls(data['names'].tolist(), data['splits'].tolist(), data['split_offsets'], data['stems'],
+                           data['bits'], data['pair_image'], data['pair_class'], data['pair_count'],
+                           data['file_sizes'], data['file_mtimes'])
+        except (OSError, KeyError, ValueError):
+            return None
+
+    # --- Queries ---
+
+    def class_id(self, name):
+        class_id = self._class_of_key.get(name, self._class_of_key.get(normalize_class_name(name)))
+        if class_id is None:
+            raise ValueError(f"Unknown class '{name}'.")
+        return class_id
+
+    def _tail_mask(self):
+        """Packed mask with the padding bits after the last image cleared."""
+        return np.packbits(np.ones(len(self), dtype=bool))
+
+    def _count_bits(self, class_id, op, value):
+        counts = np.zeros(len(self), dtype=np.int64)
+        rows = self.pair_class == class_id
+        counts[self.pair_image[rows]] = self.pair_count[rows]
+        return np.packbits(_COMPARE[op](counts, value))
+
+    def evaluate(self, expression):
+        """
+        Evaluates a class expression to a packed bitmap over all images.
+
+        Raises:
+            ValueError: On a syntax error or an unknown class name.
+        """
+        tokens = _tokenize(expression)
+        pos = 0
+
+        def peek():
+            return tokens[pos] if pos < len(tokens) else (None, None)
+
+        def take():
+            nonlocal pos
+            pos += 1
+            return tokens[pos - 1]
+
+        def parse_or():
+            result = parse_and()
+            while peek() == ('op', '|'):
+                take()
+                result = result | parse_and()
+            return result
+
+        def parse_and():
+            result = parse_not()
+            while peek() == ('op', '&'):
+                take()
+                result = result & parse_not()
+            return result
+
+        def parse_not():
+            if peek() == ('op', '~'):
+                take()
+                return ~parse_not() & self._tail_mask()
+            return parse_atom()
+
+        def parse_atom():
+            kind, value = take() if pos < len(tokens) else (None, None)
+            if (kind, value) == ('op', '('):
+                result = parse_or()
+                if pos >= len(tokens) or take() != ('op', ')'):
+                    raise ValueError(f"Missing ')' in query: {expression!r}")
+                return result
+            if kind != 'name':
+                raise ValueError(f"Expected a class name in query: {expression!r}")
+            class_id = self.class_id(value)
+            if peek()[0] == 'cmp':
+                op = take()[1]
+                kind, number = take() if pos < len(tokens) else (None, None)
+                if kind != 'int':
+                    raise ValueError(f"Expected a number after '{value} {op}' in query: {expression!r}")
+                return self._count_bits(class_id, op, number)
+            return self.bits[class_id].copy()
+
+        result = parse_or()
+        if pos != len(tokens):
+            raise ValueError(f"Unexpected {tokens[pos][1]!r} in query: {expression!r}")
+        return result
+
+    def query(self, expression, splits=None):
+        """
+        Runs a class expression, optionally restricted to some splits.
+
+        Returns:
+            dict: split -> sorted list of matching stems.
+        """
+        matches = np.unpackbits(self.evaluate(expression), count=len(self)).astype(bool)
+        result = {}
+        for i, split in enumerate(self.splits):
+            if splits is not None and split not in splits:
+                continue
+            start, end = self.split_offsets[i], self.split_offsets[i + 1]
+            result[split] = self.stems[start:end][matches[start:end]].tolist()
+        return result
+
+    def class_counts(self, stems_by_split):
+        """Images per class among a query result."""
+        selected = np.zeros(len(self), dtype=bool)
+        for i, split in enumerate(self.splits):
+            if split in stems_by_split:
+                start, end = self.split_offsets[i], self.split_offsets[i + 1]
+                selected[start:end] = np.isin(self.stems[start:end], stems_by_split[split])
+        packed = np.packbits(selected)
+        return np.unpackbits(self.bits & packed, axis=1).sum(axis=1)
+
+
+def _is_current(index, dataset_path, names, splits):
+    """True when every label file of the dataset has the name, size and mtime the index was built from."""
+    if index.names != list(names) or index.splits != list(splits):
+        return False
+    current = []
+    for split in splits:
+        current.extend(scan_label_files(os.path.join(dataset_path, split, 'labels')))
+    count('files_scanned', len(current))
+    count('stat_calls', len(current))
+    return (len(current) == len(index) and index.stems.tolist() == [stem for stem, _, _ in current]
+            and np.array_equal(index.file_sizes, [size for _, size, _ in current])
+            and np.array_equal(index.file_mtimes, [mtime for _, _, mtime in current]))
+
+
+def open_index(dataset_path, names, splits=SPLITS, rebuild=False, verbose=False):
+    """
+    Loads the dataset's bitmap index, rebuilding it when the labels changed.
+
+    Freshness is checked on the size and mtime of every label file, from
+    one scandir pass per split (no label file is opened); a rebuild goes
+    through the label cache, so only changed label files are parsed.
+    """
+    path = dataset_cache_path(dataset_path, '.' + BITMAP_NAME)
+    index = None if rebuild else ClassBitmapIndex.load(path)
+    if index is not None and not _is_current(index, dataset_path, names, splits):
+        index = None
+    if index is None:
+        if verbose:
+            print(f"Building class bitmap index in '{path}'...")
+        index = ClassBitmapIndex.build(dataset_path, names, splits, verbose=verbose)
+        try:
+            index.save(path)
+        except OSError as e:
+            print(f"   ⚠ Could not save class bitmap index {path}: {e}")
+    return index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Query a YOLO dataset by class without reading label files.")
+    parser.add_argument('dataset', help="Dataset folder with train/valid/test splits.")
+    parser.add_argument('expression', help="e.g. \"(fire | smoke) & ~person\" or \"COW >= 2\".")
+    parser.add_argument('--yaml', default='master.yaml', help="YAML file in the dataset folder with the class names.")
+    parser.add_argument('--split', action='append', choices=SPLITS, help="Only these splits (repeatable).")
+    parser.add_argument('--list', action='store_true', help="Print the matching image stems.")
+    parser.add_argument('--rebuild', action='store_true', help="Rebuild the bitmap index.")
+    add_label_cache_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    start_metrics(args)
+    configure_label_cache(args)
+
+    with open(os.path.join(args.dataset, args.yaml), 'r') as f:
+        class_names = yaml.safe_load(f)['names']
+    if isinstance(class_names, dict):
+        class_names = [class_names[k] for k in sorted(class_names)]
+
+    begin_stage("index")
+    bitmap_index = open_index(args.dataset, class_names, rebuild=args.rebuild, verbose=True)
+    begin_stage("query")
+    try:
+        result = bitmap_index.query(args.expression, args.split)
+    except ValueError as e:
+        print(f"❌ Invalid query: {e}")
+        raise SystemExit(1)
+    for split, stems in result.items():
+        print(f"{split}: {len(stems)} images")
+        if args.list:
+            for stem in stems:
+                print(f"  {stem}")
+    counts = bitmap_index.class_counts(result)
+    print("Images per class in the result:")
+    for class_id in np.nonzero(counts)[0].tolist():
+        print(f"  - {class_names[class_id]}: {counts[class_id]}")
+    finish_metrics(args)
@@ -0,0 +1,173 @@
+import os
+import json
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import yaml
+from classtable import normalize_class_name
+from instrument import count
+
+# libyaml's C loader is many times faster than the pure-Python one; same results.
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+# Bump when the registry layout changes; an old registry is then rebuilt.
+REGISTRY_VERSION = 1
+REGISTRY_NAME = 'class_registry.json'
+YAML_NAME = 'data.yaml'
+DISCOVERY_WORKERS = 8
+
+
+def default_registry_path(datasets_parent):
+    """The registry lives in the folder of source datasets, next to them."""
+    return os.path.join(datasets_parent, REGISTRY_NAME)
+
+
+def read_yaml_classes(yaml_path):
+    """
+    Class names of a data.yaml, written as a list or as an {id: name} mapping.
+
+    Raises:
+        OSError, yaml.YAMLError: If the file cannot be read or parsed.
+    """
+    with open(yaml_path, 'r') as f:
+        data = yaml.load(f, Loader=SafeLoader) or {}
+    names = (data.get('names') or []) if isinstance(data, dict) else []
+    if isinstance(names, dict):
+        names = [names[key] for key in sorted(names)]
+    return [str(name).strip() for name in names]
+
+
+def master_names(spellings, previous=None):
+    """
+    The master class list for the class name spellings of all datasets.
+
+    Names that only differ in case or surrounding spaces are one class, named
+    by its most common spelling. Classes of `previous` keep their position (and
+    so their id); new classes are appended in sorted order.
+    """
+    by_key = {}
+    for name, _ in sorted(spellings.items(), key=lambda item: (-item[1], item[0])):
+        by_key.setdefault(normalize_class_name(name), name)
+
+    names = list(previous or [])
+    known = {normalize_class_name(name) for name in names}
+    names.extend(sorted(name for key, name in by_key.items() if key not in known))
+    return names
+
+
+def load_class_registry(registry_path):
+    """The registry at `registry_path`, or None if it is missing, unreadable or of another version."""
+    try:
+        with open(registry_path, 'r', encoding='utf-8') as f:
+            registry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if registry.get('version') != REGISTRY_VERSION:
+        return None
+    return registry
+
+
+def save_class_registry(registry_path, registry):
+    tmp_path = registry_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(registry, f, indent=2)
+    os.replace(tmp_path, registry_path)
+
+
+def _read_dataset(yaml_path):
+    try:
+        return read_yaml_classes(yaml_path), None
+    except (OSError, yaml.YAMLError) as e:
+        return [], str(e)
+
+
+def discover_classes(datasets_parent, registry_path=None, workers=DISCOVERY_WORKERS, use_cache=True,
+                     renumber=False, verbose=True):
+    """
+    Builds or refreshes the class registry of a folder of datasets.
+
+    Every '<dataset>/data.yaml' is stat-ed; only files whose size or mtime
+    differ from the previous registry are parsed, in parallel. The registry
+    holds the master class list, its normalized keys and, per dataset, the
+    class names of its data.yaml and the table old id -> master id (-1 for
+    none). It is rewritten only when something changed.
+
+    Args:
+        datasets_parent: Folder with one sub-folder per dataset.
+        registry_path: Where the registry lives (default: REGISTRY_NAME in datasets_parent).
+        workers (int): Parallel YAML parsers.
+        use_cache (bool): Set to False to parse every data.yaml again.
+        renumber (bool): Sort the master list from scratch instead of keeping the
+            ids of the previous registry (new classes are appended by default).
+
+    Returns:
+        dict: The registry.
+    """
+    registry_path = registry_path or default_registry_path(datasets_parent)
+    previous = load_class_registry(registry_path)
+    cached = previous['datasets'] if previous is not None and use_cache else {}
+
+    current = []
+    with os.scandir(datasets_parent) as entries:
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            yaml_path = os.path.join(entry.path, YAML_NAME)
+            try:
+                st = os.stat(yaml_path)
+            except OSError:
+                continue
+            current.append((entry.name, yaml_path, st.st_size, st.st_mtime_ns))
+    current.sort()
+    count('files_scanned', len(current))
+    count('stat_calls', len(current))
+
+    datasets = {}
+    changed = []
+    for name, yaml_path, size, mtime in current:
+        hit = cached.get(name)
+        if hit is not None and hit['size'] == size and hit['mtime_ns'] == mtime:
+            datasets[name] = {'yaml': YAML_NAME, 'size': size, 'mtime_ns': mtime, 'names': hit['names'],
+                              'error': hit.get('error')}
+        else:
+            changed.append((name, yaml_path, size, mtime))
+
+    if changed:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            results = list(pool.map(_read_dataset, [yaml_path for _, yaml_path, _, _ in changed]))
+        for (name, _, size, mtime), (names, error) in zip(changed, results):
+            datasets[name] = {'yaml': YAML_NAME, 'size': size, 'mtime_ns': mtime, 'names': names, 'error': error}
+    count('yamls_parsed', len(changed))
+    count('yamls_reused', len(current) - len(changed))
+    datasets = dict(sorted(datasets.items()))
+
+    spellings = Counter()
+    for entry in datasets.values():
+        spellings.update(entry['names'])
+    kept_names = None if previous is None or renumber else previous['names']
+    names = master_names(spellings, kept_names)
+    class_map = {normalize_class_name(name): i for i, name in enumerate(names)}
+    for entry in datasets.values():
+        entry['table'] = [class_map.get(normalize_class_name(name), -1) for name in entry['names']]
+
+    registry = {'version': REGISTRY_VERSION, 'names': names, 'keys': [normalize_class_name(name) for name in names],
+                'datasets': datasets}
+    unchanged = previous is not None and {key: previous.get(key) for key in registry} == registry
+    if not unchanged:
+        save_class_registry(registry_path, registry)
+
+    if verbose:
+        print(f"   - {len(datasets)} data.yaml files: {len(current) - len(changed)} cached, {len(changed)} parsed "
+              f"({'C' if SafeLoader is not yaml.SafeLoader else 'Python'} loader).")
+        for name, entry in datasets.items():
+            if entry['error']:
+                print(f"   ⚠ Error reading {name}/{YAML_NAME}: {entry['error']}")
+        unused = set(class_map) - {normalize_class_name(n) for n in spellings}
+        if unused:
+            print(f"   ℹ {len(unused)} classes of the registry are no longer in any data.yaml "
+                  f"(kept so the ids stay the same; renumber to drop them).")
+        if not unchanged:
+            print(f"   - Registry with {len(names)} classes written to {registry_path}")
+    return registry
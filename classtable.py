@@ -0,0 +1,110 @@
+from collections import Counter
+import numpy as np
+
+
+def normalize_class_name(name):
+    """Key used to match class names across datasets ('  Black Rust' -> 'black rust')."""
+    return str(name).strip().lower()
+
+
+def compile_class_table(old_classes, new_class_map, normalize=None):
+    """
+    Compiles a dataset's class list into an integer lookup array.
+
+    Args:
+        old_classes (list): Class names of the source dataset, indexed by old id.
+        new_class_map (dict): Class name (or normalized key) -> new id.
+        normalize: Optional function applied to each old name before the lookup.
+
+    Returns:
+        np.ndarray: table[old_id] is the new id, or -1 if the class is dropped.
+    """
+    if normalize is None:
+        normalize = str
+    return np.array([new_class_map.get(normalize(name), -1) for name in old_classes], dtype=np.int32)
+
+
+def parse_label_lines(texts):
+    """
+    Splits YOLO label texts into one class-id array plus the rest of every line.
+
+    Returns:
+        (np.ndarray, list, np.ndarray, Counter): class ids of all annotation lines,
+        the untouched coordinates of each line, the number of lines per text, and
+        first tokens that are not integers (those lines are skipped).
+    """
+    class_ids = []
+    rests = []
+    counts = []
+    not_numeric = Counter()
+    for text in texts:
+        count = 0
+        for line in text.splitlines():
+            parts = line.split()
+            if not parts:
+                continue
+            try:
+                class_ids.append(int(parts[0]))
+            except ValueError:
+                not_numeric[parts[0]] += 1
+                continue
+            rests.append(' '.join(parts[1:]))
+            count += 1
+        counts.append(count)
+    return np.array(class_ids, dtype=np.int64), rests, np.array(counts, dtype=np.int64), not_numeric
+
+
+def remap_label_texts(texts, table):
+    """
+    Remaps many label files at once with a compiled class table.
+
+    The class ids of all files are translated with one vectorized lookup;
+    lines whose class maps to -1 are dropped.
+
+    Returns:
+        (list, np.ndarray, Counter): new label text per input ('' when nothing
+        is kept), dropped-annotation counts per old class id, and counts of
+        invalid ids (out of range or not a number).
+    """
+    class_ids, rests, counts, invalid = parse_label_lines(texts)
+
+    valid = (class_ids >= 0) & (class_ids < len(table))
+    new_ids = np.full(len(class_ids), -1, dtype=np.int32)
+    new_ids[valid] = table[class_ids[valid]]
+    keep = new_ids >= 0
+
+    unknown = np.bincount(class_ids[valid & ~keep], minlength=len(table))
+    invalid.update(class_ids[~valid].tolist())
+
+    new_ids = new_ids.tolist()
+    keep = keep.tolist()
+    new_texts = []
+    start = 0
+    for count in counts.tolist():
+        end = start + count
+        new_texts.append('\n'.join(f"{new_ids[j]} {rests[j]}" for j in range(start, end) if keep[j]))
+        start = end
+    return new_texts, unknown, invalid
+
+
+class RemapReport:
+    """Collects dropped annotations so they are reported once instead of once per line."""
+
+    def __init__(self):
+        self.unknown = Counter()   # (dataset, class name) -> annotations
+        self.invalid = Counter()   # (dataset, class id) -> annotations
+
+    def add(self, dataset, old_classes, unknown_counts, invalid_counts):
+        for old_id in np.nonzero(unknown_counts)[0].tolist():
+            self.unknown[(dataset, old_classes[old_id])] += int(unknown_counts[old_id])
+        for old_id, count in invalid_counts.items():
+            self.invalid[(dataset, old_id)] += count
+
+    def print_summary(self):
+        if not self.unknown and not self.invalid:
+            return
+        print("\n⚠ Dropped annotations:")
+        for (dataset, name), count in sorted(self.unknown.items()):
+            print(f"   - Unknown class '{name}' in {dataset}: {count} annotations")
+        for (dataset, class_id), count in sorted(self.invalid.items(), key=lambda item: str(item[0])):
+            print(f"   - Invalid class index {class_id} in {dataset}: {count} annotations")
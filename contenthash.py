@@ -0,0 +1,128 @@
+import os
+import json
+import hashlib
+import functools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from instrument import count
+
+# Bump when the layout of the cache file changes; old caches are then rebuilt.
+HASH_CACHE_VERSION = 1
+HASH_CACHE_NAME = 'content_hashes.json'
+
+# Hashing is CPU bound (SHA-1 runs at a few hundred MB/s per core), so it uses processes.
+HASH_WORKERS = os.cpu_count() or 1
+# Fewer files than this are hashed in the calling process; starting a pool costs more.
+MIN_POOL_FILES = 256
+HASH_CHUNK = 1 << 20
+
+
+def add_hash_workers_argument(parser, default=HASH_WORKERS):
+    """Adds the shared --hash-workers option to an argparse parser."""
+    parser.add_argument('--hash-workers', type=int, default=default,
+                        help="Processes hashing file contents (1 hashes in the calling process).")
+
+
+def content_digest(path):
+    """SHA-1 of a file's contents, read in 1 MB chunks."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class HashCache:
+    """
+    Content hashes of files, kept between runs keyed by (path, size, mtime).
+
+    Only files that are new or whose size or mtime changed are read again;
+    those are hashed in a process pool. `save()` keeps the entries looked up
+    since the cache was loaded, so files that went away drop out of it.
+
+    `digest` may be any module-level function path -> JSON value (e.g. a
+    perceptual hash); `kind` names it, and a cache of another kind is ignored.
+    Digests that mostly wait on the disk (reading a few header bytes) are
+    better served by `executor='thread'`. `bytes_counter` names the metric
+    the sizes of the files read are added to; None for digests that do not
+    read whole files (they count what they read themselves).
+
+        cache = HashCache(output_path / HASH_CACHE_NAME)
+        digests = cache.hash_files(image_paths)
+        cache.save()
+    """
+
+    def __init__(self, cache_path, digest=content_digest, kind='sha1', executor='process',
+                 bytes_counter='bytes_hashed'):
+        self.cache_path = os.fspath(cache_path)
+        self.digest = digest
+        self.kind = kind
+        self.executor = executor
+        self.bytes_counter = bytes_counter
+        self._entries = {}
+        self._used = {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == HASH_CACHE_VERSION and data.get('kind', 'sha1') == kind:
+                self._entries = data['files']
+        except (OSError, ValueError):
+            pass
+
+    def hash_files(self, paths, workers=HASH_WORKERS):
+        """
+        Returns the digest of every path, in order (None for unreadable files).
+        """
+        digests = [None] * len(paths)
+        missing = []
+        for i, path in enumerate(paths):
+            path = os.fspath(path)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+                digests[i] = entry[2]
+                self._used[path] = entry
+            else:
+                missing.append((i, path, st.st_size, st.st_mtime_ns))
+        count('stat_calls', len(paths))
+        count('hashes_reused', len(paths) - len(missing))
+
+        missing_paths = [path for _, path, _, _ in missing]
+        digest_or_none = functools.partial(_digest_or_none, self.digest)
+        if workers > 1 and len(missing) >= MIN_POOL_FILES:
+            pool_class = ThreadPoolExecutor if self.executor == 'thread' else ProcessPoolExecutor
+            with pool_class(max_workers=workers) as pool:
+                results = list(pool.map(digest_or_none, missing_paths,
+                                        chunksize=max(1, len(missing) // (workers * 8))))
+        else:
+            results = [digest_or_none(path) for path in missing_paths]
+
+        for (i, path, size, mtime), digest in zip(missing, results):
+            digests[i] = digest
+            if digest is not None:
+                self._used[path] = [size, mtime, digest]
+                if self.bytes_counter:
+                    count(self.bytes_counter, size)
+        count('files_hashed', len(missing))
+        return digests
+
+    def save(self):
+        """Writes the entries used by this run, atomically, if anything changed."""
+        if self._used == self._entries:
+            return
+        tmp_path = self.cache_path + '.tmp'
+        os.makedirs(os.path.dirname(os.path.abspath(tmp_path)), exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': HASH_CACHE_VERSION, 'kind': self.kind, 'files': self._used}, f)
+        os.replace(tmp_path, self.cache_path)
+        self._entries = dict(self._used)
+
+
+def _digest_or_none(digest, path):
+    try:
+        return digest(path)
+    except (OSError, ValueError):
+        # Unreadable, or (for decoding digests) not a valid image
+        return None
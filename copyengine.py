@@ -0,0 +1,163 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from materialize import materialize_file, write_label
+from instrument import count
+
+# Copy threads used when a script does not say otherwise. Small-file copies
+# are latency bound, so several in flight keep SSDs and network mounts busy.
+COPY_WORKERS = 8
+
+# At most this many queued copies per worker; submit() blocks beyond that,
+# so a generator of millions of files never piles up in memory.
+IN_FLIGHT_PER_WORKER = 4
+
+# Only the first few failures are printed one by one.
+MAX_PRINTED_ERRORS = 10
+
+
+def add_copy_workers_argument(parser, default=COPY_WORKERS):
+    """Adds the shared --copy-workers option to an argparse parser."""
+    parser.add_argument('--copy-workers', type=int, default=default,
+                        help="Parallel file copies (1 copies serially in the calling thread).")
+
+
+class CopyExecutor:
+    """
+    Places files on a bounded thread pool and reports the throughput.
+
+    Use as a context manager; leaving the block waits for every copy:
+
+        with CopyExecutor(workers=8, link_mode='hardlink') as copier:
+            copier.make_dirs([dest_img_dir, dest_lbl_dir])
+            for src, dst in pairs:
+                copier.submit(src, dst)
+        copier.report("train")
+
+    With workers=1 every call runs inline, so the serial behaviour (and error
+    order) of the scripts is kept.
+    """
+
+    def __init__(self, workers=COPY_WORKERS, link_mode='copy', preserve_metadata=False, max_in_flight=None):
+        self.workers = max(1, int(workers))
+        self.link_mode = link_mode
+        self.preserve_metadata = preserve_metadata
+        self.files = 0
+        self.bytes = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._pool = None
+        self._in_flight = None
+        self._error = None
+        self._started = time.perf_counter()
+        self._elapsed = None
+        if self.workers > 1:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers)
+            self._in_flight = threading.BoundedSemaphore(max_in_flight or self.workers * IN_FLIGHT_PER_WORKER)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def make_dirs(self, dirs):
+        """Creates all output folders once, up front, instead of per file."""
+        for path in sorted(set(os.fspath(d) for d in dirs)):
+            os.makedirs(path, exist_ok=True)
+
+    def submit(self, src, dst, link_mode=None, preserve_metadata=None, on_done=None):
+        """Queues one file placement (see materialize_file)."""
+        link_mode = self.link_mode if link_mode is None else link_mode
+        preserve_metadata = self.preserve_metadata if preserve_metadata is None else preserve_metadata
+        self.submit_task(self._place, src, dst, link_mode, preserve_metadata, on_done=on_done)
+
+    def submit_label(self, dst, text, src=None, src_text=None, link_mode=None, on_done=None):
+        """Queues one label write (see write_label)."""
+        link_mode = self.link_mode if link_mode is None else link_mode
+        self.submit_task(self._write_label, dst, text, src, src_text, link_mode, on_done=on_done)
+
+    def submit_task(self, fn, *args, on_done=None):
+        """
+        Queues any file task. `fn` returns the bytes it wrote (or any other status);
+        `on_done(result, error)` is called with its return value, or with the
+        OSError it raised.
+        """
+        if self._pool is None:
+            self._run(fn, args, on_done)
+            return
+        self._in_flight.acquire()
+        try:
+            self._pool.submit(self._run, fn, args, on_done, True)
+        except BaseException:
+            self._in_flight.release()
+            raise
+
+    def close(self):
+        """Waits for all queued tasks; re-raises the first unexpected error."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        if self._elapsed is None:
+            self._elapsed = time.perf_counter() - self._started
+            count('files_copied', self.files)
+            count('bytes_copied', self.bytes)
+            count('errors', self.failed)
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def report(self, what="files"):
+        """Prints files, bytes and throughput of everything run so far."""
+        elapsed = self._elapsed if self._elapsed is not None else time.perf_counter() - self._started
+        elapsed = max(elapsed, 1e-9)
+        failed = f", {self.failed} failed" if self.failed else ""
+        print(f"   - Copied {self.files} {what} ({self.bytes / 1024 ** 2:.1f} MB) in {elapsed:.2f}s: "
+              f"{self.bytes / 1024 ** 2 / elapsed:.1f} MB/s, {self.files / elapsed:.0f} files/s "
+              f"[{self.workers} workers, {self.link_mode}]{failed}")
+
+    # --- Internals ---
+
+    def _place(self, src, dst, link_mode, preserve_metadata):
+        used = materialize_file(src, dst, link_mode, preserve_metadata)
+        # Links do not write image bytes; count what a copy would have moved
+        return os.path.getsize(dst) if used == 'copy' else 0
+
+    def _write_label(self, dst, text, src, src_text, link_mode):
+        if write_label(dst, text, src=src, src_text=src_text, link_mode=link_mode) == 'copy':
+            return len(text.encode('utf-8'))
+        return 0
+
+    def _run(self, fn, args, on_done, release=False):
+        result = error = None
+        try:
+            result = fn(*args)
+        except OSError as e:
+            error = e
+        except BaseException as e:
+            if not release:
+                raise
+            # Pool thread: keep the first unexpected error for close() to re-raise
+            with self._lock:
+                if self._error is None:
+                    self._error = e
+            self._in_flight.release()
+            return
+
+        with self._lock:
+            if error is None:
+                self.files += 1
+                if isinstance(result, int):
+                    self.bytes += result
+            else:
+                self.failed += 1
+                if self.failed <= MAX_PRINTED_ERRORS:
+                    print(f"[ERROR] {fn.__name__.strip('_')} failed: {error}")
+                elif self.failed == MAX_PRINTED_ERRORS + 1:
+                    print("[ERROR] More failures; only the count is reported from now on.")
+        if release:
+            self._in_flight.release()
+        if on_done is not None:
+            on_done(result, error)
@@ -1,22 +1,59 @@
 import yaml
+import argparse
+import numpy as np
 from pathlib import Path
 from collections import Counter
+from labelcache import load_label_table, add_label_cache_arguments, configure_label_cache
+from packeddataset import PackedDataset, is_pack
+from instrument import add_metrics_arguments, begin_stage, start_metrics, finish_metrics
 
 # --- CONFIGURATION ---
 
-# 1. Set the path to your main dataset folder (e.g., master_dataset or master_dataset_filtered)
+# 1. Set the path to your main dataset folder (e.g., master_dataset or master_dataset_filtered),
+#    or to a pack folder written by packeddataset.py
 DATASET_PATH = Path(r"C:\Users\HP\Desktop\master_dataset")
 
 # 2. Set the name of your YAML file
 YAML_FILENAME = "master.yaml"
 
+SPLITS = ['train', 'valid', 'test']
+
 
 # --- SCRIPT LOGIC ---
 
+def count_split(dataset_path, split, num_classes):
+    """
+    Counts one split with NumPy.
+
+    Returns:
+        (int, np.ndarray, np.ndarray): number of label files, instances per class
+        and images per class (unique classes per image), or None if the split
+        has no labels folder.
+    """
+    if is_pack(dataset_path):
+        # Packed datasets carry their parsed labels; no label file is opened
+        with PackedDataset(dataset_path) as pack:
+            if split not in pack:
+                return None
+            labels = pack[split].label_table()
+    else:
+        labels_dir = dataset_path / split / 'labels'
+        if not labels_dir.is_dir():
+            return None
+        labels = load_label_table(labels_dir)
+
+    class_ids = labels.class_id[labels.class_id >= 0]
+    instances = np.bincount(class_ids, minlength=num_classes)
+
+    _, unique_classes = labels.unique_image_classes()
+    images_per_class = np.bincount(unique_classes[unique_classes >= 0], minlength=num_classes)
+    return len(labels), instances, images_per_class
+
 def count_class_instances(dataset_path, yaml_filename):
     """Counts instances of each class in a YOLO dataset."""
     
     yaml_path = dataset_path / yaml_filename
+    begin_stage("read yaml")
     
     # Load the YAML file to get class names
     try:
@@ -34,33 +71,30 @@ def count_class_instances(dataset_path, yaml_filename):
         print(f"❌ Error: Could not read or parse {yaml_path}. Details: {e}")
         return
 
-    class_counts = Counter()
+    num_classes = max(class_names) + 1 if class_names else 0
+
+    # Each split comes back as NumPy count arrays; the label cache makes re-runs cheap
+    begin_stage("count")
+    results = [count_split(dataset_path, split, num_classes) for split in SPLITS]
+
     image_counts = Counter()
-    
-    # Iterate through train, valid, and test splits
-    for split in ['train', 'valid', 'test']:
-        labels_dir = dataset_path / split / 'labels'
-        
-        if not labels_dir.is_dir():
+    split_instances = {}
+    split_images_per_class = {}
+    for split, result in zip(SPLITS, results):
+        if result is None:
             print(f"⚠️  Warning: No 'labels' directory found for '{split}' split. Skipping.")
             continue
-        
-        # Count images by counting label files
-        label_files = list(labels_dir.glob('*.txt'))
-        image_counts[split] = len(label_files)
-        
-        # Count class instances within the label files
-        for label_file in label_files:
-            with open(label_file, 'r') as f:
-                for line in f:
-                    try:
-                        class_id = int(line.strip().split()[0])
-                        class_counts[class_id] += 1
-                    except (ValueError, IndexError):
-                        # Handle empty or malformed lines
-                        pass
+        image_counts[split], split_instances[split], split_images_per_class[split] = result
+
+    size = max([num_classes] + [len(c) for c in split_instances.values()])
+    class_counts = np.zeros(size, dtype=np.int64)
+    images_per_class = np.zeros(size, dtype=np.int64)
+    for split in split_instances:
+        class_counts[:len(split_instances[split])] += split_instances[split]
+        images_per_class[:len(split_images_per_class[split])] += split_images_per_class[split]
 
     # --- Print the Report ---
+    begin_stage("report")
     print("\n" + "="*40)
     print("📊 DATASET ANALYSIS REPORT")
     print("="*40)
@@ -72,11 +106,34 @@ def count_class_instances(dataset_path, yaml_filename):
 
     print("\nTotal Instances per Class (across all splits):")
     for class_id, class_name in sorted(class_names.items()):
-        count = class_counts.get(class_id, 0)
+        count = class_counts[class_id]
         print(f"  - ID {class_id:2d} | {class_name:<40} | {count} instances")
-        
+
+    print("\nImages per Class (an image counts once per class it contains):")
+    for class_id, class_name in sorted(class_names.items()):
+        count = images_per_class[class_id]
+        print(f"  - ID {class_id:2d} | {class_name:<40} | {count} images")
+
+    print("\nPer-Split Breakdown (instances / images):")
+    splits = list(split_instances)
+    print(f"  {'ID':>5} | {'Class':<40} | " + " | ".join(f"{s.capitalize():>15}" for s in splits))
+    for class_id, class_name in sorted(class_names.items()):
+        cells = []
+        for split in splits:
+            instances = split_instances[split][class_id] if class_id < len(split_instances[split]) else 0
+            images = split_images_per_class[split][class_id] if class_id < len(split_images_per_class[split]) else 0
+            cells.append(f"{f'{instances} / {images}':>15}")
+        print(f"  {class_id:5d} | {class_name:<40} | " + " | ".join(cells))
+
     print("="*40)
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Count instances and images per class of a YOLO dataset or pack.")
+    add_label_cache_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    start_metrics(args)
+    configure_label_cache(args)
     count_class_instances(DATASET_PATH, YAML_FILENAME)
+    finish_metrics(args)
@@ -0,0 +1,371 @@
+import os
+import gc
+import zlib
+import argparse
+import tracemalloc
+from array import array
+from collections import defaultdict
+import numpy as np
+from imageindex import ImageIndex, IMAGE_EXTENSIONS, report_orphans
+from labelcache import add_label_cache_arguments, configure_label_cache, load_label_table
+from instrument import add_metrics_arguments, begin_stage, count, start_metrics, finish_metrics
+
+# --- CONFIGURATION ---
+# Dataset whose index is measured when this file is run as a script
+DATASET_PATH = r"C:\Users\HP\Desktop\master_dataset"
+SPLITS = ['train', 'valid', 'test']
+# ---------------------
+
+# Names are zlib-compressed in blocks of this many; name() decompresses one block.
+NAME_BLOCK = 64
+
+
+class DatasetIndex:
+    """
+    Compact index of the images of a dataset and the classes they contain.
+
+    Every image is interned once into an integer id. Names are stored
+    zlib-compressed in blocks of NAME_BLOCK, the split is one byte per image
+    and class membership is a CSR array:
+
+        class_images[class_ptr[c]:class_ptr[c + 1]]   image ids of class c (sorted)
+
+    so the scripts can count, sample and trim with NumPy instead of holding
+    dicts of file-name lists. The image -> classes direction is derived on
+    demand with image_class_csr(). Images are added split by split with
+    add_split() (or add_label_table()), then finalize() builds the arrays.
+    """
+
+    def __init__(self, splits=SPLITS):
+        self.splits = list(splits)
+        self._name_blocks = bytearray()
+        self._block_offsets = array('Q', [0])
+        self._pending_names = []
+        self._num_images = 0
+        self._split = array('B')
+        self._sizes = None
+        self._label_sizes = None
+        self._pair_images = array('I')
+        self._pair_classes = array('I')
+        self._cached_block = (-1, None)
+        self.num_classes = 0
+
+        self.split_id = None
+        self.sizes = None
+        self.label_sizes = None
+        self.class_ptr = None
+        self.class_images = None
+
+    def __len__(self):
+        return self._num_images
+
+    # --- Building ---
+
+    def add_split(self, split, names, image_ids, class_ids, sizes=None, label_sizes=None):
+        """
+        Adds the images of one split.
+
+        Args:
+            split (str): One of self.splits.
+            names (list): File name of every image of the split.
+            image_ids, class_ids: One (image, class) pair per annotation or per
+                unique pair; positions refer to `names`. Duplicates are dropped.
+            sizes (list): Optional byte size of every image (image + label).
+            label_sizes (list): Optional byte size of every image's label alone.
+
+        Returns:
+            int: The id of names[0]; the split occupies the next len(names) ids.
+        """
+        first = len(self)
+        split_code = self.splits.index(split)
+        for name in names:
+            self._pending_names.append(name)
+            if len(self._pending_names) == NAME_BLOCK:
+                self._flush_names()
+        self._num_images += len(names)
+        self._split.extend([split_code] * len(names))
+        if sizes is not None:
+            if self._sizes is None:
+                self._sizes = array('q')
+            self._sizes.extend([0] * (first - len(self._sizes)))
+            self._sizes.extend(sizes)
+        if label_sizes is not None:
+            if self._label_sizes is None:
+                self._label_sizes = array('I')
+            self._label_sizes.extend([0] * (first - len(self._label_sizes)))
+            self._label_sizes.extend(label_sizes)
+
+        image_ids = np.asarray(image_ids, dtype=np.int64)
+        class_ids = np.asarray(class_ids, dtype=np.int64)
+        valid = (class_ids >= 0) & (image_ids >= 0)
+        self._pair_images.frombytes((image_ids[valid] + first).astype(np.uint32).tobytes())
+        self._pair_classes.frombytes(class_ids[valid].astype(np.uint32).tobytes())
+        if valid.any():
+            self.num_classes = max(self.num_classes, int(class_ids[valid].max()) + 1)
+        return first
+
+    def _flush_names(self):
+        if self._pending_names:
+            self._name_blocks += zlib.compress('\n'.join(self._pending_names).encode('utf-8'))
+            self._block_offsets.append(len(self._name_blocks))
+            self._pending_names = []
+
+    def add_label_table(self, split, labels, image_names, sizes=None):
+        """
+        Adds a split from a LabelTable.
+
+        `image_names` holds the image file name of every label row (None when
+        the label has no image); only labels with an image are added. With
+        `sizes`, the label sizes of the table are recorded in label_sizes too.
+        """
+        rows = [i for i, name in enumerate(image_names) if name is not None]
+        row_to_image = np.full(len(image_names), -1, dtype=np.int64)
+        row_to_image[rows] = np.arange(len(rows))
+
+        pair_rows, pair_classes = labels.unique_image_classes()
+        pair_images = row_to_image[pair_rows] if len(pair_rows) else pair_rows.astype(np.int64)
+        kept_sizes = kept_label_sizes = None
+        if sizes is not None:
+            kept_sizes = [sizes[i] for i in rows]
+            kept_label_sizes = labels.sizes[rows].tolist()
+        return self.add_split(split, [image_names[i] for i in rows], pair_images, pair_classes, kept_sizes,
+                              kept_label_sizes)
+
+    def finalize(self, num_classes=None):
+        """Builds the CSR arrays. Call once after the last add_split()."""
+        if num_classes is not None:
+            self.num_classes = max(self.num_classes, num_classes)
+        self._flush_names()
+        num_images = len(self)
+        images = np.frombuffer(self._pair_images, dtype=np.uint32).astype(np.int64)
+        classes = np.frombuffer(self._pair_classes, dtype=np.uint32).astype(np.int64)
+
+        # Each (class, image) pair once, sorted by class, then image
+        key = np.unique(classes * max(num_images, 1) + images)
+        classes, images = key // max(num_images, 1), key % max(num_images, 1)
+
+        self.class_ptr = np.zeros(self.num_classes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(classes, minlength=self.num_classes), out=self.class_ptr[1:])
+        self.class_images = images.astype(np.uint32)
+
+        self.split_id = np.frombuffer(self._split, dtype=np.uint8)
+        self.sizes = None
+        if self._sizes is not None:
+            self._sizes.extend([0] * (num_images - len(self._sizes)))
+            self.sizes = np.frombuffer(self._sizes, dtype=np.int64)
+        self.label_sizes = None
+        if self._label_sizes is not None:
+            self._label_sizes.extend([0] * (num_images - len(self._label_sizes)))
+            self.label_sizes = np.frombuffer(self._label_sizes, dtype=np.uint32)
+        # The pair buffers are no longer needed once the CSR arrays exist
+        self._pair_images = array('I')
+        self._pair_classes = array('I')
+        return self
+
+    @classmethod
+    def from_yolo(cls, dataset_path, splits=SPLITS, extensions=IMAGE_EXTENSIONS, with_sizes=False, verbose=False):
+        """
+        Indexes a YOLO dataset (<split>/images + <split>/labels) through the label cache.
+
+        Labels without an image are left out. With `with_sizes`, the size of
+        every image plus its label is recorded in `sizes`, and of the label
+        alone in `label_sizes`.
+        """
+        index = cls(splits)
+        for split in splits:
+            label_dir = os.path.join(dataset_path, split, 'labels')
+            image_dir = os.path.join(dataset_path, split, 'images')
+            if not os.path.exists(label_dir):
+                if verbose:
+                    print(f"   - Warning: No '{split}/labels' directory found. Skipping.")
+                continue
+            if verbose:
+                print(f"   - Processing '{split}' split...")
+
+            labels = load_label_table(label_dir, verbose=verbose)
+            stems = labels.stems.tolist()
+            image_index = ImageIndex(image_dir, extensions, with_sizes=with_sizes)
+            if verbose:
+                report_orphans(image_index.match_labels([stem + '.txt' for stem in stems]), split)
+
+            image_names = [image_index.find(stem) for stem in stems]
+            sizes = None
+            if with_sizes:
+                sizes = [(image_index.size(stem) or 0) + label_size
+                         for stem, label_size in zip(stems, labels.sizes.tolist())]
+            index.add_label_table(split, labels, image_names, sizes)
+        return index.finalize()
+
+    # --- Queries ---
+
+    def _names_of_block(self, block):
+        if self._cached_block[0] != block:
+            start, end = self._block_offsets[block], self._block_offsets[block + 1]
+            names = zlib.decompress(self._name_blocks[start:end]).decode('utf-8').split('\n')
+            self._cached_block = (block, names)
+        return self._cached_block[1]
+
+    def name(self, image_id):
+        """File name of an image (consecutive ids reuse the last decompressed block)."""
+        return self._names_of_block(image_id // NAME_BLOCK)[image_id % NAME_BLOCK]
+
+    def names(self):
+        """Yields the name of every image in id order."""
+        for block in range(len(self._block_offsets) - 1):
+            yield from self._names_of_block(block)
+
+    def stem(self, image_id):
+        return os.path.splitext(self.name(image_id))[0]
+
+    def split_of(self, image_id):
+        return self.splits[self.split_id[image_id]]
+
+    def images_of_class(self, class_id):
+        """Image ids containing `class_id`, in ascending order."""
+        return self.class_images[self.class_ptr[class_id]:self.class_ptr[class_id + 1]]
+
+    def images_of_classes(self, class_ids):
+        """Image ids containing any of `class_ids`, in ascending order."""
+        pieces = [self.images_of_class(c) for c in class_ids if 0 <= c < self.num_classes]
+        if not pieces:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(pieces))
+
+    def stems_by_split(self, image_ids):
+        """{split: set of image stems} of the given image ids."""
+        stems = {split: set() for split in self.splits}
+        for image_id in np.asarray(image_ids).tolist():
+            stems[self.splits[self.split_id[image_id]]].add(self.stem(image_id))
+        return stems
+
+    def stems_without_classes(self, class_ids):
+        """{split: set of stems} of the images containing none of `class_ids`."""
+        return self.stems_by_split(np.setdiff1d(np.arange(len(self)), self.images_of_classes(class_ids)))
+
+    def image_class_csr(self):
+        """
+        The transposed membership, built on demand (not kept by the index).
+
+        Returns:
+            (np.ndarray, np.ndarray): image_ptr and image_classes; the classes of
+            image i are image_classes[image_ptr[i]:image_ptr[i + 1]].
+        """
+        pair_classes = np.repeat(np.arange(self.num_classes, dtype=np.int64), np.diff(self.class_ptr))
+        order = np.argsort(self.class_images, kind='stable')
+        image_ptr = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.class_images, minlength=len(self)), out=image_ptr[1:])
+        return image_ptr, pair_classes[order]
+
+    def class_counts(self, weights=None):
+        """
+        Images per class.
+
+        Args:
+            weights: Optional per-image weights or boolean mask (e.g. images kept
+                after trimming, or 1 + duplicates after oversampling).
+        """
+        if weights is None:
+            return np.diff(self.class_ptr)
+        per_pair = np.asarray(weights, dtype=np.int64)[self.class_images]
+        cumulative = np.concatenate(([0], np.cumsum(per_pair)))
+        return cumulative[self.class_ptr[1:]] - cumulative[self.class_ptr[:-1]]
+
+    def memory_footprint(self):
+        """Bytes held by every part of the index."""
+        return {
+            'names': len(self._name_blocks) + self._block_offsets.itemsize * len(self._block_offsets),
+            'split': self.split_id.nbytes,
+            'sizes': sum(a.nbytes for a in (self.sizes, self.label_sizes) if a is not None),
+            'class -> images': self.class_ptr.nbytes + self.class_images.nbytes,
+        }
+
+    def print_footprint(self):
+        footprint = self.memory_footprint()
+        parts = ", ".join(f"{part} {size / 1024:.0f} KB" for part, size in footprint.items())
+        print(f"   - Index: {len(self)} images, {len(self.class_images)} image/class pairs, "
+              f"{sum(footprint.values()) / 1024 ** 2:.2f} MB ({parts}).")
+
+
+def build_dict_of_lists(dataset_path, splits=SPLITS, extensions=IMAGE_EXTENSIONS):
+    """
+    The structures the index replaces, built the way the scripts used to.
+
+    Returns:
+        (dict, dict): class id -> list of image names (one name object per
+        image, shared by its classes), and image name -> split.
+    """
+    class_to_images = defaultdict(list)
+    image_to_split = {}
+    for split in splits:
+        label_dir = os.path.join(dataset_path, split, 'labels')
+        if not os.path.exists(label_dir):
+            continue
+        labels = load_label_table(label_dir)
+        image_index = ImageIndex(os.path.join(dataset_path, split, 'images'), extensions)
+        names = [image_index.find(stem) for stem in labels.stems.tolist()]
+        for name in names:
+            if name is not None:
+                image_to_split[name] = split
+        image_ids, class_ids = labels.unique_image_classes()
+        for image_id, class_id in zip(image_ids.tolist(), class_ids.tolist()):
+            if names[image_id] is not None:
+                class_to_images[class_id].append(names[image_id])
+    return class_to_images, image_to_split
+
+
+def measure_footprint(dataset_path, splits=SPLITS):
+    """
+    Memory of the index and of the dict-of-lists it replaces, measured with tracemalloc.
+
+    Both are built from the same (warmed) label cache. `retained` is what is
+    still allocated once the structure is built, `peak` the most allocated
+    while building it.
+
+    Returns:
+        dict: {'dict_of_lists': {'retained': bytes, 'peak': bytes}, 'index': {...}}
+    """
+    # Warm the label cache, so neither measurement includes a first parse
+    DatasetIndex.from_yolo(dataset_path, splits)
+    builders = {
+        'dict_of_lists': lambda: build_dict_of_lists(dataset_path, splits),
+        'index': lambda: DatasetIndex.from_yolo(dataset_path, splits),
+    }
+    results = {}
+    for name, build in builders.items():
+        gc.collect()
+        tracemalloc.start()
+        structure = build()
+        gc.collect()
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del structure
+        results[name] = {'retained': retained, 'peak': peak}
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Index a dataset and measure its memory against the dict-of-lists the scripts used to build.")
+    parser.add_argument('dataset', nargs='?', default=DATASET_PATH, help="Dataset folder with train/valid/test splits.")
+    add_label_cache_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    start_metrics(args)
+    configure_label_cache(args)
+
+    begin_stage("index")
+    index = DatasetIndex.from_yolo(args.dataset, verbose=True)
+    index.print_footprint()
+
+    begin_stage("measure")
+    footprint = measure_footprint(args.dataset)
+    old, new = footprint['dict_of_lists'], footprint['index']
+    for name, measured in footprint.items():
+        count(f"{name}_retained_bytes", measured['retained'])
+        count(f"{name}_peak_bytes", measured['peak'])
+    print("\n📏 Memory (tracemalloc):")
+    print(f"   - dict-of-lists: {old['retained'] / 1024 ** 2:8.2f} MB retained, {old['peak'] / 1024 ** 2:8.2f} MB peak")
+    print(f"   - index:         {new['retained'] / 1024 ** 2:8.2f} MB retained, {new['peak'] / 1024 ** 2:8.2f} MB peak")
+    print(f"   - {old['retained'] / max(1, new['retained']):.1f}x smaller retained, "
+          f"{old['peak'] / max(1, new['peak']):.1f}x smaller peak")
+    finish_metrics(args)
@@ -1,7 +1,15 @@
-import os
-import shutil
+import argparse
 from pathlib import Path
+import numpy as np
 import yaml
+from materialize import add_link_mode_argument
+from copyengine import CopyExecutor, add_copy_workers_argument, COPY_WORKERS
+from journal import BuildJournal, add_resume_argument
+from instrument import METRICS, add_metrics_arguments, begin_stage, stage, start_metrics, finish_metrics
+from imageindex import ImageIndex, list_label_files, report_orphans
+from classtable import compile_class_table, remap_label_texts
+from datasetindex import DatasetIndex
+from labelcache import add_label_cache_arguments, configure_label_cache
 
 # ===================================================================
 # SETUP: YOU ONLY NEED TO EDIT THESE THREE VARIABLES
@@ -59,6 +67,11 @@ selected_classes = [
     'sheep',
     'smoke',
 ]
+
+# 4. (Optional) How images are placed in the output: 'copy', 'hardlink', 'reflink' or 'symlink'
+LINK_MODE = 'copy'
+# 5. (Optional) Parallel file copies (1 = one file at a time)
+COPY_THREADS = COPY_WORKERS
 # ===================================================================
 
 def get_class_list_from_yaml(yaml_path):
@@ -72,72 +85,92 @@ def get_class_list_from_yaml(yaml_path):
         print(f"⚠ Error reading {yaml_path}: {e}")
     return []
 
-def filter_and_copy_files(split, old_classes, new_class_map):
+def filter_and_copy_files(split, old_classes, new_class_map, link_mode=LINK_MODE, copy_workers=COPY_THREADS,
+                          journal=None, skip_stems=None):
     """
     Reads label files, keeps only selected classes with new IDs,
     and copies the corresponding images and new labels to the output folder.
+
+    The data.yaml class list is compiled once into an old id -> new id array and
+    applied to all annotations of the split in a single vectorized lookup.
+    With a BuildJournal, files go to its staging folder and files finished by
+    an interrupted run are skipped; without one they are written straight
+    into output_path. Label files whose stem is in `skip_stems` (images the
+    DatasetIndex knows to have none of the selected classes) are not opened.
+
+    Returns:
+        (int, int): Images copied, and files that could not be written.
     """
     image_dir = source_dataset_path / split / 'images'
     label_dir = source_dataset_path / split / 'labels'
 
     if not label_dir.is_dir() or not image_dir.is_dir():
         print(f"   ⚠ Skipping '{split}' (missing images or labels directory).")
-        return 0
+        return 0, 0
 
-    dest_img_dir = output_path / split / 'images'
-    dest_lbl_dir = output_path / split / 'labels'
-    dest_img_dir.mkdir(parents=True, exist_ok=True)
-    dest_lbl_dir.mkdir(parents=True, exist_ok=True)
+    dest_img_dir = f"{split}/images"
+    dest_lbl_dir = f"{split}/labels"
 
     images_copied_count = 0
 
-    for label_file_name in os.listdir(label_dir):
-        if not label_file_name.endswith('.txt'):
-            continue
-
-        new_labels = []
-        with open(label_dir / label_file_name, 'r') as f:
-            for line in f.readlines():
-                parts = line.strip().split()
-                if not parts:
-                    continue
-
-                old_cls_id = int(parts[0])
-
-                if old_cls_id < len(old_classes):
-                    class_name = old_classes[old_cls_id]
-                    # Check if this class is one we want to keep
-                    if class_name in new_class_map:
-                        new_cls_id = new_class_map[class_name]
-                        new_line = f"{new_cls_id} {' '.join(parts[1:])}"
-                        new_labels.append(new_line)
-                else:
-                    print(f"     ⚠ Invalid class index {old_cls_id} in {label_file_name}")
-
-        # If the file contains any of the selected classes, save the new label file and copy the image
-        if new_labels:
-            # Write the new label file
-            with open(dest_lbl_dir / label_file_name, 'w') as f:
-                f.write('\n'.join(new_labels))
-
-            # Find and copy the corresponding image
-            copied = False
-            for ext in ['.jpg', '.jpeg', '.png', '.bmp', '.webp']:
-                image_path = image_dir / f"{Path(label_file_name).stem}{ext}"
-                if image_path.exists():
-                    shutil.copy(image_path, dest_img_dir / f"{Path(label_file_name).stem}{ext}")
-                    copied = True
+    label_files = list_label_files(label_dir)
+    image_index = ImageIndex(image_dir)
+    report_orphans(image_index.match_labels(label_files), split)
+    if skip_stems:
+        label_files = [name for name in label_files if Path(name).stem not in skip_stems]
+
+    with stage("read labels"):
+        label_texts = []
+        for label_file_name in label_files:
+            with open(label_dir / label_file_name, 'r') as f:
+                label_texts.append(f.read())
+        METRICS.count("labels_parsed", len(label_files))
+
+    # Classes not in new_class_map map to -1 and are dropped
+    with stage("remap"):
+        class_table = compile_class_table(old_classes, new_class_map)
+        new_texts, _, invalid = remap_label_texts(label_texts, class_table)
+    for old_cls_id, count in invalid.items():
+        print(f"     ⚠ Invalid class index {old_cls_id} in {count} annotations")
+
+    copier = CopyExecutor(copy_workers, link_mode)
+
+    def write_label(rel_path, text, src, src_text):
+        if journal is not None:
+            journal.write_label(copier, rel_path, text, src=src, src_text=src_text)
+        else:
+            copier.submit_label(output_path / rel_path, text, src=src, src_text=src_text)
+
+    def copy_image(src, rel_path):
+        if journal is not None:
+            journal.copy(copier, src, rel_path)
+        else:
+            copier.submit(src, output_path / rel_path)
+
+    with stage("copy"), copier:
+        if journal is not None:
+            journal.make_dirs(copier, [dest_img_dir, dest_lbl_dir])
+        else:
+            copier.make_dirs([output_path / dest_img_dir, output_path / dest_lbl_dir])
+        for label_file_name, label_text, new_text in zip(label_files, label_texts, new_texts):
+            # If the file contains any of the selected classes, save the new label file and copy the image
+            if new_text:
+                # Write the new label file
+                write_label(f"{dest_lbl_dir}/{label_file_name}", new_text,
+                            src=label_dir / label_file_name, src_text=label_text)
+
+                # Find and copy the corresponding image
+                image_name = image_index.find(Path(label_file_name).stem)
+                if image_name is not None:
+                    copy_image(image_dir / image_name, f"{dest_img_dir}/{image_name}")
                     images_copied_count += 1
-                    break
-            
-            if not copied:
-                print(f"     ⚠ Image not found for label: {label_file_name}")
+    copier.report("images and labels")
 
-    return images_copied_count
+    return images_copied_count, copier.failed
 
-def create_output_yaml():
-    """Creates the final data.yaml for the new filtered dataset."""
-    yaml_path = output_path / "data.yaml"
+def create_output_yaml(yaml_dir=output_path):
+    """Creates the final data.yaml for the new filtered dataset (in `yaml_dir`, e.g. a staging folder)."""
+    yaml_path = Path(yaml_dir) / "data.yaml"
     with open(yaml_path, "w") as f:
         f.write(f"train: ../{output_path.name}/train/images\n")
         f.write(f"val: ../{output_path.name}/valid/images\n")
@@ -149,6 +182,16 @@ def create_output_yaml():
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Filter a YOLO dataset down to the selected classes.")
+    add_link_mode_argument(parser, default=LINK_MODE)
+    add_copy_workers_argument(parser, default=COPY_THREADS)
+    add_resume_argument(parser)
+    add_label_cache_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    start_metrics(args)
+    configure_label_cache(args)
+
     print("🚀 Starting dataset filtering process...")
     
     # Ensure the PyYAML package is installed
@@ -176,16 +219,37 @@ if __name__ == '__main__':
     # Create a mapping from the selected class name to its new ID (0, 1, 2...)
     new_class_mapping = {name: i for i, name in enumerate(selected_classes)}
 
+    # Images without any selected class (from the label cache) are skipped without reading their labels
+    begin_stage("index")
+    index = DatasetIndex.from_yolo(source_dataset_path)
+    selected_ids = np.flatnonzero(compile_class_table(original_class_list, new_class_mapping) >= 0)
+    skip_stems = index.stems_without_classes(selected_ids.tolist())
+
+    # The output is built in '<output>.staging' and only replaces the old one when complete
+    journal = BuildJournal(output_path, resume=args.resume)
     total_images = 0
+    total_failed = 0
     for split in ['train', 'valid', 'test']:
         print(f"  → Processing '{split}' split...")
-        count = filter_and_copy_files(split, original_class_list, new_class_mapping)
+        begin_stage(split)
+        count, failed = filter_and_copy_files(split, original_class_list, new_class_mapping, link_mode=args.link_mode,
+                                              copy_workers=args.copy_workers, journal=journal,
+                                              skip_stems=skip_stems[split])
         if count > 0:
             print(f"    ✅ Copied {count} images and their filtered labels.")
         total_images += count
-
-    if total_images > 0:
-        create_output_yaml()
+        total_failed += failed
+
+    begin_stage("publish")
+    if total_failed:
+        journal.close()
+        print(f"\n❌ {total_failed} files could not be copied. Fix the cause and re-run with --resume.")
+    elif total_images > 0:
+        journal.want("data.yaml")
+        create_output_yaml(journal.staging_dir)
+        journal.commit()
         print("\n✅ All done! Your new filtered dataset is ready in:", output_path)
     else:
+        journal.close()
         print("\n⏹️ Process finished, but no images were copied. Check if `selected_classes` match names in `data.yaml`.")
+    finish_metrics(args)
@@ -1,30 +1,33 @@
-import yaml
+import argparse
 from pathlib import Path
+from classregistry import discover_classes, default_registry_path, DISCOVERY_WORKERS
+from instrument import add_metrics_arguments, begin_stage, start_metrics, finish_metrics
 
 # --- CONFIGURATION ---
 datasets_parent = Path(r"C:\Users\HP\Desktop\abcdesease")
 # ---------------------
 
-all_classes = set()
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Collect the classes of every data.yaml into the class registry used by secondlythis.py.")
+    parser.add_argument('--registry', default=None,
+                        help="Registry file (default: class_registry.json in the datasets folder).")
+    parser.add_argument('--workers', type=int, default=DISCOVERY_WORKERS, help="Parallel YAML parsers.")
+    parser.add_argument('--no-cache', action='store_true', help="Parse every data.yaml, even unchanged ones.")
+    parser.add_argument('--renumber', action='store_true',
+                        help="Sort the master class list from scratch (class ids of earlier merges change).")
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    start_metrics(args)
 
-# Find all dataset folders
-dataset_paths = [p for p in datasets_parent.iterdir() if p.is_dir()]
+    begin_stage("discover")
+    registry = discover_classes(datasets_parent, args.registry or default_registry_path(datasets_parent),
+                                workers=args.workers, use_cache=not args.no_cache, renumber=args.renumber)
 
-for path in dataset_paths:
-    yaml_file = path / 'data.yaml'
-    if yaml_file.exists():
-        with open(yaml_file, 'r') as f:
-            try:
-                data = yaml.safe_load(f)
-                if 'names' in data and isinstance(data['names'], list):
-                    for name in data['names']:
-                        all_classes.add(str(name).strip())
-            except yaml.YAMLError as e:
-                print(f"Error reading {yaml_file}: {e}")
-
-# Print the final, sorted list
-sorted_classes = sorted(list(all_classes))
-print("master_class_list = [")
-for name in sorted_classes:
-    print(f"    '{name}',")
-print("]")
+    # Print the final, sorted list (the merge reads the registry; this is for reference)
+    begin_stage("report")
+    print("master_class_list = [")
+    for name in registry['names']:
+        print(f"    '{name}',")
+    print("]")
+    finish_metrics(args)
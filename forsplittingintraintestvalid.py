@@ -1,89 +1,493 @@
 import os
 import random
-import shutil
+import hashlib
+import argparse
+import threading
+from collections import Counter
+import numpy as np
+from materialize import add_link_mode_argument, materialize_file
+from copyengine import CopyExecutor
+from journal import BuildJournal, add_resume_argument
+from instrument import add_metrics_arguments, begin_stage, start_metrics, finish_metrics
+from imageindex import ImageIndex, list_label_files, report_orphans
+from labelcache import load_label_table, add_label_cache_arguments, configure_label_cache
 
 # --- Configuration ---
 # Set to "." because the script is in the same folder as 'images' and 'labels'
-SOURCE_DIR = "." 
-OUTPUT_DIR = "output" 
+SOURCE_DIR = "."
+OUTPUT_DIR = "output"
 TRAIN_RATIO = 0.7
 VALID_RATIO = 0.15
+# How files are placed in OUTPUT_DIR: 'copy', 'hardlink', 'reflink' or 'symlink'
+LINK_MODE = 'copy'
+
+# How images are assigned to splits:
+#   'shuffle' - shuffle the whole file list, then cut it by the ratios (set SEED to make it reproducible)
+#   'hash'    - stable hash of each file name against the ratios; streams the folder, so re-runs
+#               only add new images and never move existing ones
+#   'stratified' - multi-label iterative stratification on the labels, so every class (even one
+#               with a handful of images) is spread over the splits by the ratios
+# 'shuffle' and 'stratified' build the output in OUTPUT_DIR + '.staging' and swap it in when done
+# (an interrupted run continues with --resume); 'hash' updates OUTPUT_DIR in place (an interrupted
+# run continues by running it again) and removes pairs whose source image was deleted.
+SPLIT_MODE = 'shuffle'
+SEED = None
+COPY_WORKERS = 8
+
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png')
+SPLITS = ["train", "valid", "test"]
+# The hash split prunes outputs without a source image in batches of this many names
+PRUNE_BATCH = 4096
 
 # --- Get subdirectories ---
 source_images_dir = os.path.join(SOURCE_DIR, "images")
 source_labels_dir = os.path.join(SOURCE_DIR, "labels")
 
-print("--- Initial Setup ---")
-print(f"[*] Reading from: {os.path.abspath(source_images_dir)}")
-if not os.path.isdir(source_images_dir):
-    print("\n[FATAL ERROR] 'images' directory not found! ❌")
-    exit()
-print("[SUCCESS] Image directory found! ✅")
-
-# --- Find Files ---
-image_files = [f for f in os.listdir(source_images_dir) if f.endswith(('.jpg', '.jpeg', '.png'))]
-print(f"[*] Found {len(image_files)} total images.")
-if len(image_files) == 0:
-    print("\n[FATAL ERROR] No images found in the 'images' directory. ❌")
-    exit()
-print("--- Setup Complete ---\n")
-
-# --- Create destination directories ---
-os.makedirs(os.path.join(OUTPUT_DIR, "train", "images"), exist_ok=True)
-os.makedirs(os.path.join(OUTPUT_DIR, "train", "labels"), exist_ok=True)
-os.makedirs(os.path.join(OUTPUT_DIR, "valid", "images"), exist_ok=True)
-os.makedirs(os.path.join(OUTPUT_DIR, "valid", "labels"), exist_ok=True)
-os.makedirs(os.path.join(OUTPUT_DIR, "test", "images"), exist_ok=True)
-os.makedirs(os.path.join(OUTPUT_DIR, "test", "labels"), exist_ok=True)
-print("Created output directory structure successfully!\n")
-
-# --- Splitting Logic ---
-random.shuffle(image_files)
-total_files = len(image_files)
-train_end = int(total_files * TRAIN_RATIO)
-valid_end = train_end + int(total_files * VALID_RATIO)
-
-train_files = image_files[:train_end]
-valid_files = image_files[train_end:valid_end]
-test_files = image_files[valid_end:]
-
-print("--- Data Split Calculation ---")
-print(f"[*] Total images to split: {total_files}")
-print(f"[*] Training files count: {len(train_files)}")
-print(f"[*] Validation files count: {len(valid_files)}")
-print(f"[*] Testing files count: {len(test_files)}\n")
+
+def assign_split(stem, train_ratio=TRAIN_RATIO, valid_ratio=VALID_RATIO):
+    """
+    Assigns an image to 'train', 'valid' or 'test' from a stable hash of its name.
+
+    The same stem always lands in the same split, on any machine and in any run,
+    so new images can be added without reshuffling the existing ones.
+    """
+    digest = hashlib.blake2b(stem.encode('utf-8'), digest_size=8).digest()
+    position = int.from_bytes(digest, 'big') / 2 ** 64
+    if position < train_ratio:
+        return "train"
+    if position < train_ratio + valid_ratio:
+        return "valid"
+    return "test"
+
+
+def create_output_dirs(output_dir=OUTPUT_DIR):
+    for split in SPLITS:
+        os.makedirs(os.path.join(output_dir, split, "images"), exist_ok=True)
+        os.makedirs(os.path.join(output_dir, split, "labels"), exist_ok=True)
+    print("Created output directory structure successfully!\n")
+
 
 # --- File Copying Process ---
-def copy_files(file_list, source_img_dir, source_lbl_dir, dest_folder_name):
+def copy_files(file_list, source_img_dir, source_lbl_dir, dest_folder_name, label_files, link_mode=LINK_MODE,
+               copier=None, journal=None):
+    if journal is not None:
+        # Paths are relative to the staging folder; finished files are skipped on --resume
+        output_dir = ""
+        place = lambda src, dst: journal.copy(copier, src, dst)
+    else:
+        output_dir = OUTPUT_DIR
+        place = copier.submit if copier is not None else lambda src, dst: materialize_file(src, dst, link_mode)
     for filename in file_list:
         basename = os.path.splitext(filename)[0]
         label_filename = basename + ".txt"
-        
+
         src_image_path = os.path.join(source_img_dir, filename)
         src_label_path = os.path.join(source_lbl_dir, label_filename)
 
-        dest_image_path = os.path.join(OUTPUT_DIR, dest_folder_name, "images", filename)
-        dest_label_path = os.path.join(OUTPUT_DIR, dest_folder_name, "labels", label_filename)
+        dest_image_path = os.path.join(output_dir, dest_folder_name, "images", filename)
+        dest_label_path = os.path.join(output_dir, dest_folder_name, "labels", label_filename)
+
+        place(src_image_path, dest_image_path)
+        if label_filename in label_files:
+            place(src_label_path, dest_label_path)
+
+
+def pair_present(filename, size, dest_folder_name, output_dir=OUTPUT_DIR):
+    """
+    True when an image of the same size is already in the split, which is what
+    makes re-running the hash split incremental (copy_pair places the label
+    first, so a complete image means a complete pair).
+    """
+    try:
+        return os.stat(os.path.join(output_dir, dest_folder_name, "images", filename)).st_size == size
+    except FileNotFoundError:
+        return False
+
+
+def copy_pair(filename, size, dest_folder_name, link_mode=LINK_MODE, output_dir=OUTPUT_DIR):
+    """
+    Copies one image and its label (if any) into a split of `output_dir`.
+
+    The label is placed first, so a complete image means a complete pair.
+
+    Returns:
+        int: Bytes written (links and reflinks write none).
+    """
+    label_filename = os.path.splitext(filename)[0] + ".txt"
+    dest_image_path = os.path.join(output_dir, dest_folder_name, "images", filename)
+    dest_label_path = os.path.join(output_dir, dest_folder_name, "labels", label_filename)
+
+    written = 0
+    src_label_path = os.path.join(source_labels_dir, label_filename)
+    if os.path.exists(src_label_path):
+        if materialize_file(src_label_path, dest_label_path, link_mode) == 'copy':
+            written += os.path.getsize(dest_label_path)
+    if materialize_file(os.path.join(source_images_dir, filename), dest_image_path, link_mode) == 'copy':
+        written += size
+    return written
+
+
+def shuffle_split(link_mode=LINK_MODE, seed=SEED, workers=COPY_WORKERS, resume=False):
+    """The original split: load every name, shuffle, cut by the ratios, copy."""
+    # --- Find Files ---
+    begin_stage("scan")
+    image_files = sorted(f for f in os.listdir(source_images_dir) if f.lower().endswith(IMAGE_SUFFIXES))
+    # Label names are read once instead of stat-ing every label during the copy
+    label_files = set(list_label_files(source_labels_dir))
+    report_orphans(ImageIndex(source_images_dir, list(IMAGE_SUFFIXES)).match_labels(label_files), "source")
+    print(f"[*] Found {len(image_files)} total images.")
+    if len(image_files) == 0:
+        print("\n[FATAL ERROR] No images found in the 'images' directory. ❌")
+        return
+    print("--- Setup Complete ---\n")
+
+    journal = BuildJournal(OUTPUT_DIR, resume=resume)
+    if resume and seed is None:
+        print("[!] No --seed given: the shuffle differs from the interrupted run, so little can be reused.")
+    create_output_dirs(journal.staging_dir)
+
+    # --- Splitting Logic ---
+    random.Random(seed).shuffle(image_files)
+    total_files = len(image_files)
+    train_end = int(total_files * TRAIN_RATIO)
+    valid_end = train_end + int(total_files * VALID_RATIO)
+
+    split_files = {
+        "train": image_files[:train_end],
+        "valid": image_files[train_end:valid_end],
+        "test": image_files[valid_end:],
+    }
+
+    print("--- Data Split Calculation ---")
+    print(f"[*] Total images to split: {total_files}")
+    print(f"[*] Training files count: {len(split_files['train'])}")
+    print(f"[*] Validation files count: {len(split_files['valid'])}")
+    print(f"[*] Testing files count: {len(split_files['test'])}\n")
+
+    print("--- Starting File Copy ---")
+    begin_stage("copy")
+    for split, files in split_files.items():
+        print(f"[*] Copying {len(files)} {split} files...")
+        copier = CopyExecutor(workers, link_mode)
+        with copier:
+            copy_files(files, source_images_dir, source_labels_dir, split, label_files, link_mode, copier, journal)
+        copier.report()
+        if copier.failed:
+            journal.close()
+            print(f"[FATAL ERROR] {copier.failed} files failed; fix the cause and re-run with --resume. ❌")
+            return
+        print(f"[SUCCESS] {split.capitalize()} files copied.\n")
+    journal.commit()
+
+
+def copy_in_parallel(jobs, link_mode=LINK_MODE, workers=COPY_WORKERS, journal=None):
+    """
+    Runs copy_pair() for every (filename, size, split) job on a CopyExecutor.
+
+    At most a few copies per worker are queued at a time, so `jobs` can be a
+    generator that is consumed while the copies run. Pairs already present
+    (pair_present) are not copied again and are reported on their own line.
+    With a BuildJournal the pairs go to its staging folder and finished
+    images are journaled.
+
+    Returns:
+        int: Number of failed pairs.
+    """
+    counts = Counter()
+    lock = threading.Lock()
+    output_dir = journal.staging_dir if journal is not None else OUTPUT_DIR
+
+    def done(split, image_rel, result, error):
+        if journal is not None and error is None:
+            journal.record(image_rel)
+        with lock:
+            counts[(split, "failed" if error is not None else "copied")] += 1
+
+    copier = CopyExecutor(workers, link_mode)
+    with copier:
+        for filename, size, split in jobs:
+            image_rel = os.path.join(split, "images", filename)
+            if journal is not None:
+                journal.want(image_rel)
+                journal.want(os.path.join(split, "labels", os.path.splitext(filename)[0] + ".txt"))
+            if pair_present(filename, size, split, output_dir):
+                with lock:
+                    counts[(split, "skipped")] += 1
+                continue
+            copier.submit_task(copy_pair, filename, size, split, link_mode, output_dir,
+                               on_done=lambda result, error, split=split, image_rel=image_rel:
+                               done(split, image_rel, result, error))
+
+    print(f"[*] Total images: {sum(counts.values())}")
+    for split in SPLITS:
+        print(f"[*] {split.capitalize()}: {counts[(split, 'copied')]} copied, {counts[(split, 'failed')]} failed")
+    skipped = {split: counts[(split, 'skipped')] for split in SPLITS}
+    if any(skipped.values()):
+        print("[*] Already present, not copied again: "
+              + ", ".join(f"{split} {n}" for split, n in skipped.items()))
+    copier.report("image/label pairs")
+    print()
+    return sum(count for (_, result), count in counts.items() if result == "failed")
+
+
+def remove_pair(output_dir, split, image_name):
+    """Deletes an image and its label from a split of `output_dir`."""
+    label_filename = os.path.splitext(image_name)[0] + ".txt"
+    for path in (os.path.join(output_dir, split, "images", image_name),
+                 os.path.join(output_dir, split, "labels", label_filename)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def find_in_split(stem, ext, split, output_dir=OUTPUT_DIR):
+    """Name of the image of `stem` in a split of `output_dir` (tries `ext` first, then IMAGE_SUFFIXES), or None."""
+    for candidate in dict.fromkeys((ext,) + IMAGE_SUFFIXES):
+        name = stem + candidate
+        if os.path.exists(os.path.join(output_dir, split, "images", name)):
+            return name
+    return None
+
+
+def _outputs_without_source(image_dir, limit=PRUNE_BATCH):
+    """Up to `limit` image names in `image_dir` that are no longer in the source images folder."""
+    names = []
+    with os.scandir(image_dir) as entries:
+        for entry in entries:
+            if (entry.name.lower().endswith(IMAGE_SUFFIXES) and entry.is_file()
+                    and not os.path.exists(os.path.join(source_images_dir, entry.name))):
+                names.append(entry.name)
+                if len(names) >= limit:
+                    break
+    return names
+
+
+def prune_removed_sources(output_dir=OUTPUT_DIR):
+    """
+    Deletes the output pairs whose source image is gone.
+
+    Names are collected in batches and deleted after the scan, so a folder
+    is never modified while it is being read.
+
+    Returns:
+        Counter: Pairs removed per split.
+    """
+    removed = Counter()
+    for split in SPLITS:
+        image_dir = os.path.join(output_dir, split, "images")
+        if not os.path.isdir(image_dir):
+            continue
+        while True:
+            gone = _outputs_without_source(image_dir, PRUNE_BATCH)
+            for name in gone:
+                remove_pair(output_dir, split, name)
+            removed[split] += len(gone)
+            if len(gone) < PRUNE_BATCH:
+                break
+    return removed
+
+
+def hash_split(link_mode=LINK_MODE, workers=COPY_WORKERS):
+    """
+    Streams the images folder and assigns every file with assign_split().
+
+    Memory use does not grow with the number of images: names are never
+    collected into a list, other splits are checked with a few exists()
+    calls per image instead of an index of the output, and at most a few
+    copies per worker are queued.
+
+    The split is written into OUTPUT_DIR in place; there is no staging
+    folder or journal, whose list of wanted files would grow with the
+    dataset. Re-running is the resume: pairs already present are skipped
+    and a cut-off image (wrong size) is copied again. A copy of an image
+    in another split (left by an earlier shuffle or stratified split, or
+    by other ratios) is deleted before the image is placed, and pairs
+    whose source image was deleted are removed at the end.
+    """
+    print("--- Setup Complete ---\n")
+    create_output_dirs()
+    moved = Counter()
+
+    def jobs():
+        with os.scandir(source_images_dir) as entries:
+            for entry in entries:
+                if entry.name.lower().endswith(IMAGE_SUFFIXES) and entry.is_file():
+                    stem, ext = os.path.splitext(entry.name)
+                    split = assign_split(stem)
+                    for other in SPLITS:
+                        if other == split:
+                            continue
+                        name = find_in_split(stem, ext, other)
+                        if name is not None:
+                            remove_pair(OUTPUT_DIR, other, name)
+                            moved[other] += 1
+                    yield entry.name, entry.stat().st_size, split
+
+    print(f"--- Streaming hash split with {workers} copy workers ---")
+    begin_stage("copy")
+    copy_in_parallel(jobs(), link_mode, workers)
+    if moved:
+        print("[*] Removed copies that belonged to another split: "
+              + ", ".join(f"{split} {moved[split]}" for split in SPLITS if moved[split]) + "\n")
+
+    begin_stage("prune")
+    pruned = prune_removed_sources()
+    if sum(pruned.values()):
+        print("[*] Removed pairs whose source image is gone: "
+              + ", ".join(f"{split} {pruned[split]}" for split in SPLITS if pruned[split]) + "\n")
+
+
+def iterative_stratification(label_matrix, ratios, seed=SEED):
+    """
+    Multi-label iterative stratification (Sechidis et al., 2011).
+
+    Repeatedly takes the class with the fewest unassigned images and hands each
+    of those images to the split that still needs that class the most (ties:
+    the split that needs the most images overall, then random). The per-split,
+    per-class demand is a NumPy array updated with one vector op per image.
+
+    Args:
+        label_matrix (np.ndarray): Boolean (images x classes) matrix.
+        ratios (list): Target fraction of images per split.
+
+    Returns:
+        np.ndarray: Split index for every image.
+    """
+    rng = np.random.default_rng(seed)
+    num_images = label_matrix.shape[0]
+    ratios = np.asarray(ratios, dtype=np.float64)
+    counts = label_matrix.astype(np.int64)
+
+    split_demand = ratios * num_images
+    class_demand = np.outer(ratios, counts.sum(axis=0))
+    remaining = counts.sum(axis=0)
+    assignment = np.full(num_images, -1, dtype=np.int64)
+
+    while remaining.any():
+        # Rarest class first, so its few images are spread before the common classes fill the splits
+        candidates = np.where(remaining > 0, remaining, np.iinfo(np.int64).max)
+        class_idx = int(np.argmin(candidates))
+        images = np.nonzero((assignment < 0) & label_matrix[:, class_idx])[0]
+        rng.shuffle(images)
+
+        for image in images.tolist():
+            demand = class_demand[:, class_idx]
+            best = np.flatnonzero(demand == demand.max())
+            if len(best) > 1:
+                best = best[split_demand[best] == split_demand[best].max()]
+            split = int(best[0] if len(best) == 1 else rng.choice(best))
+
+            assignment[image] = split
+            class_demand[split] -= counts[image]
+            split_demand[split] -= 1
+            remaining -= counts[image]
+
+    # Images without any annotation only need to fill the split sizes
+    for image in np.nonzero(assignment < 0)[0].tolist():
+        best = np.flatnonzero(split_demand == split_demand.max())
+        split = int(best[0] if len(best) == 1 else rng.choice(best))
+        assignment[image] = split
+        split_demand[split] -= 1
+    return assignment
+
+
+def stratified_split(link_mode=LINK_MODE, workers=COPY_WORKERS, seed=SEED, resume=False):
+    """Splits by iterative stratification on the label cache and reports per-split class counts."""
+    begin_stage("scan")
+    images = []
+    with os.scandir(source_images_dir) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith(IMAGE_SUFFIXES) and entry.is_file():
+                images.append((entry.name, entry.stat().st_size))
+    images.sort()
+    print(f"[*] Found {len(images)} total images.")
+    if not images:
+        print("\n[FATAL ERROR] No images found in the 'images' directory. ❌")
+        return
+
+    labels = load_label_table(source_labels_dir, verbose=True)
+    row_of_stem = {stem: i for i, stem in enumerate(labels.stems.tolist())}
+    label_rows = np.array([row_of_stem.get(os.path.splitext(name)[0], -1) for name, _ in images], dtype=np.int64)
+
+    # (images x classes) membership, built from the unique (label file, class) pairs
+    valid = labels.class_id >= 0
+    num_classes = int(labels.class_id[valid].max()) + 1 if valid.any() else 0
+    image_of_row = np.full(len(labels) + 1, -1, dtype=np.int64)
+    image_of_row[label_rows[label_rows >= 0]] = np.nonzero(label_rows >= 0)[0]
+    pair_rows, pair_classes = labels.unique_image_classes()
+    pair_images = image_of_row[pair_rows]
+    keep = (pair_images >= 0) & (pair_classes >= 0)
+    label_matrix = np.zeros((len(images), num_classes), dtype=bool)
+    label_matrix[pair_images[keep], pair_classes[keep]] = True
+    print("--- Setup Complete ---\n")
+
+    begin_stage("stratify")
+    ratios = [TRAIN_RATIO, VALID_RATIO, 1.0 - TRAIN_RATIO - VALID_RATIO]
+    assignment = iterative_stratification(label_matrix, ratios, seed)
+
+    # Per-split distribution from the same arrays: images and instances per class
+    print("--- Class Distribution per Split (images / instances) ---")
+    instance_split = assignment[image_of_row[labels.image_id]] if len(labels) else np.array([], dtype=np.int64)
+    has_image = image_of_row[labels.image_id] >= 0 if len(labels) else np.array([], dtype=bool)
+    print(f"  {'Class':>5} | " + " | ".join(f"{split.capitalize():>15}" for split in SPLITS))
+    for class_idx in range(num_classes):
+        cells = []
+        class_rows = has_image & (labels.class_id == class_idx)
+        for split_idx in range(len(SPLITS)):
+            image_count = int(label_matrix[assignment == split_idx, class_idx].sum())
+            instance_count = int((instance_split[class_rows] == split_idx).sum())
+            cells.append(f"{f'{image_count} / {instance_count}':>15}")
+        print(f"  {class_idx:5d} | " + " | ".join(cells))
+    print()
 
-        shutil.copy(src_image_path, dest_image_path)
-        if os.path.exists(src_label_path):
-            shutil.copy(src_label_path, dest_label_path)
+    # Built in '<output>.staging' and swapped in when complete; --resume keeps finished pairs
+    begin_stage("copy")
+    journal = BuildJournal(OUTPUT_DIR, resume=resume)
+    create_output_dirs(journal.staging_dir)
+    jobs = ((name, size, SPLITS[split]) for (name, size), split in zip(images, assignment.tolist()))
+    print(f"--- Copying stratified split with {workers} copy workers ---")
+    failed = copy_in_parallel(jobs, link_mode, workers, journal)
+    if failed:
+        journal.close()
+        print(f"[FATAL ERROR] {failed} pairs failed; fix the cause and re-run with --resume. ❌")
+        return
+    journal.commit()
 
-print("--- Starting File Copy ---")
 
-# Copy Train Files
-print(f"[*] Copying {len(train_files)} training files...")
-copy_files(train_files, source_images_dir, source_labels_dir, "train")
-print("[SUCCESS] Training files copied.\n")
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Split a flat images/labels folder into train/valid/test.")
+    add_link_mode_argument(parser, default=LINK_MODE)
+    parser.add_argument('--mode', choices=['shuffle', 'hash', 'stratified'], default=SPLIT_MODE,
+                        help="'hash' gives a reproducible, incremental, streaming split; "
+                             "'stratified' balances every class across the splits.")
+    parser.add_argument('--seed', type=int, default=SEED, help="Seed for --mode shuffle / stratified.")
+    parser.add_argument('--workers', type=int, default=COPY_WORKERS,
+                        help="Parallel copies (1 = one file at a time).")
+    add_resume_argument(parser)
+    add_label_cache_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    if args.mode == 'hash' and args.resume:
+        parser.error("--resume does not apply to --mode hash: it writes in place, so just run it again.")
+    if args.mode == 'hash' and args.seed is not None:
+        parser.error("--seed does not apply to --mode hash: the split only depends on the file names.")
+    start_metrics(args)
+    configure_label_cache(args)
 
-# Copy Validation Files
-print(f"[*] Copying {len(valid_files)} validation files...")
-copy_files(valid_files, source_images_dir, source_labels_dir, "valid")
-print("[SUCCESS] Validation files copied.\n")
+    print("--- Initial Setup ---")
+    print(f"[*] Reading from: {os.path.abspath(source_images_dir)}")
+    if not os.path.isdir(source_images_dir):
+        print("\n[FATAL ERROR] 'images' directory not found! ❌")
+        exit()
+    print("[SUCCESS] Image directory found! ✅")
 
-# Copy Test Files
-print(f"[*] Copying {len(test_files)} testing files...")
-copy_files(test_files, source_images_dir, source_labels_dir, "test")
-print("[SUCCESS] Testing files copied.\n")
+    if args.mode == 'hash':
+        hash_split(link_mode=args.link_mode, workers=args.workers)
+    elif args.mode == 'stratified':
+        stratified_split(link_mode=args.link_mode, workers=args.workers, seed=args.seed, resume=args.resume)
+    else:
+        shuffle_split(link_mode=args.link_mode, seed=args.seed, workers=args.workers, resume=args.resume)
 
-print("--- All tasks complete! 🎉 ---")
+    print("--- All tasks complete! 🎉 ---")
+    finish_metrics(args)
@@ -0,0 +1,325 @@
+import os
+import json
+import struct
+import argparse
+from pathlib import Path
+from collections import Counter, namedtuple
+from contenthash import HashCache, HASH_WORKERS
+from imageindex import list_split_images
+from labelcache import add_cache_dir_argument, configure_label_cache, dataset_cache_path
+from instrument import add_metrics_arguments, begin_stage, count, start_metrics, finish_metrics
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# --- CONFIGURATION ---
+DATASET_PATH = Path(r"C:\Users\HP\Desktop\master_dataset")
+SPLITS = ['train', 'valid', 'test']
+
+# Also decode every image completely (much slower; finds corrupt data inside the file,
+# not only bad headers and cut-off files). Needs Pillow.
+FULL_DECODE = False
+# Delete images that fail the check, with their labels, from the dataset
+DROP_BAD = False
+
+# Header reads are a few small reads per file, so many threads keep the disk busy;
+# full decodes are CPU bound and run in processes.
+HEADER_WORKERS = 16
+DECODE_WORKERS = HASH_WORKERS
+
+# Results are kept by (path, size, mtime) in the cache folder (--cache-dir), so re-checking only
+# reads new or changed files
+HEADER_INDEX_NAME = 'image_headers.json'
+DECODE_INDEX_NAME = 'image_decode.json'
+REPORT_NAME = 'image_check.json'
+# ---------------------
+
+# How far from the end of a JPEG the end-of-image marker may be (some encoders pad)
+JPEG_TAIL = 1024
+PNG_IEND = b'\x00\x00\x00\x00IEND\xaeB`\x82'
+# JPEG start-of-frame markers (every SOFn except DHT, JPG and DAC)
+JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# Format an image's extension promises
+EXTENSION_FORMATS = {'.jpg': 'jpeg', '.jpeg': 'jpeg', '.png': 'png', '.bmp': 'bmp', '.webp': 'webp'}
+
+ImageInfo = namedtuple('ImageInfo', ['format', 'width', 'height', 'size', 'error'])
+
+
+class HeaderError(ValueError):
+    """The file is not a readable image of a known format."""
+
+
+class _CountingReader:
+    """Wraps a binary file and adds up the bytes actually read from it."""
+
+    def __init__(self, f):
+        self._f = f
+        self.bytes_read = 0
+
+    def read(self, n):
+        data = self._f.read(n)
+        self.bytes_read += len(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._f.seek(offset, whence)
+
+    def tell(self):
+        return self._f.tell()
+
+
+def _read_exact(f, n):
+    data = f.read(n)
+    if len(data) != n:
+        raise HeaderError("file ends inside the header")
+    return data
+
+
+def _jpeg_size(f, file_size):
+    f.seek(2)
+    while True:
+        marker = _read_exact(f, 2)
+        if marker[0] != 0xFF:
+            raise HeaderError(f"bad JPEG marker at byte {f.tell() - 2}")
+        code = marker[1]
+        while code == 0xFF:
+            code = _read_exact(f, 1)[0]
+        if code == 0x01 or 0xD0 <= code <= 0xD7:
+            continue
+        if code in (0xD9, 0xDA):
+            raise HeaderError("JPEG has no frame header")
+        length = struct.unpack('>H', _read_exact(f, 2))[0]
+        if length < 2:
+            raise HeaderError(f"bad JPEG segment length at byte {f.tell() - 2}")
+        if code in JPEG_SOF:
+            _, height, width = struct.unpack('>BHH', _read_exact(f, 5))
+            break
+        f.seek(length - 2, os.SEEK_CUR)
+
+    f.seek(max(0, file_size - JPEG_TAIL))
+    if b'\xff\xd9' not in f.read(JPEG_TAIL):
+        raise HeaderError("truncated JPEG (no end-of-image marker)")
+    return width, height
+
+
+def _png_size(f, file_size):
+    _, chunk, width, height = struct.unpack('>I4sII', _read_exact(f, 16))
+    if chunk != b'IHDR':
+        raise HeaderError("PNG does not start with IHDR")
+    f.seek(max(0, file_size - len(PNG_IEND)))
+    if f.read(len(PNG_IEND)) != PNG_IEND:
+        raise HeaderError("truncated PNG (no IEND chunk)")
+    return width, height
+
+
+def _bmp_size(f, file_size):
+    declared = struct.unpack('<I', _read_exact(f, 4))[0]
+    f.seek(18)
+    width, height = struct.unpack('<ii', _read_exact(f, 8))
+    if declared > file_size:
+        raise HeaderError(f"truncated BMP ({file_size} of {declared} bytes)")
+    return width, abs(height)
+
+
+def _webp_size(f, file_size):
+    riff_size, webp, chunk = struct.unpack('<I4s4s', _read_exact(f, 12))
+    if webp != b'WEBP':
+        raise HeaderError("RIFF file is not a WebP image")
+    data = _read_exact(f, 14)
+    if chunk == b'VP8 ':
+        width, height = struct.unpack('<HH', data[10:14])
+        width, height = width & 0x3FFF, height & 0x3FFF
+    elif chunk == b'VP8L':
+        bits = struct.unpack('<I', data[5:9])[0]
+        width, height = (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    elif chunk == b'VP8X':
+        width = int.from_bytes(data[8:11], 'little') + 1
+        height = int.from_bytes(data[11:14], 'little') + 1
+    else:
+        raise HeaderError(f"unknown WebP chunk {chunk!r}")
+    if riff_size + 8 > file_size:
+        raise HeaderError(f"truncated WebP ({file_size} of {riff_size + 8} bytes)")
+    return width, height
+
+
+# Format name, magic bytes, size reader (called with the file positioned after the magic)
+FORMATS = [
+    ('jpeg', b'\xff\xd8', _jpeg_size),
+    ('png', b'\x89PNG\r\n\x1a\n', _png_size),
+    ('bmp', b'BM', _bmp_size),
+    ('webp', b'RIFF', _webp_size),
+]
+
+
+def read_image_header(path):
+    """
+    Format, width and height of an image, from its header bytes only.
+
+    Also checks the end of the file where the format allows it (JPEG end
+    marker, PNG IEND chunk, BMP and WebP declared sizes), which catches
+    files cut off during a download or copy.
+
+    Returns:
+        list: [format, width, height, size in bytes, error]; error is None for a good header.
+
+    Raises:
+        OSError: If the file cannot be read.
+    """
+    file_size = os.path.getsize(path)
+    if file_size == 0:
+        return [None, 0, 0, 0, "empty file"]
+    with open(path, 'rb') as raw:
+        f = _CountingReader(raw)
+        try:
+            return _read_header(f, file_size)
+        finally:
+            count('header_bytes_read', f.bytes_read)
+
+
+def _read_header(f, file_size):
+    start = f.read(8)
+    for name, magic, size_reader in FORMATS:
+        if start.startswith(magic):
+            f.seek(len(magic))
+            try:
+                width, height = size_reader(f, file_size)
+            except (HeaderError, struct.error) as e:
+                return [name, 0, 0, file_size, str(e)]
+            if width <= 0 or height <= 0:
+                return [name, width, height, file_size, f"invalid size {width}x{height}"]
+            return [name, width, height, file_size, None]
+    return [None, 0, 0, file_size, "unknown image format"]
+
+
+def decode_error(path):
+    """Fully decodes an image with Pillow; returns the error message, or '' if it decodes."""
+    try:
+        with Image.open(path) as image:
+            image.load()
+    except OSError as e:
+        return str(e) or type(e).__name__
+    except Exception as e:
+        # Pillow raises assorted errors for broken data (SyntaxError, ValueError, ...)
+        return f"{type(e).__name__}: {e}"
+    return ''
+
+
+def check_images(paths, dataset_path, decode=False, workers=HEADER_WORKERS, decode_workers=DECODE_WORKERS):
+    """
+    Header information (and optional full-decode result) of many images.
+
+    Results are stored by (path, size, mtime) in the cache folder, in files
+    named after `dataset_path`; only new or changed files are read. Headers
+    are read in a thread pool (counted as header_bytes_read), full decodes
+    (only of images with a good header) in a process pool.
+
+    Returns:
+        list: An ImageInfo per path; `error` is None for a good image.
+    """
+    header_index = HashCache(dataset_cache_path(dataset_path, '.' + HEADER_INDEX_NAME), digest=read_image_header,
+                             kind='image-header', executor='thread', bytes_counter=None)
+    headers = header_index.hash_files(paths, workers)
+    header_index.save()
+
+    infos = [ImageInfo(None, 0, 0, 0, "cannot be read") if header is None else ImageInfo(*header)
+             for header in headers]
+
+    if decode:
+        good = [k for k, info in enumerate(infos) if info.error is None]
+        decode_index = HashCache(dataset_cache_path(dataset_path, '.' + DECODE_INDEX_NAME), digest=decode_error,
+                                 kind='image-decode', bytes_counter='bytes_decoded')
+        errors = decode_index.hash_files([paths[k] for k in good], decode_workers)
+        decode_index.save()
+        for k, error in zip(good, errors):
+            if error is None:
+                infos[k] = infos[k]._replace(error="cannot be read")
+            elif error:
+                infos[k] = infos[k]._replace(error=error)
+    count('bad_images', sum(1 for info in infos if info.error is not None))
+    return infos
+
+
+def drop_bad_pairs(dataset_path, bad):
+    """Deletes bad (split, image name) images and their label files."""
+    dataset_path = Path(dataset_path)
+    for split, name in bad:
+        (dataset_path / split / 'images' / name).unlink(missing_ok=True)
+        (dataset_path / split / 'labels' / (os.path.splitext(name)[0] + '.txt')).unlink(missing_ok=True)
+
+
+def write_report(dataset_path, images, infos):
+    """Writes image_check.json and prints the summary."""
+    bad = [(split, name, info) for (split, name), info in zip(images, infos) if info.error is not None]
+    formats = Counter(info.format for info in infos if info.error is None)
+    mismatched = [(split, name) for (split, name), info in zip(images, infos)
+                  if info.error is None and EXTENSION_FORMATS.get(os.path.splitext(name)[1].lower()) != info.format]
+    good = [info for info in infos if info.error is None]
+
+    report = {
+        'images': len(images),
+        'bad': [{'path': f"{split}/images/{name}", 'error': info.error} for split, name, info in bad],
+        'extension_mismatch': [f"{split}/images/{name}" for split, name in mismatched],
+        'formats': dict(formats),
+    }
+    report_path = Path(dataset_path) / REPORT_NAME
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    print("\n========================================")
+    print("🩺 IMAGE CHECK REPORT")
+    print("========================================")
+    print(f"  - Images checked: {len(images)} ({sum(info.size for info in infos) / 1024 ** 2:.1f} MB)")
+    print(f"  - Formats:        {', '.join(f'{name}: {n}' for name, n in formats.most_common())}")
+    if good:
+        widths = [info.width for info in good]
+        heights = [info.height for info in good]
+        print(f"  - Width:          {min(widths)} - {max(widths)} px")
+        print(f"  - Height:         {min(heights)} - {max(heights)} px")
+    if mismatched:
+        print(f"  - Extension does not match the format: {len(mismatched)} (readable, listed in the report)")
+    print(f"  - Bad images:     {len(bad)}")
+    for split, name, info in bad[:10]:
+        print(f"     ❌ {split}/images/{name}: {info.error}")
+    if len(bad) > 10:
+        print(f"     ... and {len(bad) - 10} more")
+    print(f"\n📄 Full list written to {report_path}")
+    return [(split, name) for split, name, _ in bad]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Check that every image of a dataset is readable and index its format and size.")
+    parser.add_argument('dataset', nargs='?', default=DATASET_PATH, type=Path,
+                        help="Dataset folder with train/valid/test splits.")
+    parser.add_argument('--decode', action='store_true', default=FULL_DECODE,
+                        help="Also decode every image completely (slow; needs Pillow).")
+    parser.add_argument('--drop', action='store_true', default=DROP_BAD,
+                        help="Delete bad images and their labels.")
+    parser.add_argument('--workers', type=int, default=HEADER_WORKERS, help="Threads reading headers.")
+    parser.add_argument('--decode-workers', type=int, default=DECODE_WORKERS, help="Processes decoding images.")
+    add_cache_dir_argument(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    if args.decode and Image is None:
+        print("⚠ Pillow not installed. Run: pip install Pillow (or check headers only, without --decode)")
+        raise SystemExit(1)
+    start_metrics(args)
+    configure_label_cache(args)
+
+    begin_stage("check")
+    images = list_split_images(args.dataset, SPLITS)
+    print(f"🔍 Checking {len(images)} images{' (full decode)' if args.decode else ''}...")
+    infos = check_images([args.dataset / split / 'images' / name for split, name in images], args.dataset,
+                         decode=args.decode, workers=args.workers, decode_workers=args.decode_workers)
+    begin_stage("report")
+    bad = write_report(args.dataset, images, infos)
+
+    if args.drop and bad:
+        begin_stage("drop")
+        drop_bad_pairs(args.dataset, bad)
+        print(f"🗑 Deleted {len(bad)} bad images and their labels.")
+    finish_metrics(args)
@@ -0,0 +1,124 @@
+import os
+from collections import namedtuple
+from instrument import count
+
+# Extensions probed by the scripts, in order of preference when a stem has several images.
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.bmp', '.webp']
+
+LabelMatch = namedtuple('LabelMatch', ['pairs', 'orphan_labels', 'orphan_images'])
+
+
+class ImageIndex:
+    """
+    Maps image stems to file names for one images directory.
+
+    The directory is read with a single os.scandir pass, so looking up the
+    image of a label costs a dict lookup instead of one exists() call per
+    candidate extension.
+    """
+
+    def __init__(self, image_dir, extensions=IMAGE_EXTENSIONS, with_sizes=False):
+        self.image_dir = os.fspath(image_dir)
+        self.extensions = list(extensions)
+        self.stem_to_name = {}
+        # File size per stem, only collected when asked for (costs one stat per image on Linux)
+        self.stem_to_size = {}
+
+        # Extensions match case-insensitively ('IMG.JPG'); the on-disk name is kept
+        priority = {ext.lower(): i for i, ext in enumerate(self.extensions)}
+        if not os.path.isdir(self.image_dir):
+            return
+
+        scanned = stats = 0
+        with os.scandir(self.image_dir) as entries:
+            for entry in entries:
+                scanned += 1
+                stem, ext = os.path.splitext(entry.name)
+                ext = ext.lower()
+                if ext not in priority or not entry.is_file():
+                    continue
+                current = self.stem_to_name.get(stem)
+                if current is None or priority[ext] < priority[os.path.splitext(current)[1].lower()]:
+                    self.stem_to_name[stem] = entry.name
+                    if with_sizes:
+                        self.stem_to_size[stem] = entry.stat().st_size
+                        stats += 1
+        count('files_scanned', scanned)
+        count('stat_calls', stats)
+
+    def __len__(self):
+        return len(self.stem_to_name)
+
+    def __contains__(self, stem):
+        return stem in self.stem_to_name
+
+    def find(self, stem):
+        """Returns the image file name for `stem`, or None."""
+        return self.stem_to_name.get(stem)
+
+    def path(self, stem):
+        """Returns the full image path for `stem`, or None."""
+        name = self.stem_to_name.get(stem)
+        return os.path.join(self.image_dir, name) if name else None
+
+    def size(self, stem):
+        """Returns the image size in bytes (needs with_sizes=True), or None."""
+        return self.stem_to_size.get(stem)
+
+    def add(self, name):
+        """Registers an image written into the directory after the scan."""
+        self.stem_to_name[os.path.splitext(name)[0]] = name
+
+    def remove(self, stem):
+        """Forgets an image deleted from the directory after the scan."""
+        self.stem_to_name.pop(stem, None)
+
+    def match_labels(self, label_files):
+        """
+        Pairs label file names with their images.
+
+        Returns:
+            LabelMatch: `pairs` is a list of (label_file, image_name) for labels
+            that have an image, `orphan_labels` lists labels without one and
+            `orphan_images` lists images that no label refers to.
+        """
+        pairs = []
+        orphan_labels = []
+        label_stems = set()
+        for label_file in label_files:
+            stem = os.path.splitext(label_file)[0]
+            label_stems.add(stem)
+            name = self.stem_to_name.get(stem)
+            if name is None:
+                orphan_labels.append(label_file)
+            else:
+                pairs.append((label_file, name))
+
+        orphan_images = sorted(name for stem, name in self.stem_to_name.items() if stem not in label_stems)
+        return LabelMatch(pairs, orphan_labels, orphan_images)
+
+
+def list_label_files(label_dir):
+    """Returns the sorted '.txt' file names of a labels directory (one scandir pass)."""
+    if not os.path.isdir(label_dir):
+        return []
+    with os.scandir(label_dir) as entries:
+        names = sorted(entry.name for entry in entries if entry.name.endswith('.txt') and entry.is_file())
+    count('files_scanned', len(names))
+    return names
+
+
+def list_split_images(dataset_path, splits):
+    """Lists (split, image name) of every image in the '<split>/images' folders of a dataset."""
+    images = []
+    for split in splits:
+        index = ImageIndex(os.path.join(dataset_path, split, 'images'))
+        images.extend((split, name) for name in sorted(index.stem_to_name.values()))
+    return images
+
+
+def report_orphans(match, where):
+    """Prints a one-line orphan summary for a LabelMatch."""
+    if match.orphan_labels or match.orphan_images:
+        print(f"   ℹ {where}: {len(match.orphan_labels)} labels without an image, "
+              f"{len(match.orphan_images)} images without a label.")
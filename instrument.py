@@ -0,0 +1,195 @@
+import os
+import re
+import csv
+import sys
+import json
+import time
+import cProfile
+import threading
+import functools
+from collections import Counter
+from contextlib import contextmanager
+
+# Counters filled in by the shared modules; scripts may add their own names.
+#   files_scanned   directory entries looked at (images, labels)
+#   stat_calls      explicit stat() calls
+#   labels_parsed   label files parsed (not served from the label cache)
+#   labels_reused   label files served from the label cache
+#   files_copied    files placed by a CopyExecutor
+#   bytes_copied    bytes written by those copies
+#   errors          failed file operations
+
+
+def add_metrics_arguments(parser):
+    """Adds the shared --metrics and --profile-dir options to an argparse parser."""
+    parser.add_argument('--metrics', default=None,
+                        help="Write stage timings and counters to this file (.json, or .csv).")
+    parser.add_argument('--profile-dir', default=None,
+                        help="Write a cProfile dump of every top-level stage into this folder.")
+
+
+class Metrics:
+    """
+    Wall/CPU time per stage and named counters for one run.
+
+    Stages nest per thread ('copy/train'). Scripts with numbered steps call
+    begin('scan'), begin('copy'), ... which closes the previous step; blocks
+    and helpers use `with stage(...)` or `@timed(...)`. With a profile_dir,
+    every top-level stage of the main thread also gets a cProfile dump
+    (cProfile only sees the thread it runs in, not the copy workers).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self, profile_dir=None):
+        self.stages = {}
+        self.counters = Counter()
+        self.profile_dir = profile_dir
+        self._profiles = 0
+        self._started = time.perf_counter()
+        self._started_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self._local = threading.local()
+
+    # --- Stages ---
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _push(self, name, begun=False):
+        stack = self._stack()
+        path = f"{stack[-1]['path']}/{name}" if stack else name
+        profiler = None
+        if self.profile_dir and not stack and threading.current_thread() is threading.main_thread():
+            profiler = cProfile.Profile()
+        frame = {'path': path, 'begun': begun, 'profiler': profiler,
+                 'wall': time.perf_counter(), 'cpu': time.process_time()}
+        stack.append(frame)
+        if profiler is not None:
+            profiler.enable()
+
+    def _pop(self):
+        frame = self._stack().pop()
+        wall = time.perf_counter() - frame['wall']
+        cpu = time.process_time() - frame['cpu']
+        if frame['profiler'] is not None:
+            frame['profiler'].disable()
+            self._dump_profile(frame['path'], frame['profiler'])
+        with self._lock:
+            entry = self.stages.setdefault(frame['path'], {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0})
+            entry['calls'] += 1
+            entry['wall_s'] += wall
+            entry['cpu_s'] += cpu
+
+    def _dump_profile(self, path, profiler):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        self._profiles += 1
+        safe = re.sub(r'[^\w.-]+', '_', path)
+        profiler.dump_stats(os.path.join(self.profile_dir, f"{self._profiles:02d}-{safe}.prof"))
+
+    @contextmanager
+    def stage(self, name):
+        """Times a block as a stage (nested under the current one)."""
+        self._push(name)
+        try:
+            yield
+        finally:
+            self._pop()
+
+    def timed(self, name=None):
+        """Decorator form of stage(); the stage is named after the function by default."""
+        def decorate(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.stage(name or fn.__name__):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def begin(self, name):
+        """Ends the current step (if any) and starts step `name`."""
+        self.end()
+        self._push(name, begun=True)
+
+    def end(self):
+        """Ends the current step, and any stage still open inside it."""
+        stack = self._stack()
+        while any(frame['begun'] for frame in stack):
+            self._pop()
+
+    # --- Counters ---
+
+    def count(self, name, n=1):
+        if n:
+            with self._lock:
+                self.counters[name] += n
+
+    # --- Output ---
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'script': os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else None,
+                'argv': sys.argv[1:],
+                'started_at': self._started_at,
+                'total_wall_s': round(time.perf_counter() - self._started, 6),
+                'stages': {path: {'calls': s['calls'], 'wall_s': round(s['wall_s'], 6), 'cpu_s': round(s['cpu_s'], 6)}
+                           for path, s in self.stages.items()},
+                'counters': dict(self.counters),
+            }
+
+    def write(self, path):
+        """Writes the metrics as JSON, or as CSV rows when `path` ends in .csv."""
+        data = self.snapshot()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if path.lower().endswith('.csv'):
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['kind', 'name', 'calls', 'wall_s', 'cpu_s', 'value'])
+                writer.writerow(['total', data['script'], '', data['total_wall_s'], '', ''])
+                for name, s in data['stages'].items():
+                    writer.writerow(['stage', name, s['calls'], s['wall_s'], s['cpu_s'], ''])
+                for name, value in data['counters'].items():
+                    writer.writerow(['counter', name, '', '', '', value])
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2)
+
+    def print_summary(self):
+        data = self.snapshot()
+        if not data['stages'] and not data['counters']:
+            return
+        print(f"\n⏱ Timings ({data['total_wall_s']:.2f}s total):")
+        for name, s in data['stages'].items():
+            calls = f" x{s['calls']}" if s['calls'] > 1 else ""
+            print(f"   - {name:<32} {s['wall_s']:8.2f}s wall {s['cpu_s']:8.2f}s cpu{calls}")
+        if data['counters']:
+            print("   " + ", ".join(f"{name}={value}" for name, value in sorted(data['counters'].items())))
+
+
+# One registry per process, shared by the modules and the script that runs them
+METRICS = Metrics()
+stage = METRICS.stage
+timed = METRICS.timed
+count = METRICS.count
+begin_stage = METRICS.begin
+
+
+def start_metrics(args=None):
+    """Resets the registry at the start of a script (profiling per --profile-dir)."""
+    METRICS.reset(profile_dir=getattr(args, 'profile_dir', None))
+
+
+def finish_metrics(args=None):
+    """Ends the last step, prints the timings and writes --metrics if given."""
+    METRICS.end()
+    METRICS.print_summary()
+    path = getattr(args, 'metrics', None)
+    if path:
+        METRICS.write(path)
+        print(f"   📈 Metrics written to {path}")
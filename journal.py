@@ -0,0 +1,182 @@
+import os
+import json
+import shutil
+import threading
+
+JOURNAL_NAME = '.journal.jsonl'
+STAGING_SUFFIX = '.staging'
+
+# The journal is flushed after every record and fsync'ed this often, so a
+# crash loses at most the last few records (those files are simply redone).
+FSYNC_EVERY = 256
+
+
+def add_resume_argument(parser):
+    """Adds the shared --resume option to an argparse parser."""
+    parser.add_argument('--resume', action='store_true',
+                        help="Continue an interrupted build from its staging folder instead of starting over.")
+
+
+class BuildJournal:
+    """
+    Builds an output dataset in a staging folder with a write-ahead journal.
+
+    Every finished file is appended to `<output>.staging/.journal.jsonl`
+    with its size. After a crash or Ctrl-C, a run with resume=True keeps the
+    staging folder and skips every journaled file whose size still matches;
+    files that were only partly written are not in the journal and are
+    written again. commit() swaps the staging folder into place with
+    renames, so readers see either the previous dataset or the complete new
+    one, never a half-built one.
+
+        journal = BuildJournal(output_dir, resume=args.resume)
+        with CopyExecutor(...) as copier:
+            journal.make_dirs(copier, ['train/images', 'train/labels'])
+            journal.copy(copier, src, 'train/images/a.jpg')
+        journal.commit()
+    """
+
+    def __init__(self, output_dir, resume=False):
+        self.output_dir = os.path.abspath(os.fspath(output_dir))
+        self.staging_dir = self.output_dir + STAGING_SUFFIX
+        self.journal_path = os.path.join(self.staging_dir, JOURNAL_NAME)
+        self.done = {}
+        self.wanted = set()
+        self.resumed = False
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._unsynced = 0
+
+        if resume and os.path.isfile(self.journal_path):
+            self.done = self._read_journal()
+            self.resumed = True
+            print(f"   ♻ Resuming from '{self.staging_dir}': {len(self.done)} files already done.")
+        else:
+            if resume:
+                print(f"   ℹ Nothing to resume in '{self.staging_dir}'; starting a fresh build.")
+            if os.path.exists(self.staging_dir):
+                shutil.rmtree(self.staging_dir)
+        os.makedirs(self.staging_dir, exist_ok=True)
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+
+    def _read_journal(self):
+        done = {}
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A record torn by the crash; that file is redone
+                    continue
+                done[entry['path']] = entry['size']
+        return done
+
+    def path(self, rel_path):
+        """Staging path of an output file, e.g. path('train/images/a.jpg')."""
+        return os.path.join(self.staging_dir, rel_path)
+
+    def is_done(self, rel_path, expected_size=None):
+        """
+        True if `rel_path` was journaled and the staged file still has the
+        journaled size (and `expected_size`, e.g. the source's, if given).
+        """
+        size = self.done.get(rel_path)
+        if size is None or (expected_size is not None and size != expected_size):
+            return False
+        try:
+            return os.path.getsize(self.path(rel_path)) == size
+        except OSError:
+            return False
+
+    def want(self, rel_path):
+        """Marks a file as part of this build (e.g. a YAML written directly into path())."""
+        self.wanted.add(rel_path)
+
+    def record(self, rel_path):
+        """Journals a finished output file with its current size."""
+        size = os.path.getsize(self.path(rel_path))
+        with self._lock:
+            self._journal.write(json.dumps({'path': rel_path, 'size': size}) + '\n')
+            self._journal.flush()
+            self._unsynced += 1
+            if self._unsynced >= FSYNC_EVERY:
+                os.fsync(self._journal.fileno())
+                self._unsynced = 0
+            self.done[rel_path] = size
+
+    def make_dirs(self, copier, rel_dirs):
+        copier.make_dirs(self.path(rel_dir) for rel_dir in rel_dirs)
+
+    def copy(self, copier, src, rel_path, expected_size=None, **kwargs):
+        """
+        Queues `src` -> rel_path on a CopyExecutor unless it is already done.
+
+        Returns:
+            bool: False when the file was skipped.
+        """
+        self.wanted.add(rel_path)
+        if self.is_done(rel_path, expected_size):
+            self.skipped += 1
+            return False
+        copier.submit(src, self.path(rel_path), on_done=self._on_done(rel_path), **kwargs)
+        return True
+
+    def write_label(self, copier, rel_path, text, src=None, src_text=None):
+        """Queues a label write unless it is already done (see CopyExecutor.submit_label)."""
+        self.wanted.add(rel_path)
+        if self.is_done(rel_path):
+            self.skipped += 1
+            return False
+        copier.submit_label(self.path(rel_path), text, src=src, src_text=src_text, on_done=self._on_done(rel_path))
+        return True
+
+    def _on_done(self, rel_path):
+        def done(result, error):
+            if error is None:
+                self.record(rel_path)
+        return done
+
+    def commit(self):
+        """
+        Publishes the staging folder as the output folder.
+
+        The previous output (if any) is renamed aside, the staging folder is
+        renamed into place and only then is the old one deleted. After a
+        resume, staged files this run did not ask for (e.g. from a different
+        random sample) are removed first.
+        """
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._journal.close()
+        os.remove(self.journal_path)
+        if self.resumed:
+            self._prune()
+
+        old_dir = self.output_dir + '.old'
+        if os.path.exists(old_dir):
+            shutil.rmtree(old_dir)
+        if os.path.exists(self.output_dir):
+            os.rename(self.output_dir, old_dir)
+        os.rename(self.staging_dir, self.output_dir)
+        if os.path.exists(old_dir):
+            shutil.rmtree(old_dir)
+        if self.skipped:
+            print(f"   ♻ {self.skipped} files were reused from the interrupted run.")
+
+    def _prune(self):
+        # Callers may build rel paths with '/'; relpath() uses os.sep (backslashes on Windows)
+        wanted = {os.path.normpath(rel_path) for rel_path in self.wanted}
+        removed = 0
+        for root, _, files in os.walk(self.staging_dir):
+            for name in files:
+                full_path = os.path.join(root, name)
+                if os.path.relpath(full_path, self.staging_dir) not in wanted:
+                    os.remove(full_path)
+                    removed += 1
+        if removed:
+            print(f"   🗑 Removed {removed} staged files that are no longer part of the build.")
+
+    def close(self):
+        """Closes the journal without publishing; the staging folder stays for --resume."""
+        if not self._journal.closed:
+            self._journal.close()
@@ -0,0 +1,245 @@
+import os
+import hashlib
+import numpy as np
+from instrument import count
+
+# Bump when the layout of the cache file changes; old caches are then rebuilt.
+CACHE_VERSION = 1
+
+# Parsed labels and the other per-dataset caches (class bitmaps, image hashes, ...) are kept
+# in this folder, never inside the datasets that are read, so source datasets stay untouched
+# and no cache file ends up in copies or packs. Delete the folder to drop every cache.
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'yolo-dataset-cache')
+
+# Set by configure_label_cache() from the command line options
+_settings = {'cache_dir': CACHE_DIR, 'enabled': True}
+
+
+def add_cache_dir_argument(parser):
+    """Adds the shared --cache-dir option to an argparse parser."""
+    parser.add_argument('--cache-dir', default=CACHE_DIR,
+                        help="Folder for the label, index and hash caches (kept outside the datasets).")
+
+
+def add_label_cache_arguments(parser):
+    """Adds the shared --cache-dir and --no-label-cache options to an argparse parser."""
+    add_cache_dir_argument(parser)
+    parser.add_argument('--no-label-cache', action='store_true',
+                        help="Parse every label file and write no cache.")
+
+
+def configure_label_cache(args):
+    """Applies the add_label_cache_arguments() (or add_cache_dir_argument()) options to the caches."""
+    _settings['cache_dir'] = args.cache_dir
+    _settings['enabled'] = not getattr(args, 'no_label_cache', False)
+
+
+def dataset_cache_path(path, suffix):
+    """
+    Cache file belonging to a dataset or labels folder, inside the cache folder.
+
+    Named after the folder, its parent and a hash of the absolute path, e.g.
+    train/labels, '.npz' -> <cache dir>/train-labels-3f2a9c01d4e5b6a7.npz.
+    """
+    path = os.path.abspath(os.fspath(path))
+    key = hashlib.sha1(os.path.normcase(path).encode('utf-8')).hexdigest()[:16]
+    name = f"{os.path.basename(os.path.dirname(path))}-{os.path.basename(path)}-{key}{suffix}"
+    return os.path.join(_settings['cache_dir'], name)
+
+
+def default_cache_path(label_dir):
+    """Label cache file of a labels folder."""
+    return dataset_cache_path(label_dir, '.npz')
+
+
+def scan_label_files(label_dir):
+    """Sorted (stem, size, mtime in ns) of every '.txt' file of a labels folder (one scandir pass)."""
+    current = []
+    if os.path.isdir(label_dir):
+        with os.scandir(label_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith('.txt') and entry.is_file():
+                    st = entry.stat()
+                    current.append((entry.name[:-4], st.st_size, st.st_mtime_ns))
+    current.sort()
+    return current
+
+
+def parse_label_text(text):
+    """
+    Parses the text of one YOLO label file.
+
+    Lines whose first token is not an integer are skipped, like the scripts do.
+    Missing or unparsable box values are stored as NaN.
+
+    Returns:
+        (list, list): class ids and [x, y, w, h] boxes, one entry per annotation.
+    """
+    class_ids = []
+    boxes = []
+    for line in text.splitlines():
+        parts = line.split()
+        if not parts:
+            continue
+        try:
+            class_id = int(parts[0])
+        except ValueError:
+            continue
+        box = [float('nan')] * 4
+        for i, value in enumerate(parts[1:5]):
+            try:
+                box[i] = float(value)
+            except ValueError:
+                pass
+        class_ids.append(class_id)
+        boxes.append(box)
+    return class_ids, boxes
+
+
+class LabelTable:
+    """
+    All annotations of one labels directory as NumPy columns.
+
+    Attributes:
+        stems: Label/image names without extension, one per label file (the image table).
+        sizes, mtimes: Size and mtime (ns) of every label file when it was parsed.
+        offsets: Row range of file i is offsets[i]:offsets[i + 1].
+        image_id: Index into `stems` for every annotation row (int32).
+        class_id: Class of every annotation row (int32).
+        bbox: x, y, w, h of every annotation row (float32, shape (N, 4)).
+    """
+
+    def __init__(self, stems, sizes, mtimes, offsets, class_id, bbox):
+        self.stems = stems
+        self.sizes = sizes
+        self.mtimes = mtimes
+        self.offsets = offsets
+        self.class_id = class_id
+        self.bbox = bbox
+        self.image_id = np.repeat(np.arange(len(stems), dtype=np.int32), np.diff(offsets))
+
+    def __len__(self):
+        return len(self.stems)
+
+    @property
+    def num_annotations(self):
+        return len(self.class_id)
+
+    def classes_of(self, i):
+        """Class ids annotated in label file i."""
+        return self.class_id[self.offsets[i]:self.offsets[i + 1]]
+
+    def unique_image_classes(self):
+        """Returns (image_ids, class_ids) with every (image, class) pair listed once."""
+        key = (self.image_id.astype(np.int64) << 32) | (self.class_id.astype(np.int64) & 0xFFFFFFFF)
+        key = np.unique(key)
+        image_ids = (key >> 32).astype(np.int32)
+        class_ids = (key & 0xFFFFFFFF).astype(np.uint32).view(np.int32)
+        return image_ids, class_ids
+
+    @classmethod
+    def empty(cls):
+        return cls(np.array([], dtype=str), np.array([], dtype=np.int64), np.array([], dtype=np.int64),
+                   np.zeros(1, dtype=np.int64), np.array([], dtype=np.int32), np.zeros((0, 4), dtype=np.float32))
+
+
+def _read_cache(cache_path):
+    try:
+        with np.load(cache_path) as data:
+            if int(data['version']) != CACHE_VERSION:
+                return None
+            return LabelTable(data['stems'], data['sizes'], data['mtimes'], data['offsets'],
+                              data['class_id'], data['bbox'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _write_cache(cache_path, table):
+    tmp_path = cache_path + '.tmp'
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, version=CACHE_VERSION, stems=table.stems, sizes=table.sizes, mtimes=table.mtimes,
+                     offsets=table.offsets, image_id=table.image_id, class_id=table.class_id, bbox=table.bbox)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"   ⚠ Could not write label cache {cache_path}: {e}")
+
+
+def load_label_table(label_dir, cache_path=None, use_cache=None, verbose=False):
+    """
+    Loads every annotation of a labels directory, using the on-disk cache.
+
+    Only label files whose size or mtime changed since the cache was written
+    are re-parsed; removed files are dropped. The cache is rewritten when
+    anything changed.
+
+    Args:
+        label_dir: Folder with YOLO '.txt' label files.
+        cache_path: Where the cache lives (default: in the label cache folder).
+        use_cache (bool): Set to False to parse everything and leave the cache alone
+            (default: as configured, see --no-label-cache).
+        verbose (bool): Print how many files were reused/parsed/removed.
+
+    Returns:
+        LabelTable: Label files in sorted name order.
+    """
+    label_dir = os.fspath(label_dir)
+    if not os.path.isdir(label_dir):
+        return LabelTable.empty()
+    cache_path = cache_path or default_cache_path(label_dir)
+    if use_cache is None:
+        use_cache = _settings['enabled']
+
+    current = scan_label_files(label_dir)
+
+    cached = _read_cache(cache_path) if use_cache else None
+    cached_rows = {}
+    if cached is not None:
+        for i, stem in enumerate(cached.stems.tolist()):
+            cached_rows[stem] = (i, int(cached.sizes[i]), int(cached.mtimes[i]))
+
+    class_pieces = []
+    bbox_pieces = []
+    counts = np.zeros(len(current), dtype=np.int64)
+    reused = parsed = 0
+    for n, (stem, size, mtime) in enumerate(current):
+        hit = cached_rows.pop(stem, None)
+        if hit is not None and hit[1] == size and hit[2] == mtime:
+            i = hit[0]
+            start, end = cached.offsets[i], cached.offsets[i + 1]
+            class_pieces.append(cached.class_id[start:end])
+            bbox_pieces.append(cached.bbox[start:end])
+            counts[n] = end - start
+            reused += 1
+            continue
+
+        with open(os.path.join(label_dir, stem + '.txt'), 'r') as f:
+            class_ids, boxes = parse_label_text(f.read())
+        class_pieces.append(np.asarray(class_ids, dtype=np.int32))
+        bbox_pieces.append(np.asarray(boxes, dtype=np.float32).reshape(-1, 4))
+        counts[n] = len(class_ids)
+        parsed += 1
+    removed = len(cached_rows)
+    count('files_scanned', len(current))
+    count('stat_calls', len(current))
+    count('labels_parsed', parsed)
+    count('labels_reused', reused)
+
+    offsets = np.zeros(len(current) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    table = LabelTable(
+        np.array([c[0] for c in current], dtype=str),
+        np.array([c[1] for c in current], dtype=np.int64),
+        np.array([c[2] for c in current], dtype=np.int64),
+        offsets,
+        np.concatenate(class_pieces) if class_pieces else np.array([], dtype=np.int32),
+        np.concatenate(bbox_pieces) if bbox_pieces else np.zeros((0, 4), dtype=np.float32),
+    )
+
+    if verbose:
+        where = os.path.relpath(os.path.abspath(label_dir), os.path.dirname(os.path.dirname(os.path.abspath(label_dir))))
+        print(f"   - Label cache of {where}: {reused} reused, {parsed} parsed, {removed} removed.")
+    if use_cache and (parsed or removed or cached is None):
+        _write_cache(cache_path, table)
+    return table
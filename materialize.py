@@ -0,0 +1,188 @@
+import os
+import shutil
+
+# How files are placed into a derived dataset:
+#   copy     - full byte copy (the original behaviour)
+#   hardlink - second directory entry for the same file, no extra bytes
+#   reflink  - copy-on-write clone (Btrfs, XFS, ...), no extra bytes until modified
+#   symlink  - link pointing back at the source file
+# Every mode except 'copy' falls back to a copy when it is not possible,
+# e.g. when the output folder is on another drive than the source.
+LINK_MODES = ['copy', 'hardlink', 'reflink', 'symlink']
+
+FICLONE = 0x40049409  # Linux ioctl used by `cp --reflink`
+
+COPY_CHUNK = 8 * 1024 * 1024
+
+_fallback_warned = set()
+
+
+def add_link_mode_argument(parser, default='copy'):
+    """Adds the shared --link-mode option to an argparse parser."""
+    parser.add_argument('--link-mode', choices=LINK_MODES, default=default,
+                        help="How images and unchanged labels are placed in the output "
+                             "(falls back to copy when a link is not possible).")
+
+
+def _remove_existing(dst):
+    # Never write through an existing hardlink/symlink into the source dataset.
+    try:
+        os.remove(dst)
+    except FileNotFoundError:
+        pass
+
+
+def _reflink(src, dst):
+    """Clones src to dst with a copy-on-write reflink. Raises OSError if unsupported."""
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError("reflink is not supported on this platform")
+
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+
+
+def _kernel_copy(fsrc, fdst, size):
+    """
+    Copies `size` bytes between open files inside the kernel.
+
+    Tries os.copy_file_range, then os.sendfile, then a plain read/write loop;
+    each step continues from the current file positions, so a fallback in
+    the middle of a file is safe. A kernel call that stops early (returns 0
+    before `size` bytes) hands the rest to the read/write loop.
+    """
+    src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+    copied = 0
+    for kernel_call in (getattr(os, 'copy_file_range', None), getattr(os, 'sendfile', None)):
+        if kernel_call is None:
+            continue
+        try:
+            while copied < size:
+                if kernel_call is os.sendfile:
+                    sent = os.sendfile(dst_fd, src_fd, None, min(COPY_CHUNK, size - copied))
+                else:
+                    sent = kernel_call(src_fd, dst_fd, min(COPY_CHUNK, size - copied))
+                if sent == 0:
+                    break
+                copied += sent
+        except OSError:
+            # Cross-filesystem on old kernels, unsupported filesystem, ...
+            continue
+        if copied >= size:
+            return
+        break
+    shutil.copyfileobj(fsrc, fdst, COPY_CHUNK)
+
+
+def copy_file(src, dst, preserve_metadata=False):
+    """
+    Copies `src` to `dst` like shutil.copy (or copy2 with `preserve_metadata`).
+
+    On Linux the bytes never pass through Python: os.copy_file_range (which can
+    also clone on Btrfs/XFS/NFS) or os.sendfile do the copy. Where neither
+    exists (Windows), shutil's own fast path is used.
+
+    Returns:
+        int: Size of the copied file in bytes.
+    """
+    if not hasattr(os, 'copy_file_range') and not hasattr(os, 'sendfile'):
+        (shutil.copy2 if preserve_metadata else shutil.copy)(src, dst)
+        return os.path.getsize(dst)
+
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        _kernel_copy(fsrc, fdst, size)
+        written = fdst.tell()
+    if written != size:
+        raise OSError(f"Short copy of {src}: {written} of {size} bytes")
+    if preserve_metadata:
+        shutil.copystat(src, dst)
+    else:
+        shutil.copymode(src, dst)
+    return size
+
+
+def append_file(src, fdst):
+    """
+    Appends all of `src` to `fdst`, an unbuffered binary file (open(..., 'wb', buffering=0)),
+    at its current position, inside the kernel where possible.
+
+    Returns:
+        int: Number of bytes appended.
+    """
+    with open(src, 'rb') as fsrc:
+        size = os.fstat(fsrc.fileno()).st_size
+        start = fdst.tell()
+        _kernel_copy(fsrc, fdst, size)
+    if fdst.tell() - start != size:
+        raise OSError(f"Short copy of {src}: {fdst.tell() - start} of {size} bytes")
+    return size
+
+
+def _warn_fallback(link_mode, src, error):
+    if link_mode not in _fallback_warned:
+        _fallback_warned.add(link_mode)
+        print(f"     ⚠ {link_mode} not possible for {src} ({error}); falling back to copy.")
+
+
+def materialize_file(src, dst, link_mode='copy', preserve_metadata=False):
+    """
+    Places the file `src` at `dst` using the requested link mode.
+
+    Args:
+        src: Path of the source file.
+        dst: Destination path. An existing file there is replaced.
+        link_mode (str): One of LINK_MODES.
+        preserve_metadata (bool): Keep timestamps/permissions like shutil.copy2
+            when the file ends up being copied or reflinked.
+
+    Returns:
+        str: The mode that was actually used ('copy' after a fallback).
+    """
+    if link_mode not in LINK_MODES:
+        raise ValueError(f"Unknown link mode '{link_mode}'. Expected one of {LINK_MODES}.")
+
+    src, dst = os.fspath(src), os.fspath(dst)
+    _remove_existing(dst)
+
+    try:
+        if link_mode == 'hardlink':
+            os.link(src, dst)
+            return link_mode
+        if link_mode == 'symlink':
+            os.symlink(os.path.abspath(src), dst)
+            return link_mode
+        if link_mode == 'reflink':
+            _reflink(src, dst)
+            if preserve_metadata:
+                shutil.copystat(src, dst)
+            return link_mode
+    except OSError as e:
+        # Cross-device link, unsupported filesystem, missing symlink privilege, ...
+        _warn_fallback(link_mode, src, e)
+
+    copy_file(src, dst, preserve_metadata)
+    return 'copy'
+
+
+def write_label(dst, text, src=None, src_text=None, link_mode='copy'):
+    """
+    Writes a label file into the output dataset.
+
+    When the new `text` is identical to the source label's contents (`src_text`
+    read from `src`), the source file is materialized with `link_mode` instead,
+    so only labels that actually change get fresh bytes on disk.
+    """
+    if link_mode != 'copy' and src is not None and text == src_text:
+        return materialize_file(src, dst, link_mode)
+
+    _remove_existing(dst)
+    with open(dst, 'w') as f:
+        f.write(text)
+    return 'copy'
@@ -0,0 +1,286 @@
+import os
+import json
+import argparse
+from pathlib import Path
+from collections import Counter
+import numpy as np
+from contenthash import HashCache, HASH_WORKERS, add_hash_workers_argument
+from imageindex import list_split_images
+from labelcache import add_cache_dir_argument, configure_label_cache, dataset_cache_path
+from instrument import add_metrics_arguments, begin_stage, count, start_metrics, finish_metrics
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# --- CONFIGURATION ---
+DATASET_PATH = Path(r"C:\Users\HP\Desktop\master_dataset")
+SPLITS = ['train', 'valid', 'test']
+
+# Images whose 64-bit difference hashes differ in at most this many bits are near-duplicates.
+# 0 finds re-encodes only; 4-6 also catches resized, recompressed and lightly edited copies.
+HAMMING_RADIUS = 4
+
+# What to do with near-duplicate clusters that span splits. Every cluster is kept in the
+# first of SPLITS it appears in (train before valid before test); its copies elsewhere:
+#   'report' - are only listed (near_duplicates.json next to the splits)
+#   'move'   - are moved, with their labels, into that split
+#   'drop'   - are deleted, with their labels
+RESOLVE = 'report'
+RESOLVE_MODES = ['report', 'move', 'drop']
+
+REPORT_NAME = 'near_duplicates.json'
+# Difference hashes are cached by (path, size, mtime) in the cache folder (--cache-dir), so re-runs
+# only decode new images
+CACHE_NAME = 'dhash_cache.json'
+# ---------------------
+
+HASH_BITS = 64
+# Candidate pairs are checked in blocks of about this many, to bound memory
+PAIR_BLOCK = 1 << 22
+# Buckets larger than this (e.g. many images sharing a flat region) are compared row block by row block
+LARGE_BUCKET = 1024
+
+
+def dhash_file(path):
+    """
+    64-bit difference hash of an image.
+
+    The image is reduced to 9x8 grey pixels and every bit says whether a pixel
+    is brighter than its left neighbour. Resizing, recompression and small
+    colour changes flip few bits. JPEGs are decoded at reduced scale (draft).
+    """
+    with Image.open(path) as image:
+        image.draft('L', (64, 64))
+        pixels = np.asarray(image.convert('L').resize((9, 8), Image.Resampling.BOX), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+if hasattr(np, 'bitwise_count'):
+    def popcount(values):
+        """Number of set bits of every uint64."""
+        return np.bitwise_count(values)
+else:
+    _BYTE_BITS = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def popcount(values):
+        """Number of set bits of every uint64 (NumPy < 2.0: per-byte lookup)."""
+        values = np.ascontiguousarray(values, dtype=np.uint64)
+        return _BYTE_BITS[values.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.uint8)
+
+
+def near_pairs(hashes, radius):
+    """
+    All pairs (i, j), i < j, of distinct hashes at Hamming distance <= radius.
+
+    Multi-index hashing: the 64 bits are cut into radius + 1 substrings, and
+    two hashes within the radius agree exactly on at least one of them. For
+    every substring the hashes are sorted into buckets of equal value; only
+    pairs sharing a bucket are compared, with a vectorized XOR + popcount.
+
+    Args:
+        hashes (np.ndarray): Unique uint64 hashes.
+
+    Returns:
+        (np.ndarray, np.ndarray): i and j of every pair.
+    """
+    n = len(hashes)
+    if n < 2 or radius < 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    bounds = np.linspace(0, HASH_BITS, min(radius + 1, HASH_BITS) + 1).astype(np.int64)
+    found = []
+    candidates = 0
+    for lo, hi in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        keys = (hashes >> np.uint64(lo)) & np.uint64((1 << (hi - lo)) - 1)
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        sizes = np.diff(np.r_[starts, n])
+
+        for start, size in zip(starts[sizes > LARGE_BUCKET].tolist(), sizes[sizes > LARGE_BUCKET].tolist()):
+            members = order[start:start + size]
+            rows = max(1, PAIR_BLOCK // size)
+            for a in range(0, size, rows):
+                block = members[a:a + rows]
+                close = popcount(hashes[block, None] ^ hashes[None, members]) <= radius
+                r, c = np.nonzero(np.triu(close, a + 1))
+                candidates += close.size
+                i, j = block[r], members[c]
+                found.append((np.minimum(i, j), np.maximum(i, j)))
+
+        # Smaller buckets of the same size are compared together: one row of members per bucket
+        for size in np.unique(sizes[(sizes > 1) & (sizes <= LARGE_BUCKET)]).tolist():
+            first, second = np.triu_indices(size, 1)
+            bucket_starts = starts[sizes == size]
+            rows = max(1, PAIR_BLOCK // len(first))
+            for b in range(0, len(bucket_starts), rows):
+                members = order[bucket_starts[b:b + rows, None] + np.arange(size)]
+                for p in range(0, len(first), PAIR_BLOCK):
+                    i = members[:, first[p:p + PAIR_BLOCK]].ravel()
+                    j = members[:, second[p:p + PAIR_BLOCK]].ravel()
+                    candidates += len(i)
+                    close = popcount(hashes[i] ^ hashes[j]) <= radius
+                    found.append((np.minimum(i[close], j[close]), np.maximum(i[close], j[close])))
+    count('pairs_compared', candidates)
+
+    if not found:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    # A pair agreeing on several substrings was found once per substring
+    pair_keys = np.unique(np.concatenate([i * n + j for i, j in found]))
+    return pair_keys // n, pair_keys % n
+
+
+def connected_components(n, first, second):
+    """Component label (smallest member) of every node of an undirected graph, by min-label propagation."""
+    labels = np.arange(n)
+    while True:
+        low = np.minimum(labels[first], labels[second])
+        updated = labels.copy()
+        np.minimum.at(updated, first, low)
+        np.minimum.at(updated, second, low)
+        # Pointer jumping: follow labels to their own label until stable
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+def find_clusters(dataset_path, radius=HAMMING_RADIUS, splits=SPLITS, workers=HASH_WORKERS):
+    """
+    Groups the images of a dataset into near-duplicate clusters.
+
+    Returns:
+        (list, list, int): clusters as lists of (split, image name, hash) with
+        at least two images each, ordered by SPLITS and name within a cluster
+        and by their first image; unreadable images; number of images scanned.
+    """
+    dataset_path = Path(dataset_path)
+    images = list_split_images(dataset_path, splits)
+    print(f"🔍 Hashing {len(images)} images...")
+    cache = HashCache(dataset_cache_path(dataset_path, '.' + CACHE_NAME), digest=dhash_file, kind='dhash64')
+    hashes = cache.hash_files([dataset_path / split / 'images' / name for split, name in images], workers)
+    cache.save()
+
+    unreadable = [images[k] for k, h in enumerate(hashes) if h is None]
+    readable = [k for k, h in enumerate(hashes) if h is not None]
+    values = np.array([hashes[k] for k in readable], dtype=np.uint64)
+
+    # Identical hashes are one node of the graph
+    unique, inverse = np.unique(values, return_inverse=True)
+    print(f"🔗 Searching {len(unique)} distinct hashes within {radius} bits...")
+    first, second = near_pairs(unique, radius)
+    labels = connected_components(len(unique), first, second)[inverse]
+
+    sizes = Counter(labels.tolist())
+    members = {}
+    for k, label in zip(readable, labels.tolist()):
+        if sizes[label] > 1:
+            split, name = images[k]
+            members.setdefault(label, []).append((split, name, hashes[k]))
+    clusters = sorted(members.values(), key=lambda cluster: (splits.index(cluster[0][0]), cluster[0][1]))
+    count('near_duplicate_clusters', len(clusters))
+    return clusters, unreadable, len(images)
+
+
+def resolve_clusters(dataset_path, clusters, mode, splits=SPLITS):
+    """
+    Keeps every cluster in the first split it appears in; moves or deletes its copies elsewhere.
+
+    Labels go along with their images. A copy whose name already exists in the
+    target split is left where it is.
+
+    Returns:
+        int: Images moved or deleted.
+    """
+    dataset_path = Path(dataset_path)
+    changed = 0
+    for cluster in clusters:
+        target = cluster[0][0]
+        for split, name, _ in cluster:
+            if split == target:
+                continue
+            label_name = os.path.splitext(name)[0] + '.txt'
+            image_path = dataset_path / split / 'images' / name
+            label_path = dataset_path / split / 'labels' / label_name
+            if mode == 'drop':
+                image_path.unlink(missing_ok=True)
+                label_path.unlink(missing_ok=True)
+            else:
+                target_image = dataset_path / target / 'images' / name
+                target_label = dataset_path / target / 'labels' / label_name
+                if target_image.exists() or target_label.exists():
+                    print(f"   ⚠ {target}/images/{name} already exists, leaving {split}/images/{name}.")
+                    continue
+                os.replace(image_path, target_image)
+                if label_path.exists():
+                    os.replace(label_path, target_label)
+            changed += 1
+    return changed
+
+
+def write_report(dataset_path, clusters, unreadable, total, radius, splits=SPLITS):
+    """Writes near_duplicates.json and prints the leakage summary."""
+    spans = [len({split for split, _, _ in cluster}) > 1 for cluster in clusters]
+    cross = [cluster for cluster, spanning in zip(clusters, spans) if spanning]
+    leaked = Counter(split for cluster in cross for split, _, _ in cluster if split != cluster[0][0])
+
+    report = {
+        'radius': radius,
+        'images': total,
+        'unreadable': [f"{split}/images/{name}" for split, name in unreadable],
+        'clusters': [{'cross_split': spanning,
+                      'images': [{'path': f"{split}/images/{name}", 'hash': f"{h:016x}"} for split, name, h in cluster]}
+                     for cluster, spanning in zip(clusters, spans)],
+    }
+    report_path = Path(dataset_path) / REPORT_NAME
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    print("\n========================================")
+    print("🧬 NEAR-DUPLICATE REPORT")
+    print("========================================")
+    print(f"  - Images scanned:        {total}")
+    print(f"  - Near-duplicate groups: {len(clusters)} ({sum(len(c) for c in clusters)} images)")
+    print(f"  - Groups across splits:  {len(cross)}")
+    for split in splits:
+        if leaked[split]:
+            print(f"  - Copies leaking into {split}: {leaked[split]}")
+    if unreadable:
+        print(f"  - Unreadable images:     {len(unreadable)}")
+    print(f"\n📄 Full list written to {report_path}")
+    return cross
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Find near-duplicate images (perceptual hashes) and the ones leaking across splits.")
+    parser.add_argument('dataset', nargs='?', default=DATASET_PATH, type=Path,
+                        help="Dataset folder with train/valid/test splits.")
+    parser.add_argument('--radius', type=int, default=HAMMING_RADIUS,
+                        help="Largest Hamming distance (of 64 bits) between near-duplicates.")
+    parser.add_argument('--resolve', choices=RESOLVE_MODES, default=RESOLVE,
+                        help="Report, or move/drop the copies of a group outside its first split.")
+    add_hash_workers_argument(parser)
+    add_cache_dir_argument(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    if Image is None:
+        print("⚠ Pillow not installed. Run: pip install Pillow")
+        raise SystemExit(1)
+    start_metrics(args)
+    configure_label_cache(args)
+
+    begin_stage("hash")
+    clusters, unreadable, total = find_clusters(args.dataset, args.radius, workers=args.hash_workers)
+    begin_stage("report")
+    cross = write_report(args.dataset, clusters, unreadable, total, args.radius)
+
+    if args.resolve != 'report' and cross:
+        begin_stage("resolve")
+        changed = resolve_clusters(args.dataset, cross, args.resolve)
+        action = "Moved" if args.resolve == 'move' else "Deleted"
+        print(f"✅ {action} {changed} leaking copies (with their labels).")
+    finish_metrics(args)
@@ -0,0 +1,443 @@
+import os
+import json
+import mmap
+import shutil
+import argparse
+import threading
+import numpy as np
+import yaml
+from copyengine import CopyExecutor, add_copy_workers_argument, COPY_WORKERS
+from imageindex import ImageIndex, IMAGE_EXTENSIONS, report_orphans
+from journal import BuildJournal
+from labelcache import LabelTable, load_label_table, add_label_cache_arguments, configure_label_cache
+from materialize import append_file
+from instrument import add_metrics_arguments, count, stage, start_metrics, finish_metrics
+
+# Bump when the layout of a pack changes; readers refuse other versions.
+PACK_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+SPLITS = ['train', 'valid', 'test']
+
+# A new image shard is started once the current one would grow past this.
+SHARD_BYTES = 1024 ** 3
+
+# Layout of a pack folder:
+#   manifest.json              version, class names, YAML name, per-split counts and shards
+#   <split>-00000.bin, ...     image bytes, one file after the other
+#   <split>-labels.bin         raw label file bytes, one after the other
+#   <split>.index.npz          per-record offset/length/mtime arrays and the parsed labels
+# A record is one stem: its image, its label, or both (length -1 marks a missing file).
+#   <yaml>                     the source YAML, copied verbatim
+
+
+def _shard_name(split, shard):
+    return f"{split}-{shard:05d}.bin"
+
+
+def _label_blob_name(split):
+    return f"{split}-labels.bin"
+
+
+def _index_name(split):
+    return f"{split}.index.npz"
+
+
+def _pack_split(dataset_path, split, pack_dir, extensions, shard_bytes, verbose):
+    """Packs one split into pack_dir; returns its manifest entry, or None if the split is missing."""
+    image_dir = os.path.join(dataset_path, split, 'images')
+    label_dir = os.path.join(dataset_path, split, 'labels')
+    if not os.path.isdir(image_dir):
+        if verbose:
+            print(f"   - Warning: No '{split}/images' directory found. Skipping.")
+        return None
+
+    image_index = ImageIndex(image_dir, extensions)
+    labels = load_label_table(label_dir, verbose=verbose)
+    label_stems = labels.stems.tolist()
+    if verbose:
+        report_orphans(image_index.match_labels([stem + '.txt' for stem in label_stems]), split)
+    row_of_stem = {stem: i for i, stem in enumerate(label_stems)}
+
+    # One record per stem, in stem order, so orphans survive a round trip
+    stems = sorted(set(image_index.stem_to_name) | set(row_of_stem))
+    names = [image_index.find(stem) or '' for stem in stems]
+    n = len(stems)
+    image_shard = np.zeros(n, dtype=np.uint16)
+    image_offset = np.zeros(n, dtype=np.int64)
+    image_length = np.full(n, -1, dtype=np.int64)
+    image_mtime = np.zeros(n, dtype=np.int64)
+    label_offset = np.zeros(n, dtype=np.int64)
+    label_length = np.full(n, -1, dtype=np.int64)  # -1: the image has no label file
+    label_mtime = np.zeros(n, dtype=np.int64)
+    label_rows = np.full(n, -1, dtype=np.int64)
+
+    shards = []
+    shard_file = None
+    position = 0
+    with open(os.path.join(pack_dir, _label_blob_name(split)), 'wb') as label_blob:
+        try:
+            for i, (stem, name) in enumerate(zip(stems, names)):
+                if name:
+                    src = os.path.join(image_dir, name)
+                    st = os.stat(src)
+                    if shard_file is None or (position > 0 and position + st.st_size > shard_bytes):
+                        if shard_file is not None:
+                            shard_file.close()
+                        shards.append(_shard_name(split, len(shards)))
+                        shard_file = open(os.path.join(pack_dir, shards[-1]), 'wb', buffering=0)
+                        position = 0
+                    size = append_file(src, shard_file)
+                    image_shard[i] = len(shards) - 1
+                    image_offset[i] = position
+                    image_length[i] = size
+                    image_mtime[i] = st.st_mtime_ns
+                    position += size
+
+                row = row_of_stem.get(stem)
+                if row is not None:
+                    label_path = os.path.join(label_dir, stem + '.txt')
+                    with open(label_path, 'rb') as f:
+                        data = f.read()
+                    label_offset[i] = label_blob.tell()
+                    label_length[i] = len(data)
+                    label_mtime[i] = labels.mtimes[row]
+                    label_blob.write(data)
+                    label_rows[i] = row
+        finally:
+            if shard_file is not None:
+                shard_file.close()
+
+    # Parsed annotations of the packed labels, so counting never re-parses them
+    counts = np.zeros(n, dtype=np.int64)
+    has_label = label_rows >= 0
+    counts[has_label] = np.diff(labels.offsets)[label_rows[has_label]]
+    annotation_offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(counts, out=annotation_offsets[1:])
+    # Annotation rows of the label table, record by record
+    starts = labels.offsets[label_rows[has_label]]
+    rows = np.arange(annotation_offsets[-1]) + np.repeat(starts - annotation_offsets[:-1][has_label],
+                                                          counts[has_label])
+
+    with open(os.path.join(pack_dir, _index_name(split)), 'wb') as f:
+        np.savez(f, stems=np.array(stems, dtype=str), names=np.array(names, dtype=str), image_shard=image_shard, image_offset=image_offset,
+                 image_length=image_length, image_mtime=image_mtime, label_offset=label_offset,
+                 label_length=label_length, label_mtime=label_mtime, annotation_offsets=annotation_offsets,
+                 class_id=labels.class_id[rows], bbox=labels.bbox[rows])
+    has_image = image_length >= 0
+    image_bytes = int(image_length[has_image].sum())
+    count('files_copied', int(has_image.sum()) + int(has_label.sum()))
+    count('bytes_copied', image_bytes + int(label_length[has_label].sum()))
+    if verbose:
+        print(f"   - {split}: {int(has_image.sum())} images, {int(has_label.sum())} labels, "
+              f"{image_bytes / 1024 ** 2:.1f} MB in {len(shards)} shards.")
+    return {'records': n, 'images': int(has_image.sum()), 'labels': int(has_label.sum()), 'bytes': image_bytes,
+            'shards': shards}
+
+
+def _read_class_names(yaml_path):
+    with open(yaml_path, 'r') as f:
+        names = (yaml.safe_load(f) or {}).get('names') or []
+    if isinstance(names, dict):
+        names = [names[k] for k in sorted(names)]
+    return [str(name) for name in names]
+
+
+def pack_dataset(dataset_path, pack_dir, yaml_name='data.yaml', splits=SPLITS, extensions=IMAGE_EXTENSIONS,
+                 shard_bytes=SHARD_BYTES, verbose=True):
+    """
+    Packs a YOLO dataset (<split>/images + <split>/labels) into a pack folder.
+
+    Images are appended into a few large shard files (inside the kernel, see
+    append_file), labels into one blob per split; the offsets, lengths and
+    mtimes of every record go into NumPy arrays. The pack is built in a
+    staging folder and swapped into place when complete.
+    """
+    journal = BuildJournal(pack_dir)
+    manifest = {'version': PACK_VERSION, 'names': [], 'yaml': None, 'splits': {}}
+    yaml_path = os.path.join(dataset_path, yaml_name) if yaml_name else None
+    if yaml_path and os.path.isfile(yaml_path):
+        manifest['names'] = _read_class_names(yaml_path)
+        manifest['yaml'] = yaml_name
+        shutil.copyfile(yaml_path, journal.path(yaml_name))
+    elif verbose:
+        print(f"   - Warning: YAML file '{yaml_name}' not found; the pack has no class names.")
+
+    for split in splits:
+        with stage(f"pack {split}"):
+            entry = _pack_split(dataset_path, split, journal.staging_dir, extensions, shard_bytes, verbose)
+        if entry is not None:
+            manifest['splits'][split] = entry
+
+    with open(journal.path(MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    journal.commit()
+    return manifest
+
+
+class PackedSplit:
+    """
+    Random access to the records of one packed split.
+
+    Shards are memory-mapped on first use, so image(i) is a zero-copy
+    memoryview into the page cache. Views must be released before close().
+    """
+
+    def __init__(self, pack_dir, split, entry):
+        self.pack_dir = pack_dir
+        self.split = split
+        self.shards = entry['shards']
+        with np.load(os.path.join(pack_dir, _index_name(split))) as data:
+            self.stems = data['stems']
+            self.names = data['names']
+            self.image_shard = data['image_shard']
+            self.image_offset = data['image_offset']
+            self.image_length = data['image_length']
+            self.image_mtime = data['image_mtime']
+            self.label_offset = data['label_offset']
+            self.label_length = data['label_length']
+            self.label_mtime = data['label_mtime']
+            self.annotation_offsets = data['annotation_offsets']
+            self.class_id = data['class_id']
+            self.bbox = data['bbox']
+        self._maps = {}
+        self._maps_lock = threading.Lock()
+        self._row_of_stem = None
+
+    def __len__(self):
+        return len(self.stems)
+
+    def __getitem__(self, i):
+        """(image file name, image memoryview, label text) of record i; missing parts are '' / None."""
+        return self.names[i], self.image(i), self.label_text(i)
+
+    def _map(self, name):
+        mapped = self._maps.get(name)
+        if mapped is None:
+            with self._maps_lock:
+                mapped = self._maps.get(name)
+                if mapped is None:
+                    with open(os.path.join(self.pack_dir, name), 'rb') as f:
+                        size = os.fstat(f.fileno()).st_size
+                        # mmap cannot map an empty file
+                        mapped = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b'')
+                    self._maps[name] = mapped
+        return mapped
+
+    def find(self, stem):
+        """Record id of this stem, or None."""
+        if self._row_of_stem is None:
+            self._row_of_stem = {stem: i for i, stem in enumerate(self.stems.tolist())}
+        return self._row_of_stem.get(stem)
+
+    def image(self, i):
+        """Bytes of image i as a read-only memoryview (no copy), or None if the record has no image."""
+        if self.image_length[i] < 0:
+            return None
+        start = int(self.image_offset[i])
+        return self._map(self.shards[self.image_shard[i]])[start:start + int(self.image_length[i])]
+
+    def image_array(self, i):
+        """Image i as a uint8 NumPy array over the mapping, e.g. for cv2.imdecode."""
+        image = self.image(i)
+        return None if image is None else np.frombuffer(image, dtype=np.uint8)
+
+    def label(self, i):
+        """Raw bytes of the label of image i as a memoryview, or None if it has none."""
+        length = int(self.label_length[i])
+        if length < 0:
+            return None
+        start = int(self.label_offset[i])
+        return self._map(_label_blob_name(self.split))[start:start + length]
+
+    def label_text(self, i):
+        label = self.label(i)
+        return None if label is None else str(label, 'utf-8')
+
+    def classes_of(self, i):
+        """Class ids annotated in the label of image i."""
+        return self.class_id[self.annotation_offsets[i]:self.annotation_offsets[i + 1]]
+
+    def label_table(self):
+        """The packed labels as a LabelTable, for the counting/trimming code (no file is read)."""
+        has_label = self.label_length >= 0
+        counts = np.diff(self.annotation_offsets)[has_label]
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return LabelTable(self.stems[has_label], self.label_length[has_label], self.label_mtime[has_label], offsets,
+                          self.class_id, self.bbox)
+
+    def close(self):
+        for mapped in self._maps.values():
+            obj = mapped.obj
+            mapped.release()
+            if isinstance(obj, mmap.mmap):
+                obj.close()
+        self._maps = {}
+
+
+class PackedDataset:
+    """
+    Reader for a pack folder written by pack_dataset().
+
+        with PackedDataset('master.pack') as pack:
+            name, image, label = pack['train'][42]
+    """
+
+    def __init__(self, pack_dir):
+        self.pack_dir = os.fspath(pack_dir)
+        with open(os.path.join(self.pack_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('version') != PACK_VERSION:
+            raise ValueError(f"{self.pack_dir} has pack version {self.manifest.get('version')}, "
+                             f"expected {PACK_VERSION}.")
+        self.names = self.manifest['names']
+        self.splits = list(self.manifest['splits'])
+        self._open = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def __contains__(self, split):
+        return split in self.manifest['splits']
+
+    def __getitem__(self, split):
+        packed = self._open.get(split)
+        if packed is None:
+            if split not in self.manifest['splits']:
+                raise KeyError(f"Split '{split}' is not in {self.pack_dir}.")
+            packed = PackedSplit(self.pack_dir, split, self.manifest['splits'][split])
+            self._open[split] = packed
+        return packed
+
+    def close(self):
+        for packed in self._open.values():
+            packed.close()
+        self._open = {}
+
+
+def is_pack(path):
+    return os.path.isfile(os.path.join(path, MANIFEST_NAME))
+
+
+def _write_record(packed, i, image_path, label_path):
+    """Writes record i straight from the mapping; returns the bytes written."""
+    written = 0
+    image = packed.image(i)
+    if image is not None:
+        with open(image_path, 'wb') as f:
+            f.write(image)
+        mtime = int(packed.image_mtime[i])
+        os.utime(image_path, ns=(mtime, mtime))
+        written += len(image)
+    label = packed.label(i)
+    if label is not None:
+        with open(label_path, 'wb') as f:
+            f.write(label)
+        mtime = int(packed.label_mtime[i])
+        os.utime(label_path, ns=(mtime, mtime))
+        written += len(label)
+    return written
+
+
+def write_dataset_yaml(yaml_path, output_path, names):
+    """Writes a YOLO YAML with absolute paths into `output_path`, in the format of create_master_yaml()."""
+    output_path = os.path.abspath(output_path)
+    with open(yaml_path, 'w') as f:
+        f.write(f"train: {output_path}/train/images\n")
+        f.write(f"val: {output_path}/valid/images\n")
+        f.write(f"test: {output_path}/test/images\n\n")
+        f.write("names:\n")
+        for i, name in enumerate(names):
+            f.write(f"  {i}: {name}\n")
+
+
+def unpack_dataset(pack_dir, output_path, yaml_name=None, splits=None, copy_workers=COPY_WORKERS):
+    """
+    Restores the YOLO folder layout (<split>/images, <split>/labels and a YAML) from a pack.
+
+    File bytes and mtimes are identical to the packed dataset. The YAML is
+    written as `yaml_name` (default: the packed YAML's name) with paths
+    pointing at `output_path`. Built in a staging folder like the other
+    outputs.
+    """
+    journal = BuildJournal(output_path)
+    with PackedDataset(pack_dir) as pack:
+        copier = CopyExecutor(copy_workers)
+        with copier:
+            for split in pack.splits:
+                if splits is not None and split not in splits:
+                    continue
+                packed = pack[split]
+                image_dir = journal.path(os.path.join(split, 'images'))
+                label_dir = journal.path(os.path.join(split, 'labels'))
+                copier.make_dirs([image_dir, label_dir])
+                for i, (stem, name) in enumerate(zip(packed.stems.tolist(), packed.names.tolist())):
+                    copier.submit_task(_write_record, packed, i, os.path.join(image_dir, name),
+                                       os.path.join(label_dir, stem + '.txt'))
+        copier.report("records")
+        yaml_name = yaml_name or pack.manifest['yaml'] or 'data.yaml'
+        if pack.names:
+            # Paths point at the final folder, not at the staging one
+            write_dataset_yaml(journal.path(yaml_name), journal.output_dir, pack.names)
+        else:
+            print("   - Warning: The pack has no class names; no YAML written.")
+
+    if copier.failed:
+        journal.close()
+        print(f"❌ {copier.failed} records could not be written; '{output_path}' was left unchanged.")
+        return False
+    journal.commit()
+    return True
+
+
+def print_pack_info(pack_dir):
+    with PackedDataset(pack_dir) as pack:
+        print(f"📦 {pack_dir}: {len(pack.names)} classes")
+        for split, entry in pack.manifest['splits'].items():
+            print(f"  - {split}: {entry['images']} images, {entry['labels']} labels, "
+                  f"{entry['bytes'] / 1024 ** 2:.1f} MB in {len(entry['shards'])} shards")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pack a YOLO dataset into a few shard files and back.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    pack_parser = commands.add_parser('pack', help="YOLO folders -> pack folder.")
+    pack_parser.add_argument('dataset', help="Dataset folder with train/valid/test splits.")
+    pack_parser.add_argument('pack', help="Pack folder to create.")
+    pack_parser.add_argument('--yaml', default='data.yaml', help="YAML file in the dataset folder with the class names.")
+    pack_parser.add_argument('--shard-mb', type=int, default=SHARD_BYTES // 1024 ** 2,
+                             help="Start a new image shard past this size.")
+    add_label_cache_arguments(pack_parser)
+
+    unpack_parser = commands.add_parser('unpack', help="Pack folder -> YOLO folders.")
+    unpack_parser.add_argument('pack', help="Pack folder to read.")
+    unpack_parser.add_argument('dataset', help="Dataset folder to create.")
+    unpack_parser.add_argument('--yaml', default=None, help="Name of the YAML to write (default: the packed one).")
+    unpack_parser.add_argument('--split', action='append', choices=SPLITS, help="Only these splits (repeatable).")
+    add_copy_workers_argument(unpack_parser)
+
+    info_parser = commands.add_parser('info', help="Summarize a pack folder.")
+    info_parser.add_argument('pack')
+    for command_parser in (pack_parser, unpack_parser, info_parser):
+        add_metrics_arguments(command_parser)
+    args = parser.parse_args()
+    start_metrics(args)
+
+    if args.command == 'pack':
+        configure_label_cache(args)
+        print(f"🚀 Packing '{args.dataset}' into '{args.pack}'...")
+        pack_dataset(args.dataset, args.pack, yaml_name=args.yaml, shard_bytes=args.shard_mb * 1024 ** 2)
+        print_pack_info(args.pack)
+    elif args.command == 'unpack':
+        print(f"🚀 Unpacking '{args.pack}' into '{args.dataset}'...")
+        if unpack_dataset(args.pack, args.dataset, yaml_name=args.yaml, splits=args.split,
+                          copy_workers=args.copy_workers):
+            print(f"✅ Dataset ready in '{args.dataset}'.")
+    else:
+        print_pack_info(args.pack)
+    finish_metrics(args)
@@ -0,0 +1,506 @@
+import os
+import copy
+import random
+import argparse
+import numpy as np
+import yaml
+from classregistry import discover_classes, read_yaml_classes
+from classtable import compile_class_table, normalize_class_name, remap_label_texts
+from copyengine import CopyExecutor, add_copy_workers_argument, COPY_WORKERS
+from datasetindex import DatasetIndex
+from imageindex import ImageIndex, IMAGE_EXTENSIONS, report_orphans
+from instrument import add_metrics_arguments, begin_stage, stage, start_metrics, finish_metrics
+from journal import BuildJournal, add_resume_argument
+from labelcache import load_label_table, add_label_cache_arguments, configure_label_cache
+from materialize import add_link_mode_argument
+from TRIMMINGCLASSSIZE9000 import greedy_trim, random_trim
+from SORTINGFROMSIZE400MIN5000MAX import plan_balance_index
+from forsplittingintraintestvalid import assign_split, iterative_stratification, TRAIN_RATIO, VALID_RATIO
+
+SPLITS = ['train', 'valid', 'test']
+# Labels are read and remapped in batches of this many files while writing
+WRITE_BATCH = 4096
+
+
+class SourceTable:
+    """
+    Every label file of the sources, read once, as flat arrays.
+
+    A row ("base sample") is one label file of one (dataset, split) group with
+    its image, if any. Annotations are stored as global old class ids: the
+    class list of every dataset occupies its own range of `old_to_master`, so
+    one array lookup maps any annotation to the master class list.
+    """
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.groups = []             # dicts: prefix, split, image_dir, label_dir, class_base, num_classes
+        self._old_to_master = []
+        self._group = []
+        self._split = []
+        self._sizes = []
+        self._ann_counts = []
+        self._ann_old = []
+        self.stems = []
+        self.images = []
+
+    def add_dataset(self, dataset_path, old_classes, class_map, prefix=None, splits=SPLITS,
+                    extensions=IMAGE_EXTENSIONS, verbose=True):
+        """
+        Adds the splits of one YOLO dataset.
+
+        `class_map` maps a normalized old class name to its master id; classes
+        it does not know are dropped. With a `prefix` every output name becomes
+        '<prefix>_<name>', as in the merge.
+        """
+        class_base = sum(len(table) for table in self._old_to_master)
+        self._old_to_master.append(compile_class_table(old_classes, class_map, normalize_class_name))
+        label = prefix or os.path.basename(os.path.normpath(dataset_path))
+        for split in splits:
+            image_dir = os.path.join(dataset_path, split, 'images')
+            label_dir = os.path.join(dataset_path, split, 'labels')
+            if not os.path.isdir(label_dir):
+                continue
+            labels = load_label_table(label_dir)
+            stems = labels.stems.tolist()
+            image_index = ImageIndex(image_dir, extensions, with_sizes=True)
+            if verbose:
+                report_orphans(image_index.match_labels([stem + '.txt' for stem in stems]), f"{label}/{split}")
+
+            group = len(self.groups)
+            self.groups.append({'prefix': prefix, 'split': split, 'image_dir': image_dir, 'label_dir': label_dir,
+                                'class_base': class_base, 'num_classes': len(old_classes)})
+            self._group.append(np.full(len(stems), group, dtype=np.int32))
+            self._split.append(np.full(len(stems), SPLITS.index(split), dtype=np.int8))
+            self.stems.extend(stems)
+            images = [image_index.find(stem) for stem in stems]
+            self.images.extend(images)
+            self._sizes.append(np.array([(image_index.size(stem) or 0) for stem in stems], dtype=np.int64)
+                               + labels.sizes)
+
+            class_id = labels.class_id.astype(np.int64)
+            valid = (class_id >= 0) & (class_id < len(old_classes))
+            self._ann_old.append(np.where(valid, class_id + class_base, -1))
+            self._ann_counts.append(np.diff(labels.offsets))
+
+    def finalize(self):
+        def join(pieces, dtype):
+            return np.concatenate(pieces) if pieces else np.array([], dtype=dtype)
+
+        self.old_to_master = join(self._old_to_master, np.int32)
+        self.group = join(self._group, np.int32)
+        self.split = join(self._split, np.int8)
+        self.sizes = join(self._sizes, np.int64)
+        self.ann_old = join(self._ann_old, np.int64)
+        self.ann_ptr = np.zeros(len(self.group) + 1, dtype=np.int64)
+        np.cumsum(join(self._ann_counts, np.int64), out=self.ann_ptr[1:])
+        self.has_image = np.array([image is not None for image in self.images], dtype=bool)
+        del self._old_to_master, self._group, self._split, self._sizes, self._ann_old, self._ann_counts
+        return self
+
+    def __len__(self):
+        return len(self.group)
+
+    def out_stem(self, base, dup=-1):
+        prefix = self.groups[self.group[base]]['prefix']
+        stem = f"{prefix}_{self.stems[base]}" if prefix else self.stems[base]
+        return stem if dup < 0 else f"{stem}_aug_{dup}"
+
+
+class PipelineState:
+    """
+    The planned output: which base samples are written, to which split, and how classes map.
+
+    `base` may repeat a base sample; `dup` >= 0 marks its '_aug_<dup>' copies.
+    `old_to_current` maps every global old class id to the current class list.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.names = list(table.names)
+        self.old_to_current = table.old_to_master.copy()
+        self.base = np.arange(len(table), dtype=np.int64)
+        self.split = table.split.copy()
+        self.dup = np.full(len(table), -1, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.base)
+
+    def select(self, mask):
+        self.base, self.split, self.dup = self.base[mask], self.split[mask], self.dup[mask]
+
+    def annotations(self):
+        """(sample position, current class id) of every kept annotation of the current samples."""
+        ptr = self.table.ann_ptr
+        starts, counts = ptr[self.base], ptr[self.base + 1] - ptr[self.base]
+        total = int(counts.sum())
+        first = np.cumsum(counts) - counts
+        positions = np.arange(total) - np.repeat(first, counts) + np.repeat(starts, counts)
+        old = self.table.ann_old[positions]
+        classes = np.where(old >= 0, self.old_to_current[np.maximum(old, 0)], -1)
+        samples = np.repeat(np.arange(len(self.base)), counts)
+        keep = classes >= 0
+        return samples[keep], classes[keep]
+
+    def index(self, with_sizes=False):
+        """A DatasetIndex over the current samples (image id = position), for trimming and balancing."""
+        samples, classes = self.annotations()
+        index = DatasetIndex(['pipeline'])
+        # Names are not needed for planning
+        sizes = self.table.sizes[self.base].tolist() if with_sizes else None
+        index.add_split('pipeline', [''] * len(self.base), samples, classes, sizes)
+        return index.finalize(num_classes=len(self.names))
+
+    def drop_empty(self):
+        """Drops samples without any kept annotation, like the merge and the filters do."""
+        samples, _ = self.annotations()
+        has_annotation = np.zeros(len(self.base), dtype=bool)
+        has_annotation[samples] = True
+        self.select(has_annotation)
+
+    def drop_missing_images(self):
+        """Drops labels without an image; trimming and splitting only see images."""
+        self.select(self.table.has_image[self.base])
+
+    def class_counts(self, split=None):
+        """Images per current class (optionally of one split)."""
+        samples, classes = self.annotations()
+        if split is not None:
+            in_split = self.split[samples] == SPLITS.index(split)
+            samples, classes = samples[in_split], classes[in_split]
+        pairs = np.unique(samples * max(len(self.names), 1) + classes)
+        return np.bincount(pairs % max(len(self.names), 1), minlength=len(self.names))
+
+
+class Pipeline:
+    """
+    Lazy chain of the dataset scripts over one in-memory table of the sources.
+
+    Every step (filter, trim, balance, split) only records what to do; plan()
+    runs them on arrays, and materialize() then reads each kept label once,
+    remaps it from its source class list straight to the final one and writes
+    the final dataset. No intermediate dataset is ever written.
+
+        Pipeline.from_sources(abcdesease).filter(selected).trim(9000).split(mode='stratified', seed=0)
+            .materialize(output)
+    """
+
+    def __init__(self, load, steps=()):
+        self._load = load
+        self.steps = list(steps)
+
+    # --- Sources ---
+
+    @classmethod
+    def from_sources(cls, datasets_parent, classes=None, verbose=True):
+        """
+        Extract + merge: every dataset folder with a data.yaml in `datasets_parent`.
+
+        `classes` is the master class list; by default it comes from the class
+        registry of `datasets_parent` (firstlythistoexttractclasses.py), which is
+        created or refreshed as needed. Output names get the dataset folder name as prefix and
+        labels left without any known class are dropped, as in secondlythis.py.
+        """
+        def load():
+            registry = discover_classes(datasets_parent, verbose=verbose)
+            datasets = {name: entry['names'] for name, entry in registry['datasets'].items() if entry['names']}
+            names = list(classes) if classes is not None else registry['names']
+            if verbose:
+                source = "given" if classes is not None else "from the class registry"
+                print(f"   - {len(datasets)} datasets, {len(names)} master classes ({source}).")
+            class_map = {normalize_class_name(name): i for i, name in enumerate(names)}
+            table = SourceTable(names)
+            for prefix, old_classes in datasets.items():
+                table.add_dataset(os.path.join(datasets_parent, prefix), old_classes, class_map,
+                                  prefix=prefix, verbose=verbose)
+            state = PipelineState(table.finalize())
+            state.drop_empty()
+            return state
+        return cls(load)
+
+    @classmethod
+    def from_dataset(cls, dataset_path, yaml_name='master.yaml', verbose=True):
+        """An already merged dataset (e.g. the master), keeping its names and class ids."""
+        def load():
+            names = read_yaml_classes(os.path.join(dataset_path, yaml_name))
+            table = SourceTable(names)
+            table.add_dataset(dataset_path, names, {normalize_class_name(name): i for i, name in enumerate(names)},
+                              verbose=verbose)
+            return PipelineState(table.finalize())
+        return cls(load)
+
+    # --- Steps ---
+
+    def _then(self, name, **params):
+        return Pipeline(self._load, self.steps + [(name, params)])
+
+    def filter(self, classes):
+        """
+        Keeps only `classes` (new ids in the given order), like filteringclassesfromfinal.py.
+
+        Names are matched like in the merge, ignoring case and surrounding spaces.
+        """
+        return self._then('filter', classes=list(classes))
+
+    def trim(self, limit, strategy='greedy', seed=None, smallest_first=False):
+        """Caps every class at `limit` images, like TRIMMINGCLASSSIZE9000.py."""
+        return self._then('trim', limit=limit, strategy=strategy, seed=seed, smallest_first=smallest_first)
+
+    def balance(self, min_images, max_images, split='train', seed=None):
+        """
+        Under/oversamples one split (None: all samples), like SORTINGFROMSIZE400MIN5000MAX.py.
+
+        Oversampled copies are written as '_aug_<n>' files of their source image.
+        """
+        return self._then('balance', min_images=min_images, max_images=max_images, split=split, seed=seed)
+
+    def split(self, train_ratio=TRAIN_RATIO, valid_ratio=VALID_RATIO, mode='shuffle', seed=None):
+        """
+        Re-splits all samples, like forsplittingintraintestvalid.py ('shuffle', 'hash' or 'stratified').
+
+        The '_aug_' copies of a balance step go to the same split as their
+        original, so no image ends up in two splits.
+        """
+        return self._then('split', train_ratio=train_ratio, valid_ratio=valid_ratio, mode=mode, seed=seed)
+
+    # --- Planning ---
+
+    def plan(self, verbose=True):
+        """Loads the sources and runs every step on arrays. Nothing is written."""
+        begin_stage("load")
+        state = self._load()
+        if verbose:
+            print(f"   - load: {len(state)} samples")
+        for name, params in self.steps:
+            begin_stage(name)
+            before = len(state)
+            getattr(self, f"_plan_{name}")(state, **params)
+            if verbose:
+                print(f"   - {name}: {before} -> {len(state)} samples")
+        return state
+
+    @staticmethod
+    def _plan_filter(state, classes):
+        known = {normalize_class_name(name) for name in state.names}
+        missing = [name for name in classes if normalize_class_name(name) not in known]
+        if missing:
+            print(f"   ⚠ Selected classes not in the class list: {missing}")
+        table = compile_class_table(state.names, {normalize_class_name(name): i for i, name in enumerate(classes)},
+                                    normalize_class_name)
+        state.old_to_current = np.where(state.old_to_current >= 0, table[np.maximum(state.old_to_current, 0)], -1)
+        state.names = list(classes)
+        state.drop_empty()
+
+    @staticmethod
+    def _plan_trim(state, limit, strategy, seed, smallest_first):
+        state.drop_missing_images()
+        if seed is not None:
+            random.seed(seed)
+        index = state.index(with_sizes=True)
+        keep = greedy_trim(index, limit, smallest_first) if strategy == 'greedy' else random_trim(index, limit)
+        state.select(keep)
+
+    @staticmethod
+    def _plan_balance(state, min_images, max_images, split, seed):
+        if seed is not None:
+            random.seed(seed)
+        in_split = np.ones(len(state), dtype=bool) if split is None else state.split == SPLITS.index(split)
+        positions = np.nonzero(in_split)[0]
+        part = copy.copy(state)
+        part.select(positions)
+        keep, duplicates, _ = plan_balance_index(part.index(), state.names, min_images, max_images)
+
+        keep_all = ~in_split
+        keep_all[positions[keep]] = True
+        copies = np.array([positions[image] for image, _ in duplicates], dtype=np.int64)
+        numbers = np.array([n for _, n in duplicates], dtype=np.int32)
+        state.base = np.concatenate([state.base[keep_all], state.base[copies]])
+        state.split = np.concatenate([state.split[keep_all], state.split[copies]])
+        state.dup = np.concatenate([state.dup[keep_all], numbers])
+
+    @staticmethod
+    def _plan_split(state, train_ratio, valid_ratio, mode, seed):
+        state.drop_missing_images()
+        # Assign every base sample once; its '_aug_' copies follow it
+        bases, first = np.unique(state.base, return_index=True)
+        table = state.table
+        if mode == 'hash':
+            assignment = np.array([SPLITS.index(assign_split(table.out_stem(base), train_ratio, valid_ratio))
+                                   for base in bases.tolist()], dtype=np.int8)
+        elif mode == 'stratified':
+            samples, classes = state.annotations()
+            label_matrix = np.zeros((len(bases), len(state.names)), dtype=bool)
+            label_matrix[np.searchsorted(bases, state.base[samples]), classes] = True
+            ratios = [train_ratio, valid_ratio, 1.0 - train_ratio - valid_ratio]
+            assignment = iterative_stratification(label_matrix, ratios, seed).astype(np.int8)
+        else:
+            # Same order and cut as the splitter: sorted image names, shuffled, cut by the ratios
+            names = [table.out_stem(base) + os.path.splitext(table.images[base])[1] for base in bases.tolist()]
+            order = sorted(range(len(bases)), key=names.__getitem__)
+            random.Random(seed).shuffle(order)
+            train_end = int(len(order) * train_ratio)
+            valid_end = train_end + int(len(order) * valid_ratio)
+            assignment = np.zeros(len(bases), dtype=np.int8)
+            assignment[order[train_end:valid_end]] = 1
+            assignment[order[valid_end:]] = 2
+        state.split = assignment[np.searchsorted(bases, state.base)]
+
+    # --- Output ---
+
+    def materialize(self, output_path, link_mode='copy', copy_workers=COPY_WORKERS, resume=False, verbose=True):
+        """
+        Plans, then writes the final dataset in one pass.
+
+        Every kept label file is read once and remapped from its source class
+        list to the final one; images are placed with `link_mode`. The output
+        is built in '<output>.staging' and swapped in when complete.
+
+        Returns:
+            PipelineState: The plan that was written, or None if files failed.
+        """
+        state = self.plan(verbose)
+
+        begin_stage("write")
+        journal = BuildJournal(output_path, resume=resume)
+        copier = CopyExecutor(copy_workers, link_mode, preserve_metadata=True)
+        with copier:
+            journal.make_dirs(copier, [os.path.join(split, sub) for split in SPLITS for sub in ['images', 'labels']])
+            order = np.lexsort((state.dup, state.base))
+            for start in range(0, len(order), WRITE_BATCH):
+                batch = order[start:start + WRITE_BATCH]
+                self._write_batch(journal, copier, state, batch)
+        copier.report("images and labels")
+
+        with stage("yaml"):
+            journal.want('data.yaml')
+            with open(journal.path('data.yaml'), 'w') as f:
+                yaml.dump({'path': os.path.abspath(output_path), 'train': 'train/images', 'val': 'valid/images',
+                           'test': 'test/images', 'names': state.names}, f, sort_keys=False)
+
+        begin_stage("publish")
+        if copier.failed:
+            journal.close()
+            print(f"❌ {copier.failed} files could not be written. Fix the cause and re-run with --resume.")
+            return None
+        journal.commit()
+        if verbose:
+            for split in SPLITS:
+                print(f"   - {split}: {int((state.split == SPLITS.index(split)).sum())} samples")
+        return state
+
+    @staticmethod
+    def _write_batch(journal, copier, state, batch):
+        table = state.table
+        bases = state.base[batch]
+        texts = {}
+        for base in np.unique(bases).tolist():
+            group = table.groups[table.group[base]]
+            with open(os.path.join(group['label_dir'], table.stems[base] + '.txt'), 'r') as f:
+                texts[base] = f.read()
+
+        # One remap per (dataset) class table
+        new_texts = {}
+        by_group = {}
+        for base in texts:
+            by_group.setdefault(int(table.group[base]), []).append(base)
+        for group_id, group_bases in by_group.items():
+            group = table.groups[group_id]
+            class_table = state.old_to_current[group['class_base']:group['class_base'] + group['num_classes']]
+            remapped, _, _ = remap_label_texts([texts[base] for base in group_bases], class_table)
+            new_texts.update(zip(group_bases, remapped))
+
+        for base, split, dup in zip(bases.tolist(), state.split[batch].tolist(), state.dup[batch].tolist()):
+            group = table.groups[table.group[base]]
+            split_name = SPLITS[split]
+            out_stem = table.out_stem(base, dup)
+            journal.write_label(copier, os.path.join(split_name, 'labels', out_stem + '.txt'), new_texts[base],
+                                src=os.path.join(group['label_dir'], table.stems[base] + '.txt'),
+                                src_text=texts[base])
+            image = table.images[base]
+            if image is not None:
+                journal.copy(copier, os.path.join(group['image_dir'], image),
+                             os.path.join(split_name, 'images', out_stem + os.path.splitext(image)[1]))
+
+
+class _StepAction(argparse.Action):
+    """Collects the step options into args.steps in command-line order."""
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        steps = list(getattr(namespace, 'steps', None) or [])
+        steps.append((self.dest, values))
+        namespace.steps = steps
+
+
+def parse_pair(text, kind=float):
+    """'400:5000' -> (400, 5000)."""
+    first, _, second = text.partition(':')
+    return kind(first), kind(second)
+
+
+def build_pipeline(args):
+    if args.from_dataset:
+        pipeline = Pipeline.from_dataset(args.source, args.yaml)
+    else:
+        classes = read_yaml_classes(args.classes) if args.classes else None
+        pipeline = Pipeline.from_sources(args.source, classes)
+    for name, value in getattr(args, 'steps', None) or []:
+        if name == 'filter':
+            pipeline = pipeline.filter([part.strip() for part in value.split(',') if part.strip()])
+        elif name == 'trim':
+            pipeline = pipeline.trim(value, strategy=args.trim_strategy, seed=args.seed,
+                                     smallest_first=args.trim_smallest_first)
+        elif name == 'balance':
+            min_images, max_images = parse_pair(value, int)
+            pipeline = pipeline.balance(min_images, max_images, split=args.balance_split or None, seed=args.seed)
+        elif name == 'split':
+            train_ratio, valid_ratio = parse_pair(value)
+            pipeline = pipeline.split(train_ratio, valid_ratio, mode=args.split_mode, seed=args.seed)
+    return pipeline
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Extract, merge, filter, trim, balance and split YOLO datasets in one pass. "
+                    "Steps run in the order they are given; only the final dataset is written.")
+    parser.add_argument('source', help="Folder of datasets with a data.yaml each (like 'abcdesease').")
+    parser.add_argument('output', help="Folder for the final dataset.")
+    parser.add_argument('--from-dataset', action='store_true',
+                        help="SOURCE is one merged dataset (e.g. the master) instead of a folder of datasets.")
+    parser.add_argument('--yaml', default='master.yaml', help="YAML with the class names for --from-dataset.")
+    parser.add_argument('--classes', help="YAML whose names are the master class list (default: extracted).")
+    parser.add_argument('--filter', action=_StepAction, metavar='NAMES', help="Comma-separated classes to keep.")
+    parser.add_argument('--trim', action=_StepAction, type=int, metavar='LIMIT', help="Cap every class at LIMIT images.")
+    parser.add_argument('--trim-strategy', choices=['greedy', 'random'], default='greedy')
+    parser.add_argument('--trim-smallest-first', action='store_true',
+                        help="Greedy trim: try the smallest files first instead of a random order.")
+    parser.add_argument('--balance', action=_StepAction, metavar='MIN:MAX', help="Under/oversample to MIN..MAX images per class.")
+    parser.add_argument('--balance-split', default='train', choices=SPLITS + [''],
+                        help="Split balanced by --balance ('' = all samples).")
+    parser.add_argument('--split', action=_StepAction, metavar='TRAIN:VALID',
+                        help="Re-split with these train and valid ratios (the rest is test).")
+    parser.add_argument('--split-mode', choices=['shuffle', 'hash', 'stratified'], default='shuffle')
+    parser.add_argument('--seed', type=int, default=None, help="Seed of the random steps.")
+    parser.add_argument('--dry-run', action='store_true', help="Plan and print the result, write nothing.")
+    add_link_mode_argument(parser)
+    add_copy_workers_argument(parser)
+    add_resume_argument(parser)
+    add_label_cache_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    start_metrics(args)
+    configure_label_cache(args)
+
+    print(f"🚀 Building '{args.output}' from '{args.source}' in one pass...")
+    pipeline = build_pipeline(args)
+    if args.dry_run:
+        state = pipeline.plan()
+        begin_stage("report")
+        for split in SPLITS:
+            counts = state.class_counts(split)
+            print(f"\n📊 {split}: {int((state.split == SPLITS.index(split)).sum())} samples")
+            for class_id in np.nonzero(counts)[0].tolist():
+                print(f"   - {state.names[class_id]}: {int(counts[class_id])} images")
+    elif pipeline.materialize(args.output, link_mode=args.link_mode, copy_workers=args.copy_workers,
+                              resume=args.resume) is not None:
+        print(f"\n✅ Final dataset ready in '{args.output}'.")
+    finish_metrics(args)
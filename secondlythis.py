@@ -1,10 +1,28 @@
 import os
-import shutil
+import json
+import time
+import argparse
 from pathlib import Path
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from materialize import add_link_mode_argument
+from copyengine import CopyExecutor, add_copy_workers_argument, COPY_WORKERS
+from imageindex import IMAGE_EXTENSIONS, ImageIndex, list_label_files, report_orphans
+from instrument import add_metrics_arguments, begin_stage, count, stage, start_metrics, finish_metrics
+from classtable import RemapReport, compile_class_table, normalize_class_name, remap_label_texts
+from classregistry import REGISTRY_NAME, discover_classes
+from contenthash import HASH_CACHE_NAME, HASH_WORKERS, HashCache, add_hash_workers_argument, content_digest
+from imageheaders import check_images
+from labelcache import add_cache_dir_argument, configure_label_cache
+import numpy as np
 
 datasets_parent = Path(r"C:\Users\HP\Desktop\abcdesease")
 
+# Class registry written by firstlythistoexttractclasses.py. When it exists, the master
+# class list and the class table of every dataset come from it (refreshed for data.yaml
+# files changed since) instead of from master_class_list below; --no-registry ignores it.
+CLASS_REGISTRY = datasets_parent / REGISTRY_NAME
+
 master_class_list = [
     'Ants',
     'Bees',
@@ -58,12 +76,45 @@ master_class_list = [
 
 output_path = Path(r"C:\Users\HP\Desktop\master_dataset")
 
+# Parallel merge settings (can also be set with --workers / --executor).
+# MERGE_WORKERS = 1 keeps the original one-file-at-a-time behaviour.
+MERGE_WORKERS = 1
+MERGE_EXECUTOR = 'thread'   # 'thread' (I/O bound) or 'process' (CPU bound remapping)
+MERGE_BATCH_SIZE = 256      # label files per work unit handed to a worker
+
+# How images are placed in master_dataset: 'copy', 'hardlink', 'reflink' or 'symlink'
+LINK_MODE = 'copy'
+# Parallel file copies inside a batch (serial merge only; with --workers > 1 the pool is the parallelism)
+MERGE_COPY_WORKERS = COPY_WORKERS
+
+# Incremental merge: master_dataset keeps a manifest of every source file (path, size,
+# mtime, optional SHA-1) and the remap table used, so re-runs only touch what changed.
+INCREMENTAL = True          # --full-rebuild ignores the manifest for one run
+HASH_SOURCES = False        # --hash: a touched-but-identical file is not reprocessed
+MANIFEST_NAME = 'merge_manifest.json'
+MANIFEST_VERSION = 1
+
+# The same image exported into several source datasets is stored once (--dedup): the
+# first copy in job order is kept and the labels of every copy are merged into it.
+# Image hashes are cached in master_dataset by (path, size, mtime).
+DEDUP_IMAGES = False
+DEDUP_HASH_WORKERS = HASH_WORKERS
+
+# Source images are checked before anything is copied (--check-images): 'header' reads only
+# the header and end of every image (fast), 'decode' also decodes it (slow, needs Pillow).
+# Pairs with a bad image are left out. Results are cached in master_dataset.
+CHECK_IMAGES = 'off'
+CHECK_IMAGES_MODES = ['off', 'header', 'decode']
 
 
 master_class_map = {name.lower().strip(): i for i, name in enumerate(master_class_list)}
+# dataset folder -> (class names, old id -> master id table) from the class registry
+registry_tables = {}
 
 
 stats = defaultdict(lambda: defaultdict(int))
+# Unknown / invalid class ids, summarised once at the end instead of printed per line
+remap_report = RemapReport()
 
 def get_class_list_from_yaml(yaml_path):
     """Reads a YOLO data.yaml file and returns the list of class names."""
@@ -79,14 +130,119 @@ def get_class_list_from_yaml(yaml_path):
         print(f"⚠ Error reading {yaml_path}: {e}")
     return []
 
-def remap_and_copy_files(original_path, split, old_classes):
-    """Reads label files, remaps class indices, and copies images/labels into master dataset."""
+def use_class_registry(registry):
+    """Takes the master class list and the per-dataset class tables from a class registry."""
+    global master_class_list, master_class_map
+    master_class_list = list(registry['names'])
+    master_class_map = {key: i for i, key in enumerate(registry['keys'])}
+    registry_tables.clear()
+    for dataset_name, entry in registry['datasets'].items():
+        registry_tables[dataset_name] = (entry['names'], np.array(entry['table'], dtype=np.int32))
+
+def compile_dataset_table(old_classes, dataset_prefix=None):
+    """Compiles a dataset's data.yaml class list into an old id -> master id array (-1 = unknown)."""
+    registered = registry_tables.get(dataset_prefix)
+    if registered is not None and registered[0] == old_classes:
+        return registered[1]
+    return compile_class_table(old_classes, master_class_map, normalize_class_name)
+
+def union_label_lines(text, extra_text):
+    """Appends the lines of `extra_text` that `text` does not have yet."""
+    lines = text.split('\n') if text else []
+    seen = set(lines)
+    for line in extra_text.split('\n') if extra_text else []:
+        if line not in seen:
+            seen.add(line)
+            lines.append(line)
+    return '\n'.join(lines)
+
+def remap_label_batch(image_dir, label_dir, dest_img_dir, dest_lbl_dir, dataset_prefix, class_table, items,
+                      link_mode=LINK_MODE, copy_workers=1, merged=None):
+    """
+    Remaps and copies one batch of label files (and their images) into the master dataset.
+
+    `items` is a list of (label_file, image_name) pairs; image_name is None
+    when the split's image index has no image for that label. The class ids of
+    the whole batch are translated with one lookup into `class_table`, and the
+    files are written through a CopyExecutor with `copy_workers` threads.
+
+    Runs in a worker, so it never touches the global `stats`; it returns
+    (copied_count, warnings, written, dropped, copied_bytes) and the caller
+    aggregates them. `written` holds the (label_name, image_name) output names
+    of every item (None for a name that was not written) or None when a write
+    failed, so the file stays out of the manifest and the next incremental run
+    retries it; `dropped` holds the unknown/invalid class
+    id counts for the RemapReport.
+
+    `merged` maps a label file to the (key, label_path, class_table) of the
+    duplicates of its image (see plan_duplicates); their remapped lines are
+    added to its label.
+    """
+    copied_count = 0
+    warnings = []
+    written = []
+    failed = set()
+
+    label_texts = []
+    for label_file, _ in items:
+        with open(label_dir / label_file, 'r') as f:
+            label_texts.append(f.read())
+    new_texts, unknown, invalid = remap_label_texts(label_texts, class_table)
+    if merged:
+        for n, (label_file, _) in enumerate(items):
+            for _, label_path, table in merged.get(label_file, ()):
+                with open(label_path, 'r') as f:
+                    extra_texts, _, _ = remap_label_texts([f.read()], table)
+                new_texts[n] = union_label_lines(new_texts[n], extra_texts[0])
+
+    def mark_failed(i, error):
+        if error is not None:
+            failed.add(i)
+
+    copier = CopyExecutor(copy_workers, link_mode)
+    with copier:
+        for i, ((label_file, image_name), label_text, new_text) in enumerate(zip(items, label_texts, new_texts)):
+            on_done = lambda result, error, i=i: mark_failed(i, error)
+            out_label = out_image = None
+            if new_text:
+                # Unique filenames
+                new_label_file = f"{dataset_prefix}_{label_file}"
+                new_image_name = f"{dataset_prefix}_{Path(label_file).stem}"
+
+                copier.submit_label(dest_lbl_dir / new_label_file, new_text,
+                                    src=label_dir / label_file, src_text=label_text, on_done=on_done)
+                out_label = new_label_file
+
+                if image_name is not None:
+                    ext = Path(image_name).suffix
+                    out_image = f"{new_image_name}{ext}"
+                    copier.submit(image_dir / image_name, dest_img_dir / out_image, on_done=on_done)
+                    copied_count += 1
+                else:
+                    warnings.append(f"     ⚠ No image found for {label_file}")
+            written.append((out_label, out_image))
+
+    for i in sorted(failed):
+        if written[i][1] is not None:
+            copied_count -= 1
+        written[i] = None
+        warnings.append(f"     ⚠ Could not write the outputs of {items[i][0]}")
+
+    return copied_count, warnings, written, (unknown, invalid), copier.bytes
+
+def prepare_split(original_path, split):
+    """Checks a (dataset, split) work unit and creates its output folders.
+
+    Returns the arguments for `remap_label_batch` (minus the item list)
+    and the sorted (label_file, image_name) items, or None if the split
+    should be skipped. Images are looked up in one scandir pass.
+    """
     image_dir = original_path / split / 'images'
     label_dir = original_path / split / 'labels'
 
     if not label_dir.is_dir() or not image_dir.is_dir():
         print(f"   ⚠ Skipping '{split}' in {original_path.name} (missing dirs).")
-        return
+        return None
 
     dest_img_dir = output_path / split / 'images'
     dest_lbl_dir = output_path / split / 'labels'
@@ -94,48 +250,378 @@ def remap_and_copy_files(original_path, split, old_classes):
     dest_lbl_dir.mkdir(parents=True, exist_ok=True)
 
     dataset_prefix = original_path.name  # Use dataset folder name for uniqueness
+    label_files = list_label_files(label_dir)
+    image_index = ImageIndex(image_dir, IMAGE_EXTENSIONS)
+    report_orphans(image_index.match_labels(label_files), f"{dataset_prefix}/{split}")
+
+    items = [(label_file, image_index.find(Path(label_file).stem)) for label_file in label_files]
+    return (image_dir, label_dir, dest_img_dir, dest_lbl_dir, dataset_prefix), items
+
+def remap_and_copy_files(original_path, split, old_classes, link_mode=LINK_MODE):
+    """Reads label files, remaps class indices, and copies images/labels into master dataset."""
+    prepared = prepare_split(original_path, split)
+    if prepared is None:
+        return
+    dirs, items = prepared
+
+    copied_count, warnings, _, dropped, _ = remap_label_batch(*dirs, compile_dataset_table(old_classes, dirs[4]), items,
+                                                              link_mode=link_mode)
+    for warning in warnings:
+        print(warning)
+    stats[original_path.name][split] += copied_count
+    remap_report.add(original_path.name, old_classes, *dropped)
+
+def describe_source(path, with_hash=False, previous=None):
+    """Returns the manifest record (path, size, mtime and optional hash) of a source file."""
+    st = os.stat(path)
+    record = {'path': str(path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    if with_hash:
+        if (previous and 'sha1' in previous and previous['size'] == st.st_size
+                and previous['mtime_ns'] == st.st_mtime_ns):
+            record['sha1'] = previous['sha1']
+        else:
+            record['sha1'] = content_digest(path)
+    return record
 
-    for label_file in os.listdir(label_dir):
-        if not label_file.endswith('.txt'):
+def source_unchanged(old, new):
+    """True if a source file still matches its manifest record."""
+    if old is None or new is None:
+        return old is new
+    if old['path'] != new['path']:
+        return False
+    if old['size'] == new['size'] and old['mtime_ns'] == new['mtime_ns']:
+        return True
+    return 'sha1' in old and old.get('sha1') == new.get('sha1')
+
+def load_manifest():
+    """Loads master_dataset's merge manifest, or None if there is no usable one."""
+    manifest_path = output_path / MANIFEST_NAME
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+def save_manifest(manifest):
+    """Writes the manifest atomically so an interrupted run never leaves half a file."""
+    output_path.mkdir(parents=True, exist_ok=True)
+    manifest_path = output_path / MANIFEST_NAME
+    tmp_path = manifest_path.with_name(manifest_path.name + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+def remove_outputs(rel_paths):
+    """Deletes output files (paths relative to master_dataset) that are no longer produced."""
+    for rel_path in rel_paths:
+        try:
+            os.remove(output_path / rel_path)
+        except FileNotFoundError:
+            pass
+
+def select_changed(dataset_prefix, split, dirs, items, old_files, manifest, with_hash=False, merged=None,
+                   stale_datasets=()):
+    """
+    Splits a job's items into unchanged ones and ones that must be (re)processed.
+
+    Unchanged entries are carried over into the new `manifest` with their outputs.
+    An item with `merged` duplicates is only unchanged if the same duplicates
+    are merged into it, their labels are unchanged and their datasets are not
+    in `stale_datasets` (remap table changed).
+
+    Returns:
+        (list, dict, int): items to process, their fresh source records keyed
+        like the manifest, and the number of unchanged images.
+    """
+    image_dir, label_dir = dirs[0], dirs[1]
+    changed = []
+    records = {}
+    unchanged_images = 0
+
+    for label_file, image_name in items:
+        key = f"{dataset_prefix}/{split}/{label_file}"
+        old = old_files.get(key)
+        label_record = describe_source(label_dir / label_file, with_hash, old and old['label'])
+        image_record = None
+        if image_name is not None:
+            image_record = describe_source(image_dir / image_name, with_hash, old and old['image'])
+        old_merged = old.get('merged', {}) if old is not None else {}
+        merged_records = {}
+        for merged_key, label_path, _ in (merged or {}).get(label_file, ()):
+            merged_records[merged_key] = describe_source(label_path, with_hash, old_merged.get(merged_key))
+
+        if old is not None and source_unchanged(old['label'], label_record) \
+                and source_unchanged(old['image'], image_record) \
+                and old_merged.keys() == merged_records.keys() \
+                and all(source_unchanged(old_merged[k], merged_records[k]) and k.split('/')[0] not in stale_datasets
+                        for k in merged_records):
+            # Fresh records keep new mtimes (and hashes) for the next run
+            manifest['files'][key] = dict(old, label=label_record, image=image_record)
+            if merged_records:
+                manifest['files'][key]['merged'] = merged_records
+            unchanged_images += sum(1 for out in old['outputs'] if '/images/' in out)
             continue
 
-        new_labels = []
-        with open(label_dir / label_file, 'r') as f:
-            for line in f.readlines():
-                parts = line.strip().split()
-                if not parts:
-                    continue
-                old_cls_id = int(parts[0])
-
-                if old_cls_id < len(old_classes):
-                    class_name = old_classes[old_cls_id].strip().lower()
-                    if class_name in master_class_map:
-                        new_cls_id = master_class_map[class_name]
-                        new_line = f"{new_cls_id} {' '.join(parts[1:])}"
-                        new_labels.append(new_line)
-                    else:
-                        print(f"     ⚠ Unknown class '{old_classes[old_cls_id]}' in {label_file}")
-                else:
-                    print(f"     ⚠ Invalid class index {old_cls_id} in {label_file}")
-
-        if new_labels:
-            # Unique filenames
-            new_label_file = f"{dataset_prefix}_{label_file}"
-            new_image_name = f"{dataset_prefix}_{Path(label_file).stem}"
-
-            with open(dest_lbl_dir / new_label_file, 'w') as f:
-                f.write('\n'.join(new_labels))
-
-            copied = False
-            for ext in ['.jpg', '.jpeg', '.png', '.bmp', '.webp']:
-                image_path = image_dir / f"{Path(label_file).stem}{ext}"
-                if image_path.exists():
-                    shutil.copy(image_path, dest_img_dir / f"{new_image_name}{ext}")
-                    copied = True
-                    stats[dataset_prefix][split] += 1
-                    break
-            if not copied:
-                print(f"     ⚠ No image found for {label_file}")
+        changed.append((label_file, image_name))
+        records[key] = (label_record, image_record, merged_records)
+
+    return changed, records, unchanged_images
+
+def finish_job(dataset_prefix, split, old_classes, batches, results, records, manifest, old_files):
+    """
+    Aggregates a job's batch results into `stats`, `remap_report` and the manifest, in submission order.
+
+    Returns:
+        int: Bytes written by the job's batches.
+    """
+    copied_bytes = 0
+    for batch, (copied_count, warnings, written, dropped, batch_bytes) in zip(batches, results):
+        copied_bytes += batch_bytes
+        for warning in warnings:
+            print(warning)
+        stats[dataset_prefix][split] += copied_count
+        remap_report.add(dataset_prefix, old_classes, *dropped)
+
+        for (label_file, _), outputs_written in zip(batch, written):
+            if outputs_written is None:
+                continue
+            out_label, out_image = outputs_written
+            key = f"{dataset_prefix}/{split}/{label_file}"
+            outputs = []
+            if out_label is not None:
+                outputs.append(f"{split}/labels/{out_label}")
+            if out_image is not None:
+                outputs.append(f"{split}/images/{out_image}")
+
+            label_record, image_record, merged_records = records[key]
+            manifest['files'][key] = {'label': label_record, 'image': image_record, 'outputs': outputs}
+            if merged_records:
+                manifest['files'][key]['merged'] = merged_records
+
+            # e.g. the image changed extension or every annotation was dropped
+            old = old_files.get(key)
+            if old is not None:
+                remove_outputs(set(old['outputs']) - set(outputs))
+    return copied_bytes
+
+def drop_bad_images(prepared, decode=False):
+    """
+    Leaves the (label, image) pairs whose image fails imageheaders.check_images out of the prepared jobs.
+
+    Returns:
+        int: Pairs left out.
+    """
+    located = []
+    for j, (_, _, _, dirs, items) in enumerate(prepared):
+        for i, (_, image_name) in enumerate(items):
+            if image_name is not None:
+                located.append((j, i, dirs[0] / image_name))
+    infos = check_images([path for _, _, path in located], output_path, decode=decode)
+
+    bad = [{} for _ in prepared]
+    for (j, i, _), info in zip(located, infos):
+        if info.error is not None:
+            bad[j][i] = info.error
+    for j, (dataset_path, split, _, _, items) in enumerate(prepared):
+        if bad[j]:
+            i, error = next(iter(bad[j].items()))
+            print(f"   ⚠ {dataset_path.name}/{split}: left out {len(bad[j])} pairs with a bad image "
+                  f"(e.g. {items[i][1]}: {error}).")
+            items[:] = [item for i, item in enumerate(items) if i not in bad[j]]
+    return sum(len(job_bad) for job_bad in bad)
+
+def plan_duplicates(prepared, class_tables, hash_cache, workers=DEDUP_HASH_WORKERS):
+    """
+    Finds images with identical bytes across all prepared jobs.
+
+    The first copy in job order is kept. Every later copy is taken out of its
+    job and its label file is attached to the kept item, so their labels are
+    merged into one sample.
+
+    Args:
+        prepared (list): (dataset_path, split, old_classes, dirs, items) per job;
+            the item lists are filtered in place.
+        class_tables (dict): dataset prefix -> compiled class table.
+        hash_cache (HashCache): Content hashes of earlier runs.
+
+    Returns:
+        (list, dict, int): per job, {label_file: [(key, label_path, class_table), ...]}
+        of merged duplicates; duplicate key -> kept key; bytes of the images not stored.
+    """
+    located = []
+    for j, (dataset_path, split, _, dirs, items) in enumerate(prepared):
+        for i, (label_file, image_name) in enumerate(items):
+            if image_name is not None:
+                located.append((j, i, dirs[0] / image_name))
+    with stage("hash"):
+        digests = hash_cache.hash_files([path for _, _, path in located], workers)
+        hash_cache.save()
+
+    def key_of(j, i):
+        dataset_path, split, _, _, items = prepared[j]
+        return f"{dataset_path.name}/{split}/{items[i][0]}"
+
+    first = {}
+    merged = [defaultdict(list) for _ in prepared]
+    removed = [set() for _ in prepared]
+    duplicate_of = {}
+    saved_bytes = 0
+    for (j, i, path), digest in zip(located, digests):
+        if digest is None:
+            continue
+        kept = first.setdefault(digest, (j, i))
+        if kept == (j, i):
+            continue
+        dataset_path, split, _, dirs, items = prepared[j]
+        kept_j, kept_i = kept
+        merged[kept_j][prepared[kept_j][4][kept_i][0]].append(
+            (key_of(j, i), dirs[1] / items[i][0], class_tables[dataset_path.name]))
+        duplicate_of[key_of(j, i)] = key_of(kept_j, kept_i)
+        removed[j].add(i)
+        saved_bytes += os.path.getsize(path)
+
+    for j, job in enumerate(prepared):
+        if removed[j]:
+            job[4][:] = [item for i, item in enumerate(job[4]) if i not in removed[j]]
+    count('duplicate_images', len(duplicate_of))
+    return [dict(m) for m in merged], duplicate_of, saved_bytes
+
+def merge_datasets(jobs, workers=MERGE_WORKERS, executor=MERGE_EXECUTOR, batch_size=MERGE_BATCH_SIZE,
+                   link_mode=LINK_MODE, incremental=INCREMENTAL, with_hash=HASH_SOURCES,
+                   copy_workers=MERGE_COPY_WORKERS, dedup=DEDUP_IMAGES, hash_workers=DEDUP_HASH_WORKERS,
+                   check=CHECK_IMAGES):
+    """
+    Merges every (dataset_path, split, old_classes) job into the master dataset.
+
+    With workers > 1 each job's label files are cut into batches and fanned out
+    across a thread or process pool. Every batch writes distinct output files,
+    so the result is byte-identical to the serial run; `stats` is only updated
+    here, in the main process, from the counts the batches return.
+
+    With `incremental`, files whose source label and image still match the
+    manifest (and whose dataset uses the same remap table) are skipped, and
+    outputs of sources that disappeared are deleted.
+
+    A serial merge copies the files of each batch with `copy_workers`
+    threads; with a pool, every batch copies serially inside its worker.
+
+    With `dedup`, images with identical bytes are stored once and their
+    labels merged (see plan_duplicates); the outputs of the dropped copies
+    are removed like those of vanished sources. `check` ('header' or
+    'decode') leaves out pairs whose image is unreadable first, so a broken
+    file is never the copy that is kept.
+    """
+    old_manifest = load_manifest() if incremental else None
+    if old_manifest is not None and old_manifest['master_classes'] != master_class_list:
+        print("   ⚠ master_class_list changed since the last merge; remapping everything.")
+        old_manifest = None
+    old_files = old_manifest['files'] if old_manifest else {}
+    old_remap = old_manifest['remap'] if old_manifest else {}
+    manifest = {'version': MANIFEST_VERSION, 'master_classes': master_class_list, 'remap': {}, 'files': {}}
+
+    started = time.perf_counter()
+    copied_bytes = 0
+    pool = None
+    if workers > 1:
+        pool_class = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+        pool = pool_class(max_workers=workers)
+        print(f"   ⚙ Merging with {workers} {executor} workers (batches of {batch_size} labels)...")
+
+    try:
+        prepared = []
+        class_tables = {}
+        for dataset_path, split, old_classes in jobs:
+            dataset_prefix = dataset_path.name
+            with stage("prepare"):
+                split_files = prepare_split(dataset_path, split)
+            if split_files is None:
+                continue
+            prepared.append((dataset_path, split, old_classes) + split_files)
+            manifest['remap'][dataset_prefix] = old_classes
+            # Compiled once per dataset, shared by all of its batches
+            if dataset_prefix not in class_tables:
+                class_tables[dataset_prefix] = compile_dataset_table(old_classes, dataset_prefix)
+        stale_datasets = {prefix for prefix, old_classes in manifest['remap'].items()
+                          if old_remap.get(prefix) != old_classes}
+
+        if check != 'off':
+            with stage("check images"):
+                drop_bad_images(prepared, decode=check == 'decode')
+
+        merged = [None] * len(prepared)
+        duplicate_of = {}
+        if dedup:
+            merged, duplicate_of, saved_bytes = plan_duplicates(
+                prepared, class_tables, HashCache(output_path / HASH_CACHE_NAME), hash_workers)
+            manifest['duplicates'] = duplicate_of
+
+        pending = []
+        for (dataset_path, split, old_classes, dirs, items), job_merged in zip(prepared, merged):
+            dataset_prefix = dataset_path.name
+            if pool is None:
+                print(f"   → Remapping '{split}' of {dataset_prefix}...")
+            with stage("prepare"):
+                items, records, unchanged_images = select_changed(
+                    dataset_prefix, split, dirs, items, old_files if dataset_prefix not in stale_datasets else {},
+                    manifest, with_hash, job_merged, stale_datasets)
+            stats[dataset_prefix][split] += unchanged_images
+            if old_manifest is not None:
+                print(f"   ♻ {dataset_prefix}/{split}: {len(items)} new or changed label files, "
+                      f"{unchanged_images} images unchanged.")
+            class_table = class_tables[dataset_prefix]
+
+            batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+            batch_merged = [{label_file: job_merged[label_file] for label_file, _ in batch if label_file in job_merged}
+                            if job_merged else None for batch in batches]
+            if pool is None:
+                results = (remap_label_batch(*dirs, class_table, batch, link_mode=link_mode, copy_workers=copy_workers,
+                                             merged=batch_extra)
+                           for batch, batch_extra in zip(batches, batch_merged))
+                with stage("remap"):
+                    copied_bytes += finish_job(dataset_prefix, split, old_classes, batches, results, records,
+                                               manifest, old_files)
+            else:
+                futures = [pool.submit(remap_label_batch, *dirs, class_table, batch, link_mode=link_mode,
+                                       merged=batch_extra)
+                           for batch, batch_extra in zip(batches, batch_merged)]
+                pending.append((dataset_prefix, split, old_classes, batches, futures, records))
+
+        # Collect in submission order so warnings print in the same order as a serial run
+        for dataset_prefix, split, old_classes, batches, futures, records in pending:
+            results = (future.result() for future in futures)
+            with stage("remap"):
+                copied_bytes += finish_job(dataset_prefix, split, old_classes, batches, results, records,
+                                           manifest, old_files)
+            print(f"   → Remapped '{split}' of {dataset_prefix}: {stats[dataset_prefix][split]} images")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    if executor == 'process' and pool is not None:
+        # Copy counters of worker processes stay there; the bytes come back with the results
+        count('bytes_copied', copied_bytes)
+
+    # Sources that disappeared (files, splits or whole datasets) take their outputs with them
+    removed = 0
+    for key, entry in old_files.items():
+        if key not in manifest['files']:
+            remove_outputs(entry['outputs'])
+            removed += 1
+    if removed:
+        print(f"   🗑 Removed outputs of {removed} source label files that are no longer merged "
+              f"(gone, duplicates or bad images).")
+    if dedup:
+        print(f"   🧬 {len(duplicate_of)} duplicate images stored once, labels merged "
+              f"({saved_bytes / 1024 ** 2:.1f} MB not stored).")
+
+    with stage("manifest"):
+        save_manifest(manifest)
+
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    print(f"   📦 Wrote {copied_bytes / 1024 ** 2:.1f} MB in {elapsed:.2f}s "
+          f"({copied_bytes / 1024 ** 2 / elapsed:.1f} MB/s, {link_mode}).")
 
 def create_master_yaml():
     """Creates final master.yaml for YOLO training."""
@@ -150,10 +636,51 @@ def create_master_yaml():
     print(f"\n📄 Master YAML created at: {yaml_path}")
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Merge YOLO datasets into one master dataset.")
+    parser.add_argument('--workers', type=int, default=MERGE_WORKERS,
+                        help="Number of parallel workers (1 = serial).")
+    parser.add_argument('--executor', choices=['thread', 'process'], default=MERGE_EXECUTOR,
+                        help="Worker pool type used when --workers > 1.")
+    add_link_mode_argument(parser, default=LINK_MODE)
+    parser.add_argument('--full-rebuild', action='store_true',
+                        help="Ignore the merge manifest and remap every source file.")
+    parser.add_argument('--hash', action='store_true', default=HASH_SOURCES,
+                        help="Record SHA-1 hashes so touched but unchanged files are skipped.")
+    add_copy_workers_argument(parser, default=MERGE_COPY_WORKERS)
+    parser.add_argument('--dedup', action='store_true', default=DEDUP_IMAGES,
+                        help="Store images with identical bytes once and merge their labels.")
+    add_hash_workers_argument(parser, default=DEDUP_HASH_WORKERS)
+    parser.add_argument('--check-images', choices=CHECK_IMAGES_MODES, default=CHECK_IMAGES,
+                        help="Leave out pairs whose image has a bad header ('header') or does not decode ('decode').")
+    parser.add_argument('--no-registry', action='store_true',
+                        help="Ignore the class registry; use master_class_list and read every data.yaml.")
+    add_cache_dir_argument(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    start_metrics(args)
+    configure_label_cache(args)
+
     print("🚀 Starting dataset merge + remap...")
+    begin_stage("read yamls")
 
-    # Auto-detect dataset folders inside parent directory
-    dataset_paths = [p for p in datasets_parent.iterdir() if p.is_dir()]
+    jobs = []
+    if not args.no_registry and CLASS_REGISTRY.exists():
+        # Only data.yaml files changed since the registry was written are parsed again
+        registry = discover_classes(datasets_parent, str(CLASS_REGISTRY))
+        use_class_registry(registry)
+        print(f"📒 Using the class registry {CLASS_REGISTRY} ({len(master_class_list)} classes).")
+        for dataset_name, entry in registry['datasets'].items():
+            if not entry['names']:
+                print(f"❌ Could not read classes from {dataset_name}/{entry['yaml']}, skipping.")
+                continue
+            for split in ['train', 'valid', 'test']:
+                jobs.append((datasets_parent / dataset_name, split, entry['names']))
+        dataset_paths = []
+    else:
+        if not args.no_registry:
+            print(f"ℹ No class registry at {CLASS_REGISTRY}; run firstlythistoexttractclasses.py to create one.")
+        # Auto-detect dataset folders inside parent directory
+        dataset_paths = [p for p in datasets_parent.iterdir() if p.is_dir()]
 
     for dataset_path in dataset_paths:
         yaml_file = dataset_path / 'data.yaml'
@@ -171,14 +698,26 @@ if __name__ == '__main__':
         print(f"   Found {len(old_class_list)} classes (sample: {old_class_list[:5]})")
 
         for split in ['train', 'valid', 'test']:
-            print(f"   → Remapping '{split}'...")
-            remap_and_copy_files(dataset_path, split, old_class_list)
+            jobs.append((dataset_path, split, old_class_list))
+
+    print()
+    begin_stage("merge")
+    merge_datasets(jobs, workers=args.workers, executor=args.executor, link_mode=args.link_mode,
+                   incremental=INCREMENTAL and not args.full_rebuild, with_hash=args.hash,
+                   copy_workers=args.copy_workers, dedup=args.dedup, hash_workers=args.hash_workers,
+                   check=args.check_images)
 
+    begin_stage("yaml")
     create_master_yaml()
+    begin_stage("report")
 
     print("\n✅ All done! Master dataset ready in:", output_path)
 
+    remap_report.print_summary()
+
     print("\n📊 Summary Report:")
     for ds, splits in stats.items():
         split_counts = {s: c for s, c in splits.items()}
         print(f"  {ds}: {split_counts}")
+
+    finish_metrics(args)
@@ -1,8 +1,16 @@
 import os
-import shutil
 import yaml
+import argparse
+from materialize import add_link_mode_argument
+from copyengine import CopyExecutor, add_copy_workers_argument, COPY_WORKERS
+from imageindex import ImageIndex, list_label_files, report_orphans
+from classquery import open_index
+from datasetindex import DatasetIndex
+from labelcache import add_label_cache_arguments, configure_label_cache
+from instrument import add_metrics_arguments, begin_stage, count, start_metrics, finish_metrics
 
-def filter_dataset(original_data_yaml, selected_classes, new_dataset_dir):
+def filter_dataset(original_data_yaml, selected_classes, new_dataset_dir, link_mode='copy', only_images=None,
+                   copy_workers=COPY_WORKERS, skip_images=None):
     """
     Filters a YOLO dataset to include only selected classes.
 
@@ -10,6 +18,12 @@ def filter_dataset(original_data_yaml, selected_classes, new_dataset_dir):
         original_data_yaml (dict): The loaded content of the original data.yaml file.
         selected_classes (list): A list of class names to keep.
         new_dataset_dir (str): The path to save the new filtered dataset.
+        link_mode (str): How images are placed: 'copy', 'hardlink', 'reflink' or 'symlink'.
+        only_images (dict): Optional {'train'/'valid'/'test': stems} from a class query;
+            label files of other images are not even opened.
+        copy_workers (int): Parallel image copies.
+        skip_images (dict): Optional {'train'/'valid'/'test': stems} of images known
+            (from a DatasetIndex) to have none of the selected classes; not opened either.
     """
     # --- 1. Setup and Configuration ---
     print("Starting dataset filtering process...")
@@ -41,9 +55,10 @@ def filter_dataset(original_data_yaml, selected_classes, new_dataset_dir):
 
     # --- 2. Create New Directory Structure ---
     print(f"\nCreating new dataset directory at: {new_dataset_dir}")
-    for split in ['train', 'valid', 'test']:
-        os.makedirs(os.path.join(new_dataset_dir, split, 'images'), exist_ok=True)
-        os.makedirs(os.path.join(new_dataset_dir, split, 'labels'), exist_ok=True)
+    begin_stage("filter")
+    copier = CopyExecutor(copy_workers, link_mode, preserve_metadata=True)
+    copier.make_dirs(os.path.join(new_dataset_dir, split, sub)
+                     for split in ['train', 'valid', 'test'] for sub in ['images', 'labels'])
 
     # --- 3. Process Each Data Split (train, valid, test) ---
     for split in ['train', 'val', 'test']:
@@ -71,9 +86,19 @@ def filter_dataset(original_data_yaml, selected_classes, new_dataset_dir):
             continue
 
         image_copy_count = 0
-        for label_filename in os.listdir(original_label_dir):
-            if not label_filename.endswith('.txt'):
-                continue
+        label_files = list_label_files(original_label_dir)
+        if only_images is not None:
+            wanted = set(only_images.get(output_split_name, ()))
+            label_files = [name for name in label_files if os.path.splitext(name)[0] in wanted]
+            print(f"Query selected {len(label_files)} label files.")
+        if skip_images is not None:
+            skipped = skip_images.get(output_split_name, set())
+            label_files = [name for name in label_files if os.path.splitext(name)[0] not in skipped]
+        # One scandir pass instead of probing every extension per label
+        image_index = ImageIndex(original_image_dir, ['.jpg', '.jpeg', '.png'])
+        report_orphans(image_index.match_labels(label_files), yaml_split_key)
+
+        for label_filename in label_files:
 
             original_label_path = os.path.join(original_label_dir, label_filename)
             
@@ -104,26 +129,24 @@ def filter_dataset(original_data_yaml, selected_classes, new_dataset_dir):
                     f.write('\n'.join(new_annotations))
 
                 # Copy the corresponding image
-                image_name = os.path.splitext(label_filename)[0]
-                
-                # Find the correct image extension (e.g., .jpg, .png)
-                found_image = False
-                for ext in ['.jpg', '.jpeg', '.png']:
-                    original_image_path = os.path.join(original_image_dir, image_name + ext)
-                    if os.path.exists(original_image_path):
-                        new_image_path = os.path.join(new_image_dir, image_name + ext)
-                        shutil.copy2(original_image_path, new_image_path)
-                        image_copy_count += 1
-                        found_image = True
-                        break
-                
-                if not found_image:
+                image_name = image_index.find(os.path.splitext(label_filename)[0])
+                if image_name is not None:
+                    original_image_path = os.path.join(original_image_dir, image_name)
+                    new_image_path = os.path.join(new_image_dir, image_name)
+                    copier.submit(original_image_path, new_image_path)
+                    image_copy_count += 1
+                else:
                     print(f"Warning: Image for label '{label_filename}' not found.")
 
+        count('labels_parsed', len(label_files))
         print(f"Finished processing '{split}'. Copied {image_copy_count} images and their labels.")
 
+    copier.close()
+    copier.report("images")
+
 
     # --- 4. Generate New data.yaml File ---
+    begin_stage("yaml")
     new_yaml_path = os.path.join(new_dataset_dir, 'data.yaml')
     
     # Correcting the paths for the new YAML file to be relative
@@ -143,6 +166,19 @@ def filter_dataset(original_data_yaml, selected_classes, new_dataset_dir):
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Copy only the selected classes of a YOLO dataset into a new dataset.")
+    add_link_mode_argument(parser)
+    add_copy_workers_argument(parser)
+    parser.add_argument('--query', help="Class expression answered from the dataset's bitmap index, "
+                                        "e.g. \"(fire | smoke) & ~person\"; only matching images are filtered.")
+    parser.add_argument('--query-split', action='append', choices=['train', 'valid', 'test'],
+                        help="Restrict --query to these splits (repeatable).")
+    add_label_cache_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    start_metrics(args)
+    configure_label_cache(args)
+
     # --- Configuration ---
     
     # 1. Define the classes you want to keep in your new dataset
@@ -206,5 +242,25 @@ if __name__ == '__main__':
     NEW_DATASET_DIRECTORY = 'filtered_farm_safety_dataset'
     
     # --- Run the script ---
-    filter_dataset(ORIGINAL_DATA_YAML_CONTENT, SELECTED_CLASSES, NEW_DATASET_DIRECTORY)
+    # The dataset folder holds the train/valid/test splits
+    dataset_root = os.path.dirname(os.path.dirname(ORIGINAL_DATA_YAML_CONTENT['train']))
+    begin_stage("index")
+    # Images without any selected class (from the label cache) are skipped without reading their labels
+    index = DatasetIndex.from_yolo(dataset_root)
+    selected_ids = [i for i, name in enumerate(ORIGINAL_DATA_YAML_CONTENT['names']) if name in SELECTED_CLASSES]
+    skip_images = index.stems_without_classes(selected_ids)
+
+    only_images = None
+    if args.query:
+        begin_stage("query")
+        bitmap_index = open_index(dataset_root, ORIGINAL_DATA_YAML_CONTENT['names'], verbose=True)
+        try:
+            only_images = bitmap_index.query(args.query, args.query_split)
+        except ValueError as e:
+            print(f"❌ Invalid query: {e}")
+            raise SystemExit(1)
+        print(f"Query '{args.query}' matched {sum(len(stems) for stems in only_images.values())} images.")
+    filter_dataset(ORIGINAL_DATA_YAML_CONTENT, SELECTED_CLASSES, NEW_DATASET_DIRECTORY, args.link_mode, only_images,
+                   args.copy_workers, skip_images)
+    finish_metrics(args)
 
@@ -0,0 +1,300 @@
+import os
+import json
+import shutil
+import struct
+import zlib
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import yaml
+from secondlythis import master_class_list
+
+# Bump when the generated layout changes, so cached benchmark datasets are rebuilt.
+SYNTH_VERSION = 1
+SPEC_NAME = 'synth.json'
+SPLITS = ['train', 'valid', 'test']
+
+# Shape of the real 'abcdesease' collection: several Roboflow exports, each
+# with its own data.yaml, class subset and class order.
+SOURCES = 6
+CLASSES = len(master_class_list)
+IMAGES = 10000
+BOXES = (1, 6)                     # boxes per labelled image, inclusive
+SPLIT_RATIOS = [0.84, 0.11, 0.05]  # train/valid/test of the merged master
+CLASS_SKEW = 1.0                   # Zipf exponent of the class frequencies
+PRIMARY_SHARE = 0.8                # boxes of an image that share its main class
+BACKGROUND_RATE = 0.02             # images with an empty label file
+NO_LABEL_RATE = 0.005              # images without a label file
+NO_IMAGE_RATE = 0.005              # label files without an image
+VARIANT_RATE = 0.15                # class names spelled differently ('cow', ' COW')
+
+# Image dimensions (weights) and file types. The files have valid JPEG/PNG
+# headers with these dimensions followed by noise, sized to width * height *
+# bytes_per_pixel. Real JPEG exports are around 0.1-0.2 bytes per pixel; the
+# default keeps 1M images at a few GB.
+IMAGE_SIZES = [((640, 640), 0.55), ((416, 416), 0.10), ((1280, 720), 0.15), ((1920, 1080), 0.10), ((800, 600), 0.10)]
+IMAGE_FORMATS = [('.jpg', 0.85), ('.png', 0.10), ('.jpeg', 0.05)]
+BYTES_PER_PIXEL = 0.01
+
+WRITE_WORKERS = 8
+WRITE_CHUNK = 512   # files per pool task
+WRITE_AHEAD = 32    # pool tasks in flight
+
+
+def class_names(n):
+    """The real class names first, then 'class_47', 'class_48', ... for bigger tests."""
+    return list(master_class_list[:n]) + [f"class_{i}" for i in range(len(master_class_list), n)]
+
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def encode_image(ext, width, height, size, noise):
+    """
+    A JPEG or PNG file of about `size` bytes whose header declares width x height.
+
+    `noise` (bytes or a memoryview) fills the image data; it must not contain
+    0xFF bytes, which would end a JPEG scan.
+    """
+    if ext == '.png':
+        header = b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+        body = noise[:max(0, size - len(header) - 24)]
+        return header + _png_chunk(b'IDAT', body) + _png_chunk(b'IEND', b'')
+
+    # SOI, JFIF APP0, baseline SOF0 (3 components), a minimal SOS, scan data, EOI
+    header = (b'\xff\xd8'
+              + b'\xff\xe0' + struct.pack('>H5sBBBHHBB', 16, b'JFIF\x00', 1, 1, 0, 1, 1, 0, 0)
+              + b'\xff\xc0' + struct.pack('>HBHHB', 17, 8, height, width, 3)
+              + b'\x01\x22\x00\x02\x11\x01\x03\x11\x01'
+              + b'\xff\xda' + struct.pack('>HB', 12, 3) + b'\x01\x00\x02\x11\x03\x11\x00\x3f\x00')
+    return header + noise[:max(0, size - len(header) - 2)] + b'\xff\xd9'
+
+
+def plan_sources(names, sources, rng, variant_rate=VARIANT_RATE):
+    """
+    Class lists of the source datasets.
+
+    Every class is in at least one source; each source also gets a random
+    share of the others, in its own order and with some names spelled the
+    way a different annotator would.
+
+    Returns:
+        list: (class ids, class names as written in the data.yaml) per source.
+    """
+    n = len(names)
+    members = [set() for _ in range(sources)]
+    for class_id in range(n):
+        members[rng.integers(sources)].add(class_id)
+    for source in members:
+        extra = rng.choice(n, size=rng.integers(0, n // 2 + 1), replace=False)
+        source.update(int(class_id) for class_id in extra)
+        if not source:
+            source.add(int(rng.integers(n)))
+
+    planned = []
+    for source in members:
+        ids = np.array(sorted(source))
+        rng.shuffle(ids)
+        written = []
+        for class_id in ids:
+            name = names[class_id]
+            if rng.random() < variant_rate:
+                name = rng.choice([name.lower(), name.upper(), f" {name}", f"{name} "])
+            written.append(str(name))
+        planned.append((ids, written))
+    return planned
+
+
+def _label_text(class_ids, boxes):
+    return ''.join(f"{c} {x:.6f} {y:.6f} {w:.6f} {h:.6f}\n" for c, (x, y, w, h) in zip(class_ids, boxes))
+
+
+def _write_files(files):
+    for path, data in files:
+        mode = 'wb' if isinstance(data, bytes) else 'w'
+        with open(path, mode) as f:
+            f.write(data)
+
+
+def write_split(source_dir, split, n, class_weights, rng, noise, prefix, settings, pool):
+    """
+    Plans and writes `n` samples of one split of a source dataset.
+
+    All random choices are made here, in order, so the output only depends
+    on the seed; the pool only writes the files.
+
+    Returns:
+        dict: Counts of images, label files and boxes written.
+    """
+    image_dir = os.path.join(source_dir, split, 'images')
+    label_dir = os.path.join(source_dir, split, 'labels')
+    os.makedirs(image_dir, exist_ok=True)
+    os.makedirs(label_dir, exist_ok=True)
+
+    k = len(class_weights)
+    lo, hi = settings['boxes']
+    n_boxes = rng.integers(lo, hi + 1, size=n)
+    n_boxes[rng.random(n) < settings['background_rate']] = 0
+    has_label = rng.random(n) >= settings['no_label_rate']
+    has_image = (rng.random(n) >= settings['no_image_rate']) | ~has_label
+
+    # Most boxes of an image are of its main class, like real single-subject photos
+    primary = rng.choice(k, size=n, p=class_weights)
+    box_class = np.repeat(primary, n_boxes)
+    other = rng.random(box_class.size) >= settings['primary_share']
+    box_class[other] = rng.choice(k, size=int(other.sum()), p=class_weights)
+    wh = rng.uniform(0.02, 0.6, size=(box_class.size, 2))
+    xy = wh / 2 + rng.random((box_class.size, 2)) * (1 - wh)
+    box_geometry = np.concatenate([xy, wh], axis=1)
+    box_starts = np.concatenate([[0], np.cumsum(n_boxes)])
+
+    sizes, size_weights = zip(*IMAGE_SIZES)
+    formats, format_weights = zip(*IMAGE_FORMATS)
+    size_pick = rng.choice(len(sizes), size=n, p=np.array(size_weights) / sum(size_weights))
+    format_pick = rng.choice(len(formats), size=n, p=np.array(format_weights) / sum(format_weights))
+    # Lognormal spread around the nominal size, like real compression ratios
+    spread = rng.lognormal(0.0, 0.35, size=n)
+    noise_offset = rng.integers(0, len(noise) // 2, size=n)
+    hashes = rng.bytes(16 * n)
+
+    files = []
+    futures = deque()
+    counts = {'images': 0, 'labels': 0, 'boxes': 0}
+    for i in range(n):
+        width, height = sizes[size_pick[i]]
+        ext = formats[format_pick[i]]
+        stem = f"{prefix}_{i:07d}_{ext[1:]}.rf.{hashes[16 * i:16 * i + 16].hex()}"
+        if has_image[i]:
+            size = int(width * height * settings['bytes_per_pixel'] * spread[i])
+            data = encode_image(ext, width, height, size, noise[noise_offset[i]:])
+            files.append((os.path.join(image_dir, stem + ext), data))
+            counts['images'] += 1
+        if has_label[i]:
+            start, end = box_starts[i], box_starts[i + 1]
+            files.append((os.path.join(label_dir, stem + '.txt'),
+                          _label_text(box_class[start:end].tolist(), box_geometry[start:end].tolist())))
+            counts['labels'] += 1
+            counts['boxes'] += int(end - start)
+        if len(files) >= WRITE_CHUNK:
+            futures.append(pool.submit(_write_files, files))
+            files = []
+            # Keep only a few chunks in flight so a slow disk does not pile up memory
+            while len(futures) > WRITE_AHEAD:
+                futures.popleft().result()
+    if files:
+        futures.append(pool.submit(_write_files, files))
+    for future in futures:
+        future.result()
+    return counts
+
+
+def load_spec(output):
+    """The settings and counts of a generated dataset, or None if it is missing or incomplete."""
+    try:
+        with open(os.path.join(output, SPEC_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def generate_dataset(output, images=IMAGES, classes=CLASSES, sources=SOURCES, boxes=BOXES,
+                     bytes_per_pixel=BYTES_PER_PIXEL, class_skew=CLASS_SKEW, seed=0,
+                     workers=WRITE_WORKERS, verbose=True):
+    """
+    Writes a synthetic collection of YOLO datasets into `output`.
+
+    `output` plays the role of the 'abcdesease' folder: one sub-folder per
+    source dataset, each with a data.yaml and train/valid/test splits.
+    SPEC_NAME is written last and records the settings, the master class
+    list and the counts; a previous synthetic dataset in `output` is replaced,
+    any other non-empty folder is refused.
+
+    Returns:
+        dict: The spec written to SPEC_NAME.
+    """
+    if os.path.isdir(output) and os.listdir(output):
+        if not os.path.exists(os.path.join(output, SPEC_NAME)):
+            raise FileExistsError(f"'{output}' is not empty and is not a synthetic dataset; refusing to overwrite it.")
+        shutil.rmtree(output)
+    os.makedirs(output, exist_ok=True)
+
+    settings = {
+        'version': SYNTH_VERSION, 'seed': seed, 'images': images, 'classes': classes, 'sources': sources,
+        'boxes': list(boxes), 'bytes_per_pixel': bytes_per_pixel, 'class_skew': class_skew,
+        'split_ratios': SPLIT_RATIOS, 'primary_share': PRIMARY_SHARE, 'background_rate': BACKGROUND_RATE,
+        'no_label_rate': NO_LABEL_RATE, 'no_image_rate': NO_IMAGE_RATE,
+    }
+    rng = np.random.default_rng(seed)
+    names = class_names(classes)
+    frequency = 1.0 / np.arange(1, classes + 1) ** class_skew
+    frequency = frequency[rng.permutation(classes)]
+
+    largest = max(w * h for (w, h), _ in IMAGE_SIZES)
+    # Shared pool of image data, sliced without copying; no 0xFF, see encode_image()
+    noise = memoryview(rng.bytes(int(largest * bytes_per_pixel * 4) + 1024).replace(b'\xff', b'\xfe'))
+
+    # Uneven source sizes, like a few big exports and several small ones
+    source_share = rng.dirichlet(np.full(sources, 1.5))
+    source_images = rng.multinomial(images, source_share)
+
+    totals = {'images': 0, 'labels': 0, 'boxes': 0}
+    spec_sources = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for s, (ids, written) in enumerate(plan_sources(names, sources, rng)):
+            folder = f"source{s:02d}.v{s + 1}i.yolov8"
+            source_dir = os.path.join(output, folder)
+            os.makedirs(source_dir, exist_ok=True)
+            with open(os.path.join(source_dir, 'data.yaml'), 'w') as f:
+                yaml.safe_dump({'train': '../train/images', 'val': '../valid/images', 'test': '../test/images',
+                                'nc': len(written), 'names': written}, f, sort_keys=False)
+
+            weights = frequency[ids] / frequency[ids].sum()
+            split_counts = {}
+            for split, n in zip(SPLITS, rng.multinomial(source_images[s], SPLIT_RATIOS)):
+                counts = write_split(source_dir, split, int(n), weights, rng, noise, f"s{s:02d}{split[0]}",
+                                     settings, pool)
+                split_counts[split] = counts
+                for key in totals:
+                    totals[key] += counts[key]
+            spec_sources.append({'folder': folder, 'names': written, 'class_ids': ids.tolist(),
+                                 'splits': split_counts})
+            if verbose:
+                written_images = sum(c['images'] for c in split_counts.values())
+                print(f"   - {folder}: {len(written)} classes, {written_images} images")
+
+    spec = {'settings': settings, 'names': names, 'sources': spec_sources, **totals}
+    with open(os.path.join(output, SPEC_NAME), 'w', encoding='utf-8') as f:
+        json.dump(spec, f, indent=2)
+    if verbose:
+        print(f"✅ {totals['images']} images, {totals['labels']} label files and {totals['boxes']} boxes "
+              f"in {sources} datasets written to '{output}'.")
+    return spec
+
+
+def parse_range(text):
+    """'1-6' -> (1, 6); '3' -> (3, 3)."""
+    lo, _, hi = text.partition('-')
+    return int(lo), int(hi or lo)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a synthetic collection of YOLO datasets shaped like 'abcdesease'.")
+    parser.add_argument('output', help="Folder for the source datasets (replaced if it holds a previous synthetic dataset).")
+    parser.add_argument('--images', type=int, default=IMAGES, help="Total number of samples over all datasets.")
+    parser.add_argument('--classes', type=int, default=CLASSES, help="Number of classes in the master list.")
+    parser.add_argument('--sources', type=int, default=SOURCES, help="Number of source datasets (data.yaml files).")
+    parser.add_argument('--boxes', type=parse_range, default=BOXES, help="Boxes per labelled image, e.g. '1-6'.")
+    parser.add_argument('--bytes-per-pixel', type=float, default=BYTES_PER_PIXEL,
+                        help="Image file size relative to its dimensions (real JPEGs: 0.1-0.2).")
+    parser.add_argument('--class-skew', type=float, default=CLASS_SKEW,
+                        help="Zipf exponent of the class frequencies (0 = balanced).")
+    parser.add_argument('--seed', type=int, default=0, help="Same seed and settings, same files.")
+    parser.add_argument('--workers', type=int, default=WRITE_WORKERS, help="Parallel file writers.")
+    args = parser.parse_args()
+
+    print(f"🚀 Generating {args.images} samples in {args.sources} datasets...")
+    generate_dataset(args.output, images=args.images, classes=args.classes, sources=args.sources, boxes=args.boxes,
+                     bytes_per_pixel=args.bytes_per_pixel, class_skew=args.class_skew, seed=args.seed,
+                     workers=args.workers)
@@ -0,0 +1,293 @@
+import os
+import io
+import json
+import zlib
+import tarfile
+import argparse
+import numpy as np
+import yaml
+from copyengine import CopyExecutor, add_copy_workers_argument, COPY_WORKERS
+from imageindex import ImageIndex, IMAGE_EXTENSIONS, report_orphans
+from journal import BuildJournal, add_resume_argument
+from labelcache import load_label_table, add_label_cache_arguments, configure_label_cache
+from instrument import add_metrics_arguments, stage, start_metrics, finish_metrics
+
+# Bump when the layout of the shards or of the index changes.
+SHARD_VERSION = 1
+INDEX_NAME = 'index.json'
+# Settings of a build in progress; a --resume with other settings starts over.
+PLAN_NAME = '.plan.json'
+SPLITS = ['train', 'valid', 'test']
+
+# A shard is closed once the next sample would grow it past this size.
+SHARD_BYTES = 256 * 1024 ** 2
+SEED = 0
+
+# Tar layout: a 512-byte header per member, data padded to 512 bytes,
+# and the archive end padded to 20 blocks.
+TAR_BLOCK = 512
+TAR_RECORD = 20 * TAR_BLOCK
+
+
+def _member_bytes(size):
+    return TAR_BLOCK + -(-size // TAR_BLOCK) * TAR_BLOCK
+
+
+def _sample_keys(stems):
+    """
+    WebDataset keys for the stems of a split.
+
+    A key ends at the first dot of a member name, so dots (common in
+    Roboflow exports) become underscores; the rare collisions get a suffix.
+    """
+    keys = []
+    used = set()
+    for stem in stems:
+        key = base = stem.replace('.', '_')
+        n = 1
+        while key in used:
+            key = f"{base}_{n}"
+            n += 1
+        used.add(key)
+        keys.append(key)
+    return keys
+
+
+def plan_split(dataset_path, split, shard_bytes=SHARD_BYTES, seed=SEED, extensions=IMAGE_EXTENSIONS, verbose=True):
+    """
+    Shuffles one split and cuts it into size-bounded shards.
+
+    The order only depends on `seed` and the split name, so the same
+    dataset always gives the same shards.
+
+    Returns:
+        dict with the image paths, label paths, sample keys, shard number of
+        every sample (in shard order) and the label table, or None if the
+        split has no images.
+    """
+    image_dir = os.path.join(dataset_path, split, 'images')
+    label_dir = os.path.join(dataset_path, split, 'labels')
+    if not os.path.isdir(image_dir):
+        if verbose:
+            print(f"   - Warning: No '{split}/images' directory found. Skipping.")
+        return None
+
+    image_index = ImageIndex(image_dir, extensions, with_sizes=True)
+    labels = load_label_table(label_dir, verbose=verbose)
+    label_stems = labels.stems.tolist()
+    if verbose:
+        report_orphans(image_index.match_labels([stem + '.txt' for stem in label_stems]), split)
+    row_of_stem = {stem: i for i, stem in enumerate(label_stems)}
+
+    # Samples are images; an image without a label is kept as a background sample
+    stems = sorted(image_index.stem_to_name)
+    order = np.random.default_rng([seed, zlib.crc32(split.encode('utf-8'))]).permutation(len(stems))
+    stems = [stems[i] for i in order.tolist()]
+    label_rows = np.array([row_of_stem.get(stem, -1) for stem in stems], dtype=np.int64)
+    label_sizes = np.where(label_rows >= 0, labels.sizes[label_rows] if len(labels) else 0, 0)
+    sample_bytes = np.array([_member_bytes(image_index.size(stem)) for stem in stems], dtype=np.int64)
+    sample_bytes += np.array([_member_bytes(size) for size in label_sizes.tolist()], dtype=np.int64)
+
+    shard_of_sample = np.zeros(len(stems), dtype=np.int64)
+    shard, used = 0, 0
+    for i, size in enumerate(sample_bytes.tolist()):
+        if used and used + size + TAR_RECORD > shard_bytes:
+            shard, used = shard + 1, 0
+        shard_of_sample[i] = shard
+        used += size
+
+    return {
+        'image_paths': [image_index.path(stem) for stem in stems],
+        'label_paths': [os.path.join(label_dir, stem + '.txt') if row >= 0 else None
+                        for stem, row in zip(stems, label_rows.tolist())],
+        'keys': _sample_keys(stems),
+        'label_rows': label_rows,
+        'shard_of_sample': shard_of_sample,
+        'num_shards': int(shard_of_sample[-1]) + 1 if len(stems) else 0,
+        'label_table': labels,
+    }
+
+
+def _add_member(tar, name, fileobj, size, mtime):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = mtime
+    info.mode = 0o644
+    # No owner names or ids, so a shard only depends on the files it holds
+    info.uid = info.gid = 0
+    info.uname = info.gname = ''
+    tar.addfile(info, fileobj)
+
+
+def write_shard(path, samples):
+    """
+    Writes one tar shard of (key, image path, label path) samples.
+
+    Members are `<key>.<image ext>` and `<key>.txt`, next to each other in
+    sample order as WebDataset expects; background images get an empty label.
+
+    Returns:
+        int: Size of the shard in bytes.
+    """
+    with open(path, 'wb') as f, tarfile.open(fileobj=f, mode='w', format=tarfile.PAX_FORMAT) as tar:
+        for key, image_path, label_path in samples:
+            st = os.stat(image_path)
+            with open(image_path, 'rb') as fsrc:
+                _add_member(tar, key + os.path.splitext(image_path)[1].lower(), fsrc, st.st_size, int(st.st_mtime))
+            label = b''
+            label_mtime = int(st.st_mtime)
+            if label_path is not None:
+                with open(label_path, 'rb') as fsrc:
+                    label = fsrc.read()
+                label_mtime = int(os.stat(label_path).st_mtime)
+            _add_member(tar, key + '.txt', io.BytesIO(label), len(label), label_mtime)
+    return os.path.getsize(path)
+
+
+def _shard_class_counts(plan, num_shards, num_classes):
+    """Instances and images per class for every shard of a split plan."""
+    labels = plan['label_table']
+    instances = np.zeros((num_shards, num_classes), dtype=np.int64)
+    images = np.zeros((num_shards, num_classes), dtype=np.int64)
+    if not len(labels) or not num_classes:
+        return instances, images
+    sample_of_row = np.full(len(labels), -1, dtype=np.int64)
+    has_label = plan['label_rows'] >= 0
+    sample_of_row[plan['label_rows'][has_label]] = np.nonzero(has_label)[0]
+
+    row_sample = sample_of_row[labels.image_id]
+    valid = (row_sample >= 0) & (labels.class_id >= 0) & (labels.class_id < num_classes)
+    key = plan['shard_of_sample'][row_sample[valid]] * num_classes + labels.class_id[valid]
+    instances += np.bincount(key, minlength=num_shards * num_classes).reshape(num_shards, num_classes)
+
+    pair_rows, pair_classes = labels.unique_image_classes()
+    pair_sample = sample_of_row[pair_rows]
+    valid = (pair_sample >= 0) & (pair_classes >= 0) & (pair_classes < num_classes)
+    key = plan['shard_of_sample'][pair_sample[valid]] * num_classes + pair_classes[valid]
+    images += np.bincount(key, minlength=num_shards * num_classes).reshape(num_shards, num_classes)
+    return instances, images
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _read_class_names(yaml_path):
+    with open(yaml_path, 'r') as f:
+        names = (yaml.safe_load(f) or {}).get('names') or []
+    if isinstance(names, dict):
+        names = [names[k] for k in sorted(names)]
+    return [str(name) for name in names]
+
+
+def export_tar_shards(dataset_path, output_dir, yaml_name='master.yaml', splits=SPLITS, shard_bytes=SHARD_BYTES,
+                      seed=SEED, workers=COPY_WORKERS, resume=False):
+    """
+    Writes every split as shuffled, size-bounded tar shards plus an index JSON.
+
+    Shards are written in parallel (one task per shard) into a staging
+    folder; with `resume`, shards finished by an interrupted run are kept.
+
+    Returns:
+        dict: The index that was written, or None if a shard failed.
+    """
+    yaml_path = os.path.join(dataset_path, yaml_name)
+    names = _read_class_names(yaml_path) if os.path.isfile(yaml_path) else []
+    if not names:
+        print(f"   - Warning: No class names in '{yaml_path}'; class counts use class ids.")
+
+    journal = BuildJournal(output_dir, resume=resume)
+    settings = {'version': SHARD_VERSION, 'seed': seed, 'shard_bytes': shard_bytes, 'splits': list(splits)}
+    if journal.resumed and _read_json(journal.path(PLAN_NAME)) != settings:
+        print("   ℹ The interrupted export used other settings; starting over.")
+        journal.close()
+        journal = BuildJournal(output_dir)
+    with open(journal.path(PLAN_NAME), 'w', encoding='utf-8') as f:
+        json.dump(settings, f)
+    index = {'version': SHARD_VERSION, 'seed': seed, 'shard_bytes': shard_bytes, 'names': names, 'splits': {}}
+    copier = CopyExecutor(workers)
+    with copier:
+        for split in splits:
+            with stage(f"plan {split}"):
+                plan = plan_split(dataset_path, split, shard_bytes, seed)
+            if plan is None:
+                continue
+            num_shards = plan['num_shards']
+            labels = plan['label_table']
+            valid = labels.class_id[labels.class_id >= 0]
+            num_classes = max(len(names), int(valid.max()) + 1 if len(valid) else 0)
+            instances, images = _shard_class_counts(plan, num_shards, num_classes)
+            class_names = names + [str(c) for c in range(len(names), num_classes)]
+
+            bounds = np.searchsorted(plan['shard_of_sample'], np.arange(num_shards + 1))
+            shards = []
+            for shard in range(num_shards):
+                start, end = int(bounds[shard]), int(bounds[shard + 1])
+                rel_path = f"{split}-{shard:06d}.tar"
+                shards.append({
+                    'url': rel_path,
+                    'samples': end - start,
+                    'instances': {class_names[c]: int(instances[shard, c]) for c in np.nonzero(instances[shard])[0]},
+                    'images': {class_names[c]: int(images[shard, c]) for c in np.nonzero(images[shard])[0]},
+                })
+                journal.want(rel_path)
+                if journal.is_done(rel_path):
+                    journal.skipped += 1
+                    continue
+                samples = list(zip(plan['keys'][start:end], plan['image_paths'][start:end],
+                                   plan['label_paths'][start:end]))
+                copier.submit_task(write_shard, journal.path(rel_path), samples,
+                                   on_done=lambda result, error, rel_path=rel_path:
+                                   error is None and journal.record(rel_path))
+
+            index['splits'][split] = {
+                'samples': len(plan['keys']),
+                'shards': shards,
+                # Brace pattern for webdataset.WebDataset / wds.ShardList
+                'urls': f"{split}-{{000000..{num_shards - 1:06d}}}.tar" if num_shards else None,
+            }
+            print(f"   - {split}: {len(plan['keys'])} samples in {num_shards} shards.")
+    copier.report("shards")
+
+    if copier.failed:
+        journal.close()
+        print(f"❌ {copier.failed} shards could not be written; re-run with --resume.")
+        return None
+    for split_index in index['splits'].values():
+        for shard in split_index['shards']:
+            shard['bytes'] = os.path.getsize(journal.path(shard['url']))
+    with open(journal.path(INDEX_NAME), 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=1)
+    journal.want(INDEX_NAME)
+    os.remove(journal.path(PLAN_NAME))
+    journal.commit()
+    return index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export a YOLO dataset as shuffled WebDataset-style tar shards.")
+    parser.add_argument('dataset', help="Dataset folder with train/valid/test splits (e.g. the merged master).")
+    parser.add_argument('output', help="Folder for the shards and index.json.")
+    parser.add_argument('--yaml', default='master.yaml', help="YAML file in the dataset folder with the class names.")
+    parser.add_argument('--split', action='append', choices=SPLITS, help="Only these splits (repeatable).")
+    parser.add_argument('--shard-mb', type=int, default=SHARD_BYTES // 1024 ** 2, help="Maximum shard size.")
+    parser.add_argument('--seed', type=int, default=SEED, help="Seed of the shuffle (same seed, same shards).")
+    add_copy_workers_argument(parser)
+    add_resume_argument(parser)
+    add_label_cache_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    start_metrics(args)
+    configure_label_cache(args)
+
+    print(f"🚀 Writing tar shards of '{args.dataset}' to '{args.output}'...")
+    result = export_tar_shards(args.dataset, args.output, yaml_name=args.yaml, splits=args.split or SPLITS,
+                               shard_bytes=args.shard_mb * 1024 ** 2, seed=args.seed, workers=args.copy_workers,
+                               resume=args.resume)
+    if result is not None:
+        print(f"✅ Shards and {INDEX_NAME} ready in '{args.output}'.")
+    finish_metrics(args)